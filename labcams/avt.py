@@ -17,7 +17,6 @@
 from .cams import *
 from queue import Queue
 
-import copy
 # Allied Vision Technologies cameras
 try:
     import vmbpy
@@ -28,16 +27,19 @@ except:
 
 class FrameHandler():
     def __init__(self):
-        self.queue = Queue(100)
+        # frames are handed over without copying, the camera
+        # gets them back (queue_frame) once they are in the ring.
+        self.queue = Queue()
 
     def get(self):
         return self.queue.get(True,timeout = 0.01)
     
     def __call__(self,cam,stream,frame):
         if frame.get_status() == vmbpy.FrameStatus.Complete:
-            self.queue.put((copy.deepcopy(frame),
+            self.queue.put((frame,
                             int(cam.LineStatus.get())))
-        cam.queue_frame(frame)
+        else:
+            cam.queue_frame(frame)
                            
 def get_camera(camera_id):
     with vmbpy.VmbSystem.get_instance() as vmb:
@@ -113,7 +115,8 @@ class AVTCam(GenericCam):
                                     start_trigger = start_trigger,
                                     stop_trigger = stop_trigger,
                                     save_trigger = save_trigger,                
-                                    recorderpar = recorderpar)
+                                    recorderpar = recorderpar,
+                                    **kwargs)
         self.drivername = 'AVT'
         self.hardware_trigger = hardware_trigger
         if self.hardware_trigger is None:
@@ -136,6 +139,7 @@ Available serials are:
             raise(OSError(txt))
                 
         self.drv = None
+        self.n_frame_buffers = n_frame_buffers
         if not len(roi):
             roi = [None,None,None,None]
         #self.pxformat = pxformat
@@ -295,21 +299,25 @@ Available serials are:
     def _cam_startacquisition(self):
         self._t = time.time() 
         self.handler = FrameHandler()
-        self.cam.start_streaming(self.handler,10) 
+        # the frames stay with us until copied to the ring, so use enough buffers
+        self.cam.start_streaming(self.handler,self.n_frame_buffers) 
 
-    def _cam_loop(self):        
+    def _cam_loop_into(self,dest):        
         try:
             frame,status = self.handler.get()
         except Exception as err:
             return (None,(None,None,None))
-        
-        ff = frame.as_numpy_ndarray().squeeze()
+        ff = frame.as_numpy_ndarray()
+        self._frame_ready()
+        np.copyto(dest.reshape(ff.shape),ff)
         frameid = frame._frame.frameID
         timestamp = frame.get_timestamp()
-        return ff,(frameid,timestamp,status)
+        self.cam.queue_frame(frame)
+        return dest,(frameid,timestamp,status)
     
     def _cam_stopacquisition(self):
         self.cam.stop_streaming()
+        self.handler.queue.queue.clear() # the driver released the frames
         
     def _cam_close(self, do_stop = True):
         if not self.cam is None:
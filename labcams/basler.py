@@ -44,7 +44,8 @@ class BaslerCam(GenericCam):
                                        start_trigger = start_trigger,
                                        stop_trigger = stop_trigger,
                                        save_trigger = save_trigger,
-                                       recorderpar=recorderpar)
+                                       recorderpar=recorderpar,
+                                       **kwargs)
         self.drivername = 'Basler'
         if cam_id is None:
             display('[Basler] - Need to supply a camera ID.')
@@ -159,12 +160,16 @@ class BaslerCam(GenericCam):
         '''stop camera acq'''
         self.cam.StopGrabbing()
 
-    def _cam_loop(self):
+    def _cam_loop_into(self,dest):
         if self.cam.IsGrabbing():
             res = self.cam.RetrieveResult(int(self.cam.ExposureTime.Value*1.1),
                                           pylon.TimeoutHandling_ThrowException)
             if res.GrabSucceeded():
+                # copy to the ring before the result is released
                 frame = res.Array
+                self._frame_ready()
+                np.copyto(dest.reshape(frame.shape),frame)
+                frame = dest
                 frameID = res.GetImageNumber()
                 timestamp = res.GetTimeStamp()
                 linestat = self.cam.LineStatus()
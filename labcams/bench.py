@@ -0,0 +1,315 @@
+#  labcams - https://jpcouto@bitbucket.org/jpcouto/labcams.git
+# Copyright (C) 2020 Joao Couto - jpcouto@gmail.com
+#
+#  This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Acquisition and recording benchmark with the synthetic camera.
+#   labcams-bench -r binary tiff -s 480x640 1024x1280 -t uint8 uint16 -f 100 500 -d 10
+# Each run acquires for a fixed duration, waits for the recorder to finish and
+# reports the rates, lost frames, queue and writer lag, the grab to disk latency
+# and the CPU use as JSON.
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import platform
+from glob import glob
+from os.path import join as pjoin
+import numpy as np
+from .utils import display
+from .io import parseCamLog, VERSION
+
+# name: (recorder format, recorder method)
+BENCH_RECORDERS = {'tiff':('tiff','queue'),
+                   'binary':('binary','queue'),
+                   'hdf5':('hdf5','queue'),
+                   'ffmpeg':('ffmpeg','queue'),
+                   'tiff-inline':('tiff','noqueue'),
+                   'binary-inline':('binary','noqueue'),
+                   'ffmpeg-inline':('ffmpeg','noqueue')}
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def _cpu_time(pid):
+    '''CPU time (user + system) of a process in seconds, None if it can not be read.'''
+    if pid is None:
+        return None
+    if not psutil is None:
+        try:
+            t = psutil.Process(pid).cpu_times()
+            return t.user + t.system
+        except Exception:
+            return None
+    try:
+        with open('/proc/{0}/stat'.format(pid),'r') as fd:
+            fields = fd.read().rsplit(')',1)[1].split()
+        return (int(fields[11]) + int(fields[12]))/os.sysconf('SC_CLK_TCK')
+    except Exception:
+        return None
+
+def _percentiles(values, q = [50,90,99]):
+    if not len(values):
+        return None
+    res = dict([('p{0}'.format(p),float(np.percentile(values,p))) for p in q])
+    res['max'] = float(np.max(values))
+    return res
+
+def _wait_for_camlogs(folder, timeout, writer = None):
+    '''
+    Waits until the camlogs of a run are closed (the recorder writes "Wrote N frames"),
+    stops waiting if the writer process (or the camera process for inline recorders) exits.
+    '''
+    tstart = time.time()
+    while time.time() - tstart < timeout:
+        if hasattr(writer,'is_alive') and not writer.is_alive():
+            break
+        camlogs = glob(pjoin(folder,'**','*.camlog'),recursive = True)
+        if len(camlogs):
+            closed = []
+            for f in camlogs:
+                with open(f,'r',encoding = 'utf-8') as fd:
+                    closed.append('] - Wrote ' in fd.read())
+            if all(closed):
+                return camlogs
+        time.sleep(0.05)
+    return glob(pjoin(folder,'**','*.camlog'),recursive = True)
+
+def _process_error(name, process):
+    '''Error message if the process exited during the run, None if it is running.'''
+    if not hasattr(process,'is_alive') or process.is_alive():
+        return None
+    return 'The {0} process exited during the run (exit code {1}).'.format(name,process.exitcode)
+
+def _read_latency(folder):
+    '''Grab to disk latency (s) of the run from the .latency.json the recorder writes.'''
+    fnames = glob(pjoin(folder,'**','*.latency.json'),recursive = True)
+    if not len(fnames):
+        return None
+    with open(fnames[0],'r') as fd:
+        saved = json.load(fd)['intervals']['saved']
+    return dict([(k,saved[k]) for k in ['count','p50','p90','p99','max']])
+
+def run_benchmark(recorder = 'binary',
+                  height = 480,
+                  width = 640,
+                  nchannels = 1,
+                  dtype = 'uint8',
+                  frame_rate = 100.,
+                  duration = 5.,
+                  pattern = 'noise',
+                  datafolder = None,
+                  sample_period = 0.01,
+                  flush_timeout = 60.,
+                  camera_parameters = dict()):
+    '''
+    Records from a synthetic camera for some time and returns the results (dict).
+
+    Inputs:
+        recorder (str)          : one of BENCH_RECORDERS
+        height, width, nchannels, dtype : frame format
+        frame_rate (float)      : target frame rate (0 is as fast as possible)
+        duration (float)        : acquisition time (s)
+        datafolder (str)        : where to record (a temporary folder that is deleted if None)
+        camera_parameters (dict): other parameters for the Camera (e.g. ring_frames)
+    The grab to disk latency (write_latency_s) is measured with latency_stats.
+    '''
+    from .cams import Camera
+    fmt,method = BENCH_RECORDERS[recorder]
+    res = dict(recorder = recorder,
+               height = int(height),
+               width = int(width),
+               nchannels = int(nchannels),
+               dtype = str(dtype),
+               frame_rate = float(frame_rate),
+               duration = float(duration))
+    tmpfolder = None
+    if datafolder is None:
+        tmpfolder = tempfile.mkdtemp(prefix = 'labcams_bench_')
+        datafolder = tmpfolder
+    name = 'bench_{0}_{1}x{2}x{3}_{4}_{5}'.format(recorder,height,width,nchannels,dtype,
+                                                  int(frame_rate))
+    runfolder = pjoin(datafolder,name)
+    cam = None
+    try:
+        cam = Camera(0,'synthetic',name,
+                     frame_rate = frame_rate,
+                     height = height,
+                     width = width,
+                     nchannels = nchannels,
+                     dtype = dtype,
+                     pattern = pattern,
+                     recorder = dict(format = fmt,
+                                     recorder = fmt,
+                                     method = method,
+                                     framesperfile = 0),
+                     recorder_path = datafolder,
+                     recorder_path_format = pjoin('{datafolder}','{dataname}','{run}_{nfiles}'),
+                     **dict(dict(latency_stats = True),**camera_parameters))
+        cam.start()
+        cam.camera_ready.wait()
+        pids = dict(camera = cam.cam.pid,
+                    main = os.getpid())
+        if hasattr(cam.writer,'pid'):
+            pids['writer'] = cam.writer.pid
+        cam.set_saving(True)
+        cpu = dict([(k,_cpu_time(p)) for k,p in pids.items()])
+        queue,lag = [],[]
+        tstart = time.time()
+        cam.start_acquisition()
+        while time.time() - tstart < duration:
+            if not cam.writer is None and hasattr(cam.writer,'get_lag'):
+                queue.append(cam.writer.get_queue_size())
+                lag.append(cam.writer.get_lag()['seconds_behind'])
+            time.sleep(sample_period)
+        cam.stop_acquisition()
+        tacquired = time.time() - tstart
+        nacquired = int(cam.nframes.value)
+        writer_lag = cam.get_writer_lag()
+        cam.set_saving(False)
+        # inline recorders write from the camera process
+        camlogs = _wait_for_camlogs(runfolder,flush_timeout,
+                                    cam.cam if cam.writer is None else cam.writer)
+        twritten = time.time() - tstart
+        for k,p in pids.items():
+            t = _cpu_time(p)
+            cpu[k] = None if (t is None or cpu[k] is None) else 100.*(t - cpu[k])/twritten
+        frame_ids = []
+        overruns = 0
+        for f in camlogs:
+            try:
+                log,comments = parseCamLog(f)[:2]
+            except Exception as err: # no frames in the log
+                continue
+            frame_ids.append(log['frame_id'].values)
+            overruns += len([c for c in comments if c.startswith('#OVERRUN')])
+        for k,process in [('camera',cam.cam),('writer',cam.writer)]:
+            error = _process_error(k,process)
+            if not error is None:
+                display('[bench] {0}: {1}'.format(name,error))
+                res['error'] = error
+                break
+        frame_ids = np.unique(np.concatenate(frame_ids)) if len(frame_ids) else np.array([])
+        res.update(dict(frames_acquired = nacquired,
+                        frames_saved = int(len(frame_ids)),
+                        frames_lost = int(max(nacquired - len(frame_ids),0)),
+                        overruns = overruns,
+                        dropped = None if writer_lag is None else writer_lag['dropped'],
+                        acquisition_fps = nacquired/tacquired,
+                        recorded_fps = len(frame_ids)/twritten,
+                        flush_seconds = twritten - tacquired,
+                        queue_high_water = int(np.max(queue)) if len(queue) else None,
+                        writer_lag_s = _percentiles(lag), # sampled seconds behind the camera
+                        write_latency_s = _read_latency(runfolder), # grab to disk
+                        cpu_percent = cpu,
+                        trigger_latency_s = float(cam.get_trigger_latency())))
+    except Exception as err:
+        display('[bench] {0} failed: {1}'.format(name,err))
+        res['error'] = str(err)
+    finally:
+        if not cam is None:
+            try:
+                cam.close()
+            except Exception as err:
+                display('[bench] could not close {0}: {1}'.format(name,err))
+        if not tmpfolder is None:
+            shutil.rmtree(tmpfolder,ignore_errors = True)
+    return res
+
+def _parse_shape(shape):
+    # HxW or HxWxC
+    shape = [int(s) for s in shape.lower().split('x')]
+    if len(shape) == 2:
+        shape.append(1)
+    return shape
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description = 'labcams acquisition and recording benchmark (synthetic camera).')
+    parser.add_argument('-r','--recorders',
+                        type = str,
+                        nargs = '+',
+                        default = ['binary'],
+                        choices = list(BENCH_RECORDERS.keys()))
+    parser.add_argument('-s','--shapes',
+                        type = str,
+                        nargs = '+',
+                        default = ['480x640'],
+                        help = 'frame sizes HxW or HxWxC')
+    parser.add_argument('-t','--dtypes',
+                        type = str,
+                        nargs = '+',
+                        default = ['uint8'])
+    parser.add_argument('-f','--rates',
+                        type = float,
+                        nargs = '+',
+                        default = [100.],
+                        help = 'frame rates (0 runs as fast as possible)')
+    parser.add_argument('-d','--duration',
+                        type = float,
+                        default = 5.)
+    parser.add_argument('-p','--pattern',
+                        type = str,
+                        default = 'noise')
+    parser.add_argument('--datafolder',
+                        type = str,
+                        default = None,
+                        help = 'where to record (default is a temporary folder, deleted after each run)')
+    parser.add_argument('--ring-frames',
+                        type = int,
+                        default = None)
+    parser.add_argument('-o','--output',
+                        type = str,
+                        default = None,
+                        help = 'JSON file for the results (default prints them)')
+    opts = parser.parse_args()
+
+    camera_parameters = dict()
+    if not opts.ring_frames is None:
+        camera_parameters['ring_frames'] = opts.ring_frames
+    results = []
+    for recorder in opts.recorders:
+        for shape in opts.shapes:
+            for dtype in opts.dtypes:
+                for rate in opts.rates:
+                    h,w,c = _parse_shape(shape)
+                    results.append(run_benchmark(recorder = recorder,
+                                                 height = h,
+                                                 width = w,
+                                                 nchannels = c,
+                                                 dtype = dtype,
+                                                 frame_rate = rate,
+                                                 duration = opts.duration,
+                                                 pattern = opts.pattern,
+                                                 datafolder = opts.datafolder,
+                                                 camera_parameters = camera_parameters))
+    report = dict(labcams_version = VERSION,
+                  python = platform.python_version(),
+                  platform = platform.platform(),
+                  cpu_count = os.cpu_count(),
+                  date = time.strftime('%Y-%m-%d %H:%M:%S'),
+                  results = results)
+    if opts.output is None:
+        print(json.dumps(report,indent = 2))
+    else:
+        with open(opts.output,'w') as fd:
+            json.dump(report,fd,indent = 2)
+        display('[bench] Results in {0}'.format(opts.output))
+
+if __name__ == '__main__':
+    main()
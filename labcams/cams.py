@@ -18,12 +18,13 @@
 # Creates separate processes for acquisition and queues frames
 import time
 import sys
+import shutil
 from multiprocessing import set_start_method
 try:
     set_start_method("spawn")
 except:
     pass
-from multiprocessing import Process, Queue, Event, Array, Value, Lock
+from multiprocessing import Process, Queue, Event, Array, Value
 from multiprocessing.shared_memory import SharedMemory # this breaks compatibility with python < 3.8
 if (sys.maxsize > 2**32):
     BUFFER_SIZE = 1.5e9  # this is the buffer size allocation in shared memory
@@ -33,6 +34,8 @@ else:
 import numpy as np
 from datetime import datetime
 from .utils import *
+from .ringbuffer import FrameRing, IndexQueue, ring_nbytes
+from .stats import LatencyStats
 import ctypes
 
 import cv2
@@ -59,6 +62,13 @@ class GenericCam(Process):
                  save_trigger = None,
                  recorder_mode = 'shared_mem_queue', # 'shared_mem','queue','inline' 
                  membuffer_len = BUFFER_SIZE,
+                 ring_frames = None,
+                 ring_seconds = None,
+                 ring_prefault = False,
+                 latency_stats = False,
+                 latency_window = 10.,
+                 camera_affinity = None,
+                 camera_priority = None,
                  **kwargs):
         super(GenericCam,self).__init__()
         self.name = name
@@ -66,17 +76,23 @@ class GenericCam(Process):
             display('Need to supply a camera ID.')
         self.cam_id = cam_id
         self.cam = None
-        self.close_event = Event()
         self.start_trigger = start_trigger
         self.stop_trigger = stop_trigger
         self.save_trigger = save_trigger
         if self.start_trigger is None:
-            self.start_trigger = Event()
+            self.start_trigger = TriggerEvent()
+        # the triggers share a condition so the camera can wait on all of them
+        condition = getattr(self.start_trigger,'condition',None)
         if self.stop_trigger is None:
-            self.stop_trigger = Event()
+            self.stop_trigger = TriggerEvent(condition)
         if self.save_trigger is None:
-            self.save_trigger = Event()
-        self.nframes = Value('i',-1)
+            self.save_trigger = TriggerEvent(condition)
+        self.close_event = TriggerEvent(condition)
+        # time of the software trigger and delay to the first frame (s)
+        self.trigger_time = Value('d',np.nan,lock = False)
+        self.trigger_latency = Value('d',np.nan,lock = False)
+        self._first_frame = False
+        self.nframes = Value('i',-1,lock = False) # only the camera process writes
 
         self.h = Value('i',-1)
         self.w = Value('i',-1)
@@ -85,12 +101,21 @@ class GenericCam(Process):
         self.nbuffers = Value('i',0)
 
         self.queue = out_q
+        # control queue and index queue of each writer that reads the ring (see add_writer)
+        self.writer_queues = []
         self.camera_ready = Event()
         self.eventsQ = Queue(MAX_QUEUE_SIZE)
+        self.ncommands = Value('i',0) # commands put on the eventsQ
         self._init_controls()
-        self._init_ctrevents()
+        # the controls set from the GUI are applied between frames (see _update_controls)
+        self.parameters = ParameterBlock(getattr(self,'ctrevents',dict()).keys())
+        self._parameters_generation = 0
+        self._ncommands_done = 0
+        self._setters = dict()
         self.cam_is_running = False
         self.was_saving = False
+        self._ring_slot = None     # slot the driver grabs into (see _cam_loop_ring)
+        self._ring_writing = False
         self.recorderpar = recorderpar
         self.recorder = None
         self.refresh_period = refreshperiod
@@ -100,11 +125,18 @@ class GenericCam(Process):
         self.membuffer_name = '{0}_{1}_{2}'.format(int(np.random.rand()*1e9),
                                                    self.name,
                                                    self.cam_id)
-        self.membuffer = SharedMemory(name = self.membuffer_name,
-                                      create = True,
-                                      size = self.membuffer_len)
-        self.membuffer_lock = Lock()
-        # fixed size, independent of the framesize
+        # the shared memory is allocated in _init_variables, when the frame size is known
+        # the ring holds ring_frames or ring_seconds of data (membuffer_len if neither is set)
+        self.ring_frames = ring_frames
+        self.ring_seconds = ring_seconds
+        self.ring_prefault = ring_prefault
+        # per-stage frame latency (created with the ring, see stats.py)
+        self.latency_stats = latency_stats
+        self.latency_window = latency_window
+        self.stats = None
+        # CPUs and priority of the camera process (see set_process_priority)
+        self.camera_affinity = camera_affinity
+        self.camera_priority = camera_priority
         self.lasttime = 0
 
         if not self.recorderpar is None:
@@ -118,54 +150,91 @@ class GenericCam(Process):
     def _recorder_inline_init(self):
         if not self.recorderpar is None:
             extrapar = {}
-            if 'binary' in self.recorderpar['recorder'].lower():
+            recorder = self.recorderpar.get('recorder',self.recorderpar.get('format',''))
+            if 'binary' in recorder.lower():
                 from .io import BinaryCamWriter as rec
-            elif 'tiff' in self.recorderpar['recorder'].lower():
+            elif 'tiff' in recorder.lower():
                 from .io import TiffCamWriter as rec
-            elif 'ffmpeg' in self.recorderpar['recorder'].lower():
+            elif 'ffmpeg' in recorder.lower():
                 from .io import FFMPEGCamWriter as rec
                 if 'hwaccel' in self.recorderpar:
                     if 'hwaccel' in self.recorderpar.keys():
                         extrapar['hwaccel'] =  self.recorderpar['hwaccel']
                     if 'compression' in self.recorderpar.keys():                    
                         extrapar['compression'] = self.recorderpar['compression']
+                for k in ['encoder_affinity','encoder_priority']:
+                    if k in self.recorderpar.keys():
+                        extrapar[k] = self.recorderpar[k]
             else:                
-                display('Recorder {0} not implemented'.format(
-                    self.recorderpar['recorder']))
+                display('Recorder {0} not implemented'.format(recorder))
             if 'rec' in dir():
                 print(extrapar)
-                self.recorder = rec(self.cam,
+                # the recorder runs in this process and reads the camera variables
+                self.recorder = rec(self,
                                     filename = self.recorderpar['filename'],
                                     pathformat = self.recorderpar['pathformat'],
                                     dataname = self.recorderpar['dataname'],
                                     datafolder = self.recorderpar['datafolder'],
-                                    framesperfile = self.recorderpar['framesperfile'],
+                                    framesperfile = self.recorderpar.get('framesperfile',0),
                                     incrementruns = True,**extrapar)
 
     def _recorder_inline_handle(self,frame,metadata):
         if not self.recorder is None:
             self.recorder.save(frame, metadata)
+            if not self.stats is None:
+                self.stats.stamp(metadata[0],'write')
 
     def _recorder_queue_handle(self,frame,metadata):
         self.queue.put((frame, metadata))
 
     def _recorder_shared_mem_handle(self,frame,metadata):
-        self.queue.put((metadata[0], metadata))
+        # the writers read the frame and the metadata from the ring
+        if not self.stats is None:
+            self.stats.stamp(metadata[0],'queue') # before, the writer may take it right away
+        for queue,index_queue in self.writer_queues:
+            index_queue.put(metadata[0]) # a full queue drops the frame for that writer only
+
+    def _send_to_writers(self,msg):
+        # control messages go to every writer
+        if not len(self.writer_queues):
+            if not self.queue is None:
+                self.queue.put(msg)
+            return
+        for queue,index_queue in self.writer_queues:
+            # tagged with the frames queued so far, the writer saves those before handling it
+            queue.put(dict(msg = msg, frames = index_queue.head))
+
+    def add_writer(self):
+        '''
+        Creates the queues for one more writer of the ring, returns (control queue, index queue).
+        The first writer uses the out_q of the camera. Must be called before the camera starts.
+        '''
+        queue = self.queue
+        if queue is None or len(self.writer_queues):
+            queue = Queue(MAX_QUEUE_SIZE)
+        # tells the writer which ring slots to save
+        index_queue = IndexQueue(capacity = self.nbuffers.value)
+        self.writer_queues.append((queue,index_queue))
+        return queue,index_queue
 
     def _stop_recorder(self):
         if self.recorder is None:
             display('[Camera {0}] Sending stop signal to the recorder.'.format(self.cam_id))
-            self.queue.put(['STOP'])
+            self._send_to_writers(['STOP'])
         else:
             self.recorder.close_run()
 
     def get_img(self,frame_index = None):
-        # no lock needed when reading because it is in update buffer?
-        #self.membuffer_lock.acquire() 
+        # lock-free, returns a copy (the last good frame if the slot could not be read)
         if frame_index is None:
             frame_index = self.nframes.value
-        img = self.imgs[frame_index % self.nbuffers.value]
-        #self.membuffer_lock.release()
+        img = self.ring.read(frame_index)
+        if img is None:
+            img = getattr(self,'_last_img',None)
+            if img is None: # nothing read yet, use what is there
+                img = np.array(self.ring.imgs[self.ring.index(frame_index)])
+            return img.copy()
+        self._last_img = img
         return img
 
     def stop_saving(self):
@@ -176,27 +245,75 @@ class GenericCam(Process):
         return
 
     def _init_ctrevents(self):
+        # dispatch table of the controls: name -> (type, setter)
+        self._setters = dict()
         if hasattr(self,'ctrevents'):
             for c in self.ctrevents.keys():
-                self.ctrevents[c]['call'] ='self.'+self.ctrevents[c]['function']    
+                self._setters[c] = (PARAMETER_TYPES[self.ctrevents[c]['type']],
+                                    getattr(self,self.ctrevents[c]['function']))
+
+    def set_parameter(self,name,value):
+        '''Sets a control (see ctrevents), the camera process applies it before the next frame.'''
+        self.parameters.set(name,value)
+
+    def send_command(self,cmd):
+        '''Sends a command (filename=NAME or log=MESSAGE) to the camera process.'''
+        self.eventsQ.put(cmd)
+        with self.ncommands.get_lock():
+            self.ncommands.value += 1
+        self.parameters.touch()
     def _init_variables(self, dtype=np.uint8):
         try:
             dtype = dtype()
         except:
             pass
+        shape = [self.h.value,self.w.value,self.nchan.value]
         if not hasattr(self,'membuffer'):
-            self.membuffer = SharedMemory(name = self.membuffer_name)
-        buffsize = [self.h.value,self.w.value,self.nchan.value]
-        self.nbuffers.value = int(self.membuffer_len // np.prod(buffsize+[dtype.itemsize]))
-        display('[{0}] - using {1} buffers.'.format(self.name,self.nbuffers.value))
-        buffsize = [self.nbuffers.value] + buffsize
-        self.imgs = np.ndarray(buffsize,
-                               buffer = self.membuffer.buf,
-                               dtype = dtype)
+            self.membuffer_len = self._ring_nbytes(shape,dtype)
+            self.membuffer = SharedMemory(name = self.membuffer_name,
+                                          create = True,
+                                          size = self.membuffer_len)
+        self.ring = FrameRing(self.membuffer.buf,
+                              self.membuffer_len,
+                              shape,
+                              dtype)
+        self.nbuffers.value = self.ring.nbuffers
+        self.imgs = self.ring.imgs
+        if self.latency_stats and self.stats is None:
+            self.stats = LatencyStats(self.nbuffers.value,
+                                      window = self.latency_window)
+        display('[{0}] - using {1} buffers ({2:.1f} MB).'.format(self.name,
+                                                                self.nbuffers.value,
+                                                                self.membuffer_len/1e6))
+
+    def _ring_nbytes(self, shape, dtype):
+        '''
+        Size of the shared memory for ring_frames frames or ring_seconds
+        of data at the current frame rate; membuffer_len if neither is set.
+        '''
+        nframes = None
+        if not self.ring_frames is None:
+            nframes = int(self.ring_frames)
+        elif not self.ring_seconds is None:
+            if self.fs.value > 0:
+                nframes = int(np.ceil(float(self.ring_seconds)*self.fs.value))
+            else:
+                display('[{0}] - frame rate unknown, can not size the ring in seconds.'.format(
+                    self.name))
+        if nframes is None:
+            return self.membuffer_len
+        return ring_nbytes(max(nframes,2),shape,dtype)
         
     def run(self):
+        # before the driver starts its threads, so they inherit it
+        set_process_priority(self.camera_affinity,
+                             self.camera_priority,
+                             name = 'camera {0}'.format(self.name))
         self._init_ctrevents()
         self._init_variables(dtype = self.dtype)
+        if self.ring_prefault:
+            # only the camera process writes to the ring, map the pages for writing here
+            self.ring.prefault(write = True)
         self.close_event.clear()
         self._init_recorder()
         while not self.close_event.is_set():
@@ -208,9 +325,14 @@ class GenericCam(Process):
                 self._cam_startacquisition()
                 self.cam_is_running = True
             while not self.stop_trigger.is_set():
-                frame,metadata = self._cam_loop()
-                self._handle_frame(frame,metadata)
-                self._parse_command_queue()
+                if self._grabs_into_ring():
+                    frame,metadata = self._cam_loop_ring()
+                    self._handle_frame(frame,metadata,in_ring = True)
+                else:
+                    frame,metadata = self._cam_loop()
+                    self._handle_frame(frame,metadata)
+                if not self.parameters.generation == self._parameters_generation:
+                    self._update_controls()
                 # to be able to pause acquisition on software trigger
                 if not self.start_trigger.is_set() or self.stop_trigger.is_set():
                     self._cam_stopacquisition()
@@ -226,81 +348,90 @@ class GenericCam(Process):
             self.cam_is_running = False
             if self.was_saving:
                 self.was_saving = False
+                self.save_trigger.clear() # the writers do not clear it on a tagged STOP
                 self._stop_recorder()
             self.stop_trigger.clear()
             if self.close_event.is_set():
                 display('[{0} {1}] Camera received a close event'.format(
                     self.drivername,self.cam_id))
                 break
+        self.ring.close()
+        del self.imgs
         self.membuffer.close()
-        del self.membuffer_lock
+        if not self.stats is None:
+            self.stats.close()
              
-    def _handle_frame(self,frame,metadata):
+    def _handle_frame(self,frame,metadata,in_ring = False):
+        newframe = not frame is None and not metadata[0] == self.lastframeid
+        if newframe:
+            if not self.stats is None:
+                self.stats.begin(metadata[0]) # the driver just returned the frame
+            # the frame and metadata go to the ring before the recorder is told
+            if in_ring:
+                self.nframes.value = metadata[0]
+                self.lastframeid = int(metadata[0])
+            else:
+                self._update_buffer(frame,metadata)
+            if not self.stats is None:
+                self.stats.stamp(metadata[0],'ring')
+            self._tupdate = time.time()
+            self.lasttime = metadata[1]
         if self.save_trigger.is_set():
             self.was_saving = True
-            if not frame is None:
-                if not metadata[0] == self.lastframeid :
-                    self._handle_recorder(frame,metadata)
+            if newframe:
+                self._handle_recorder(frame,metadata)
         elif self.was_saving:
             self._stop_recorder()
             self.was_saving = False
-        if not frame is None:
-            frameID,timestamp = metadata[:2]
-            if not frameID == self.lastframeid:
-                t = time.time()
-                #if (t - self._tupdate) > self.refresh_period:
-                #update the buffer at every time.
-                self._update_buffer(frame,frameID)
-                self._tupdate = t
-                #self.nframes.value += 1
-                #display('loop rate : {0}'.format(1./(timestamp - self.lasttime)))
-                self.lasttime = timestamp
+        if newframe and self._first_frame:
+            self._log_trigger_latency(metadata[0])
         
-    def _update_buffer(self,frame,frameID):
+    def _update_buffer(self,frame,metadata):
         ''' Updates buffer for a specific frame ID'''
-        lock = self.membuffer_lock.acquire(timeout = 0.1)
-        if not lock:
-            display('Failed to secure lock')
-            return
-        idx = frameID % self.nbuffers.value
-        if len(frame.shape) == 2:
-            self.imgs[idx,:,:,0] = frame[:]
-        else:
-            self.imgs[idx] = frame[:]
-        self.nframes.value = frameID
-        self.lastframeid = int(frameID)
-        self.membuffer_lock.release()
-
-    def _parse_command_queue(self):
-        if not self.eventsQ.empty():
-            cmd = self.eventsQ.get()
-            if '=' in cmd:
-                cmd = cmd.split('=')
-                if hasattr(self,'ctrevents'):
-                    self._call_event(cmd[0],cmd[1])
-                if cmd[0] == 'filename':
-                    if not self.recorder is None:
-                        if hasattr(self,'recorder'):
-                            self.recorder.set_filename(cmd[1])
-                        else:
-                            self.recorderpar['filename'] = cmd[1]
-                elif cmd[0] == 'log':
-                    msg = '# {0},{1} - {2}'.format(
-                        self.nframes.value,
-                        self.lasttime,cmd[1])
-                    if self.recorder is None:
-                        self.queue.put([msg])
+        self.ring.write(frame,metadata)
+        self.nframes.value = metadata[0]
+        self.lastframeid = int(metadata[0])
+
+    def get_metadata(self,frame_index = None):
+        '''Metadata record (frame_id, timestamp, host_timestamp, linestat) of a frame in the ring.'''
+        if frame_index is None:
+            frame_index = self.nframes.value
+        return self.ring.read_metadata(frame_index)
+
+    def _update_controls(self):
+        '''Applies the controls that changed and runs the commands that were sent.'''
+        self._parameters_generation,changed = self.parameters.changed(
+            self._parameters_generation)
+        for name,value in changed:
+            self._call_event(name,value)
+        while self._ncommands_done < self.ncommands.value:
+            self._parse_command(self.eventsQ.get())
+            self._ncommands_done += 1
+
+    def _parse_command(self,cmd):
+        if '=' in cmd:
+            cmd = cmd.split('=')
+            self._call_event(cmd[0],cmd[1])
+            if cmd[0] == 'filename':
+                if not self.recorder is None:
+                    if hasattr(self,'recorder'):
+                        self.recorder.set_filename(cmd[1])
                     else:
-                        if not self.recorder.logfile is None:
-                            self.recorder.logfile.write(msg)
-                            
+                        self.recorderpar['filename'] = cmd[1]
+            elif cmd[0] == 'log':
+                msg = '# {0},{1} - {2}'.format(
+                    self.nframes.value,
+                    self.lasttime,cmd[1])
+                if self.recorder is None:
+                    self._send_to_writers([msg])
+                else:
+                    if not self.recorder.logfile is None:
+                        self.recorder.logfile.write(msg)
+
     def _call_event(self,eventname,eventvalue):
-        if eventname in self.ctrevents.keys():
-            val = eval(self.ctrevents[eventname]['type']+'('+str(eventvalue)+')')
-            eval(self.ctrevents[eventname]['call']+'(val)')
-            #print(self.ctrevents[eventname])
-#        else:
-#            display('No event found {0} {1}'.format(eventname,eventvalue))
+        if eventname in self._setters.keys():
+            vtype,setter = self._setters[eventname]
+            setter(vtype(float(eventvalue)))
 
     def _cam_init(self):
         '''initialize the camera'''
@@ -320,24 +451,97 @@ class GenericCam(Process):
 
     def _cam_loop(self):
         '''get a frame and move on, returns frame,(frameID,timestamp)'''
+        if self._grabs_into_ring():
+            # driver only knows how to grab into a buffer
+            return self._cam_loop_into(np.empty(self.ring.shape,dtype = self.ring.dtype))
+        
+    def _cam_loop_into(self,dest):
+        '''
+        Optional, grabs a frame directly into dest (a H,W,NCHANNELS view of the ring)
+        returns dest,(frameID,timestamp) or None,(None,None) if there was no frame.
+        Call self._frame_ready() when the frame arrived, before writing to dest.
+        Drivers implement either _cam_loop or _cam_loop_into.
+        '''
         pass
+
+    def _frame_ready(self):
+        '''Marks the ring slot as being written; the driver has a frame to copy to dest.'''
+        if self._ring_slot is None or self._ring_writing:
+            return
+        self.ring.begin_write(self.lastframeid + 1)
+        self._ring_writing = True
+
+    def _grabs_into_ring(self):
+        return not type(self)._cam_loop_into is GenericCam._cam_loop_into
+
+    def _cam_loop_ring(self):
+        '''Grabs into the slot of the next expected frame, avoids copying the frame to the ring.'''
+        # the slot (the oldest frame) is only marked as being written once the driver
+        # has a frame (_frame_ready), not while it waits, so readers can still take it
+        idx = self.ring.index(self.lastframeid + 1)
+        self._ring_slot = idx
+        self._ring_writing = False
+        try:
+            frame,metadata = self._cam_loop_into(self.ring.imgs[idx])
+        except:
+            if self._ring_writing:
+                self.ring.abort_write(idx)
+            raise
+        finally:
+            self._ring_slot = None
+        if frame is None or metadata[0] is None:
+            if self._ring_writing:
+                self.ring.abort_write(idx)
+            return None,metadata
+        if not self._ring_writing:
+            # the driver did not call _frame_ready, the frame is in the slot already
+            self.ring.begin_write(self.lastframeid + 1)
+        if metadata[0] == self.lastframeid + 1:
+            self.ring.end_write(idx,metadata)
+            return frame,metadata
+        # not the expected frame (dropped or repeated), move it to its own slot
+        self.ring.abort_write(idx)
+        if not metadata[0] == self.lastframeid:
+            self.ring.write(frame,metadata)
+        return frame,metadata
     
     def _cam_waitsoftwaretrigger(self):
         '''wait for software trigger'''
         self.lastframeid = -1
+        triggers = [self.start_trigger,self.stop_trigger,self.close_event,self.save_trigger]
         while (not self.start_trigger.is_set()):
-            # limits resolution to 1 ms 
-            time.sleep(0.001)
             if self.close_event.is_set() or self.stop_trigger.is_set():
                 break
             self._handle_frame(None,(None,None)) # to stop saving while waiting for triggers
+            # wakes up when any of the triggers is set or cleared
+            wait_any(triggers, timeout = 1)
         if self.close_event.is_set() or self.stop_trigger.is_set():
             return
+        self.trigger_time.value = getattr(self.start_trigger,'time_set',time.time())
+        self._first_frame = True
         self.camera_ready.clear()
         display('[{0} {1}] triggered acquisition.'.format(
             self.drivername,
             self.cam_id))
 
+    def _log_trigger_latency(self,frame_id):
+        # delay between the software trigger and the first frame in the ring
+        self._first_frame = False
+        first_frame_time = self.ring.meta[self.ring.index(frame_id)]['host_timestamp']
+        self.trigger_latency.value = first_frame_time - self.trigger_time.value
+        display('[{0} {1}] first frame {2:.1f} ms after the trigger.'.format(
+            self.drivername,
+            self.cam_id,
+            self.trigger_latency.value*1000))
+        if self.save_trigger.is_set():
+            msg = '#TRIGGER:{0},{1},{2}'.format(frame_id,
+                                                self.trigger_time.value,
+                                                first_frame_time)
+            if self.recorder is None:
+                self._send_to_writers([msg])
+            elif not self.recorder.logfile is None:
+                self.recorder.logfile.write(msg + '\n')
+
     def stop_acquisition(self):
         self.start_trigger.clear()
 
@@ -345,8 +549,15 @@ class GenericCam(Process):
         self.close_event.set()
         self.stop_trigger.set()
         self.stop_acquisition()
-        self.membuffer.close()
-        self.membuffer.unlink()
+        if hasattr(self,'membuffer'):
+            self.membuffer.close()
+            self.membuffer.unlink()
+        for queue,index_queue in self.writer_queues:
+            index_queue.close()
+            if not queue is self.queue:
+                queue.close()
+        if not self.stats is None:
+            self.stats.close()
         if not self.eventsQ:
              self.eventsQ.close()
         if not self.queue is None:
@@ -371,7 +582,8 @@ class OpenCVCam(GenericCam):
                                        start_trigger = start_trigger,
                                        stop_trigger = stop_trigger,
                                        save_trigger = save_trigger,
-                                       recorderpar = recorderpar)
+                                       recorderpar = recorderpar,
+                                       **kwargs)
         self.drivername = 'openCV'
         self.frame_rate = float(frame_rate)
         self.fs.value = self.frame_rate
@@ -409,17 +621,13 @@ class OpenCVCam(GenericCam):
                 res = self.cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.25)
                 res = self.cam.set(cv2.CAP_PROP_EXPOSURE,1./self.frame_rate)
                 res = self.cam.set(cv2.CAP_PROP_FPS,self.frame_rate)
+                self.fs.value = self.frame_rate
             else:
                 display('[OpenCV] Setting auto exposure.')
                 res = self.cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.75)
                 self.cam.set(cv2.CAP_PROP_EXPOSURE, 100) 
                 self.fs.value = self.frame_rate
-
-            if self.cam_is_running:
-                self.stop_trigger.set()
-                time.sleep()
-                self.start_trigger.set()
-
+            # applied on the open capture, between frames
             display('[OpenCV {0}] Set frame_rate to: {1}.'.format(self.cam_id,
                                                                   self.frame_rate))
             
@@ -437,16 +645,20 @@ class OpenCVCam(GenericCam):
     def _cam_stopacquisition(self):
         self.cam.release() 
         
-    def _cam_loop(self):
+    def _cam_loop_into(self,dest):
         frameID = self.nframes.value + 1
         #self.nframes.value = frameID  
 
         ret_val, frame = self.cam.read()
         if not ret_val:
-            return
+            return None,(None,None)
         timestamp = time.time()
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        return frame,(frameID,timestamp)
+        self._frame_ready()
+        if len(frame.shape) == 3:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst = dest) # color conversion writes to the ring
+        else:
+            np.copyto(dest.reshape(frame.shape),frame)
+        return dest,(frameID,timestamp)
 
     def _cam_close(self):
         self.cam.release()
@@ -478,11 +690,12 @@ class Camera(object):
         self.stop_trigger = stop_trigger
         self.save_trigger = save_trigger
         if self.start_trigger is None:
-            self.start_trigger = Event()
+            self.start_trigger = TriggerEvent()
+        condition = getattr(self.start_trigger,'condition',None)
         if self.stop_trigger is None:
-            self.stop_trigger = Event()
+            self.stop_trigger = TriggerEvent(condition)
         if self.save_trigger is None:
-            self.save_trigger = Event()
+            self.save_trigger = TriggerEvent(condition)
 
         self.hardware_trigger_event = hardware_trigger_event
         if self.hardware_trigger_event is None: # to control the hardware triggering of the cameras
@@ -494,21 +707,35 @@ class Camera(object):
         self.camera_description = self.name
                     
         self.recorder_q = Queue(MAX_QUEUE_SIZE) # queue to talk to the recorder.
-        # recorder options
-        self.recorder_parameters = recorder
-        if not 'datafolder' in recorder.keys():
-            self.recorder_parameters['datafolder'] = self.recorder_path 
-        if not 'pathformat' in recorder.keys():
-            self.recorder_parameters['pathformat'] = self.recorder_path_format 
-        if not 'filename'  in recorder.keys():
-            self.recorder_parameters['filename'] = self.filename
-        if not 'dataname'  in recorder.keys():
-            self.recorder_parameters['dataname'] = self.camera_description
-        if not 'method' in recorder.keys():
-            self.recorder_parameters['method'] = 'queue'
-        if not 'format' in recorder.keys():
-            self.recorder_parameters['format'] = 'tiff'
-        if 'noqueue' in recorder['method']:
+        # recorder options, a list of recorders all write from the same ring
+        if isinstance(recorder,dict):
+            recorder = [recorder]
+        self.recorders_parameters = []
+        for i,rec in enumerate(recorder):
+            rec = dict(rec)
+            if not 'datafolder' in rec.keys():
+                rec['datafolder'] = self.recorder_path 
+            if not 'pathformat' in rec.keys():
+                rec['pathformat'] = self.recorder_path_format 
+            if not 'filename'  in rec.keys():
+                rec['filename'] = self.filename
+            if not 'dataname'  in rec.keys():
+                rec['dataname'] = self.camera_description
+                if i > 0: # so the files and logs of the recorders don't collide
+                    rec['dataname'] += '_' + rec.get('name',rec.get('format','tiff'))
+            if not 'method' in rec.keys():
+                rec['method'] = 'queue'
+            if not 'format' in rec.keys():
+                rec['format'] = 'tiff'
+            self.recorders_parameters.append(rec)
+        self.recorder_parameters = self.recorders_parameters[0]
+        # CPUs and priority of the writer process and of the encoders it starts
+        for k in ['writer_affinity','writer_priority','encoder_affinity','encoder_priority']:
+            if k in kwargs.keys():
+                value = kwargs.pop(k)
+                for rec in self.recorders_parameters:
+                    rec[k] = value
+        if 'noqueue' in self.recorder_parameters['method']:
             recorderpar = self.recorder_parameters
         else:
             recorderpar = None # Use a queue recorder
@@ -550,6 +777,14 @@ class Camera(object):
             self._init_ximea_cam(params)
         elif self.driver.lower() in ['pointgrey','flir']:
             self._init_pointgrey_cam(params)
+        elif self.driver.lower() == 'synthetic':
+            from .synthetic import SyntheticCam
+            self.cam = SyntheticCam(cam_id = self.cam_id,
+                                    start_trigger = self.start_trigger,
+                                    stop_trigger = self.stop_trigger,
+                                    save_trigger = self.save_trigger,
+                                    out_q = self.recorder_q,
+                                    **params)
         elif self.driver.lower() in ['nidaq']:
             params['recorderpar'] = self.recorder_parameters
             self._init_nidaq_cam(params)
@@ -561,80 +796,199 @@ class Camera(object):
                              self.driver))
         self.cam.name = self.name
         self.camera_ready = self.cam.camera_ready
-        self.writer = None
+        self.writers = []
         if recorderpar is None:
-            if self.recorder_parameters['format'] == 'tiff':
-                display('Recording to TIFF.')
-                from .io import TiffWriter
-                self.writer = TiffWriter(cam = self.cam, **self.recorder_parameters)
-            elif self.recorder_parameters['format'] == 'ffmpeg':
-                display('Recording with FFMPEG.')
-                from .io import FFMPEGWriter
-                self.writer = FFMPEGWriter(cam = self.cam, **self.recorder_parameters)
-            elif self.recorder_parameters['format'] == 'binary':
-                from .io import BinaryWriter
-                vchans = None
+            for rec in self.recorders_parameters:
+                writer = self._init_writer(rec)
+                if not writer is None:
+                    self.writers.append(writer)
+        elif len(self.recorders_parameters) > 1:
+            display('[WARNING] Only one recorder with method noqueue, ignoring the others.')
+        self.writer = self.writers[0] if len(self.writers) else None
+        self.stop_saving = self.cam.stop_saving
+        self.stop_acquisition = self.cam.stop_acquisition
+        if hasattr(self.cam,'get_img'):     
+            self.get_img = self.cam.get_img
+        if hasattr(self.cam,'get_metadata'):
+            self.get_metadata = self.cam.get_metadata
+        if hasattr(self.cam,'nframes'):
+            self.nframes = self.cam.nframes
+        self.stats = getattr(self.cam,'stats',None) # per-stage latency (latency_stats)
+        for writer in self.writers:
+            if hasattr(writer,'virtual_channels'):    # set the number of channels from the excitation
                 if hasattr(self,'excitation_trigger'):
-                    vchans = self.excitation_trigger.nchannels
-                display('Recording in binary format.')
-                self.writer = BinaryWriter(cam = self.cam,
-                                           virtual_channels = vchans,
-                                           **self.recorder_parameters)
-            elif self.recorder_parameters['format'] == 'opencv':
-                from .io import OpenCVWriter
-                display('Recording with OpenCV.')
-                self.writer = OpenCVWriter(cam = self.cam,
-                                           **self.recorder_parameters)
-            elif self.recorder_parameters['format'] == 'daq':
-                self.writer = None
-            else:
-                    print(''' 
+                    writer.virtual_channels.value = self.excitation_trigger.nchannels.value
+
+    def _init_writer(self,recorder_parameters):
+        '''Starts a writer that reads from the camera ring (each has its own queues).'''
+        writer = None
+        if recorder_parameters['format'] == 'tiff':
+            display('Recording to TIFF.')
+            from .io import TiffWriter
+            writer = TiffWriter(cam = self.cam, **recorder_parameters)
+        elif recorder_parameters['format'] == 'ffmpeg':
+            display('Recording with FFMPEG.')
+            from .io import FFMPEGWriter
+            writer = FFMPEGWriter(cam = self.cam, **recorder_parameters)
+        elif recorder_parameters['format'] == 'binary':
+            from .io import BinaryWriter
+            vchans = None
+            if hasattr(self,'excitation_trigger'):
+                vchans = self.excitation_trigger.nchannels
+            display('Recording in binary format.')
+            writer = BinaryWriter(cam = self.cam,
+                                  virtual_channels = vchans,
+                                  **recorder_parameters)
+        elif recorder_parameters['format'] in ['hdf5','h5']:
+            from .io import HDF5Writer
+            display('Recording to HDF5.')
+            writer = HDF5Writer(cam = self.cam,
+                                **recorder_parameters)
+        elif recorder_parameters['format'] == 'opencv':
+            from .io import OpenCVWriter
+            display('Recording with OpenCV.')
+            writer = OpenCVWriter(cam = self.cam,
+                                  **recorder_parameters)
+        elif recorder_parameters['format'] == 'daq':
+            writer = None
+        else:
+            print(''' 
 
 The available recorders are:
     - tiff (multiple tiffstacks - the default)   
     - binary 
+    - hdf5    Chunked HDF5 with lossless Blosc compression (needs h5py and hdf5plugin)
     - ffmpeg  Records video format using ffmpeg (hwaccel options: intel, nvidia - remove for no hardware acceleration)
     - opencv  Records video format using openCV
 
 The recorders can be specified with the '"format":"ffmpeg"' option in each camera "recorder" setting of the config file.
 ''')
-                    raise ValueError('Unknown recorder {0} '.format(self.recorder_parameters['format']))
-        self.stop_saving = self.cam.stop_saving
-        self.stop_acquisition = self.cam.stop_acquisition
-        if hasattr(self.cam,'get_img'):     
-            self.get_img = self.cam.get_img
-        if hasattr(self.cam,'nframes'):
-            self.nframes = self.cam.nframes
-        if hasattr(self.writer,'virtual_channels'):    # set the number of channels from the excitation
-            if hasattr(self,'excitation_trigger'):
-                self.writer.virtual_channels.value = self.excitation_trigger.nchannels.value
+            raise ValueError('Unknown recorder {0} '.format(recorder_parameters['format']))
+        return writer
 
     def get_img_with_virtual_channels(self,frame_index = None):
         if hasattr(self,'excitation_trigger'):
             vchans = self.excitation_trigger.nchannels.value
         else:
             vchans = 1
-        lock = self.cam.membuffer_lock.acquire(timeout = 0.1)
         if frame_index is None:
             frame_index = int(np.floor(self.cam.nframes.value/vchans)*vchans)
         imgs = []
         for i in np.arange(vchans)[::-1]:
-            imgs.append(self.cam.imgs[
-                np.mod(frame_index-i,
-                       self.cam.nbuffers.value)].squeeze())
+            img = self.cam.ring.read(frame_index-i)
+            if img is None: # the camera kept writing to the slot, use what is there
+                img = np.array(self.cam.imgs[self.cam.ring.index(frame_index-i)])
+            imgs.append(img.squeeze())
         if vchans > 1:
             img = np.stack(imgs).transpose(1,2,0)
         else:
             img = imgs[0]
-        if lock:
-            self.cam.membuffer_lock.release()
         return img
 
+    def get_writer_lag(self):
+        '''
+        How far behind the writers are (dict), None if not recording through the ring.
+        With more than one writer: the slowest one and the overruns and drops of all.
+        '''
+        lags = [w.get_lag() for w in self.writers if hasattr(w,'get_lag')]
+        if not len(lags):
+            return None
+        lag = dict(lags[0])
+        for l in lags[1:]:
+            for k in ['frames_behind','seconds_behind']:
+                lag[k] = max(lag[k],l[k])
+            for k in ['overruns','dropped']:
+                lag[k] += l[k]
+        return lag
+
+    def get_latency(self, rolling = True):
+        '''
+        Per-stage latency percentiles (s) of the last latency_window seconds
+        (or of the current run), None if latency_stats is off.
+        '''
+        if self.stats is None:
+            return None
+        return self.stats.summary(rolling = rolling)
+
+    def get_stats(self):
+        '''
+        Acquisition and recording counters of the camera (dict), for monitoring:
+            frames_acquired, acquisition_fps    : camera frames and rate
+            frames_written, writer_fps          : frames the writer saved and rate (None without writer process)
+            bytes_written                       : bytes of the frames handed to the writer
+            write_seconds                       : time the writer spent in blocking writes to disk
+            ring_frames, ring_occupancy         : ring size and fraction waiting for the writer
+            queue_depth, dropped, overruns      : writer queue, frames not queued and frames overwritten
+            disk_free                           : bytes free on the recorder disk
+        Rates are computed between calls (at most every half second).
+        '''
+        tnow = time.time()
+        nframes = int(self.cam.nframes.value) if hasattr(self.cam,'nframes') else None
+        nwritten = None
+        writers = [w for w in self.writers if hasattr(w,'frames_written')]
+        if len(writers): # the slowest writer
+            nwritten = min([int(w.frames_written.value) for w in writers])
+        if not hasattr(self,'_stats_last'):
+            self._stats_last = (tnow,nframes,nwritten,None,None)
+        tlast,nlast,wlast,fps,wfps = self._stats_last
+        if tnow - tlast >= 0.5:
+            if not nframes is None and not nlast is None:
+                fps = max(nframes - nlast,0)/(tnow - tlast)
+            if not nwritten is None and not wlast is None:
+                wfps = (nwritten - wlast)/(tnow - tlast)
+            self._stats_last = (tnow,nframes,nwritten,fps,wfps)
+        nbuffers = self.cam.nbuffers.value if hasattr(self.cam,'nbuffers') else 0
+        lag = self.get_writer_lag()
+        res = dict(camera = self.name,
+                   saving = self.save_trigger.is_set(),
+                   frames_acquired = nframes,
+                   acquisition_fps = fps,
+                   frames_written = nwritten,
+                   writer_fps = wfps,
+                   bytes_written = None,
+                   write_seconds = None,
+                   ring_frames = nbuffers,
+                   ring_occupancy = None,
+                   queue_depth = None,
+                   dropped = None,
+                   overruns = None,
+                   disk_free = None)
+        if len(writers):
+            res['bytes_written'] = sum([int(w.bytes_written.value) for w in writers])
+            res['write_seconds'] = sum([w.write_seconds.value for w in writers])
+            res['queue_depth'] = max([w.get_queue_size() for w in writers])
+        if len(writers) > 1:
+            res['writers'] = [dict(dataname = w.dataname,
+                                   frames_written = int(w.frames_written.value),
+                                   bytes_written = int(w.bytes_written.value),
+                                   write_seconds = w.write_seconds.value,
+                                   queue_depth = w.get_queue_size())
+                              for w in writers]
+        if not lag is None:
+            if nbuffers > 0:
+                res['ring_occupancy'] = min(max(lag['frames_behind'],0)/nbuffers,1.)
+            res['dropped'] = lag['dropped']
+            res['overruns'] = lag['overruns']
+        folder = self.recorder_parameters['datafolder']
+        while not os.path.isdir(folder) and not os.path.dirname(folder) == folder:
+            folder = os.path.dirname(folder) # the data folder may not exist yet
+        try:
+            res['disk_free'] = shutil.disk_usage(folder).free
+        except OSError:
+            pass
+        return res
+
+    def get_trigger_latency(self):
+        '''Seconds from the last software trigger to the first frame (nan if not known).'''
+        if hasattr(self.cam,'trigger_latency'):
+            return self.cam.trigger_latency.value
+        return np.nan
+
     def set_saving(self,value):
         if value:
-            if not self.writer is None:
-                self.writer.init_cam(self.cam)
-                self.writer.write_event.set()
+            for writer in self.writers:
+                writer.init_cam(self.cam)
+                writer.write_event.set()
             self.cam.save_trigger.set()
         else:
             self.stop_saving()
@@ -657,22 +1011,22 @@ The recorders can be specified with the '"format":"ffmpeg"' option in each camer
         if hasattr(self,'excitation_trigger'):
             self.excitation_trigger.start()
             self.excitation_trigger.disarm()
-        if hasattr(self,'writer'):
-            if not self.writer is None:
-                self.writer.start()
+        for writer in self.writers:
+            writer.start()
         if hasattr(self,'cam'):
             self.cam.start()
         if hasattr(self,'excitation_trigger'):
             self.excitation_trigger.arm()
 
     def set_filename(self,name):
-        if not self.writer is None:
-            self.writer.set_filename(name)
+        if len(self.writers):
+            for writer in self.writers:
+                writer.set_filename(name)
         elif self.driver.lower() == 'nidaq':
             self.cam.recorder.set_filename(name)
         else:
             display('[Camera] Setting serial recorder filename.')
-            self.cam.eventsQ.put('filename='+name)
+            self.cam.send_command('filename='+name)
 
         
     def _init_pco_cam(self,parameters):
@@ -885,16 +1239,16 @@ Please install nidaqmx using pip and NIDAQmx from the National Instruments websi
         self.stop_acquisition()
         self.cam.close()
         self.cam.stop_saving()
-        if not self.writer is None:
-            self.writer.stop()
+        for writer in self.writers:
+            writer.stop()
         if hasattr(self,'excitation_trigger'):
             self.excitation_trigger.close()
         display('Waiting for the camera process to close.')
         self.cam.join()
-        if not self.writer is None:
+        for writer in self.writers:
             display('Waiting for the writer process to close.')
-            self.writer.join()
-            display(f'Writer {self.name} closed.')
+            writer.join()
+            display(f'Writer {writer.dataname} closed.')
         display(f'Camera {self.name} closed.')
         
         
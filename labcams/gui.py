@@ -116,12 +116,28 @@ class LabCamsGUI(QMainWindow):
                                                             '{filename}',
                                                             '{today}_{run}_{nfiles}')
         if not 'recorder_path' in self.parameters.keys():
-            self.parameters['recorder_path'] = pjoin(os.path.expanduser('~'),'data'),
+            self.parameters['recorder_path'] = pjoin(os.path.expanduser('~'),'data')
 
         if not 'recorder_frames_per_file' in self.parameters.keys():
             self.parameters['recorder_frames_per_file'] = 0
 
         camdrivers = [cam['driver'].lower() for cam in camDescriptions]
+        # keep the camera processes and the writers on separate cores ("cpu_placement":"auto")
+        placement = None
+        if self.parameters.get('cpu_placement','none') == 'auto':
+            ncams = len([d for d in camdrivers if not d == 'nidaq'])
+            placement = default_cpu_placement(ncams)
+            if placement is None:
+                display('[cpu placement] Not enough cores to keep {0} cameras apart from the writers, not pinning.'.format(ncams))
+        icam = 0
+        for cam in self.cam_descriptions:
+            if placement is None or cam['driver'].lower() == 'nidaq':
+                continue
+            if not 'camera_affinity' in cam.keys() and not 'writer_affinity' in cam.keys():
+                cam['camera_affinity'],cam['writer_affinity'] = placement[icam]
+                display('[cpu placement] {0}: camera on CPUs {1}, writer on CPUs {2}.'.format(
+                    cam['name'],cam['camera_affinity'],cam['writer_affinity']))
+            icam += 1
         self.camQueues = []
         self.saveflags = []
         for c,cam in enumerate(self.cam_descriptions):
@@ -162,6 +178,15 @@ class LabCamsGUI(QMainWindow):
         self.initUI()
         
         self.camerasRunning = False
+        # Prometheus text file with the camera stats (for node_exporter or other scrapers)
+        self.metrics_file = self.parameters.get('metrics_file',None)
+        if self.metrics_file is True:
+            self.metrics_file = pjoin(self.parameters['recorder_path'],'labcams.prom')
+        if self.metrics_file:
+            self.metrics_timer = QTimer()
+            self.metrics_timer.timeout.connect(self.write_metrics)
+            self.metrics_timer.start(int(1000*self.parameters.get('metrics_period',5)))
+            display('Writing metrics to {0}'.format(self.metrics_file))
         
         for cam in self.cams[::-1]:
             cam.start()
@@ -197,10 +222,24 @@ class LabCamsGUI(QMainWindow):
             self.zmqsocket.send_pyobj(dict(action=msgtype,
                                            value = msg))
         if not self.udpsocket is None and not address is None:
+            if not type(msg) is str:
+                msg = json.dumps(msg)
             self.udpsocket.sendto('{0}={1}'.format(msgtype,msg).encode(),address)
+
+    def get_stats(self):
+        '''Stats of all cameras (see Camera.get_stats).'''
+        return [cam.get_stats() for cam in self.cams]
+
+    def write_metrics(self):
+        try:
+            write_metrics_file(self.metrics_file,prometheus_metrics(self.get_stats()))
+        except Exception as err:
+            display('Could not write the metrics file {0}: {1}'.format(self.metrics_file,err))
                 
     def server_actions(self): # all this should be moved to a class somewhere else.
+        address = None # only UDP replies to an address
         if not self.zmqsocket is None:
+            import zmq
             try:
                 message = self.zmqsocket.recv_pyobj(flags=zmq.NOBLOCK)
             except:
@@ -232,7 +271,7 @@ class LabCamsGUI(QMainWindow):
             self.server_reply(msg = 'save',address = address) 
         elif message['action'].lower() == 'log':
             for c in self.cams:
-                c.cam.eventsQ.put('log={0}'.format(message['value']))
+                c.cam.send_command('log={0}'.format(message['value']))
             self.recController.udpmessages.setText(message['value'])
             self.server_reply(msg = 'log',address = address) 
         elif message['action'].lower() == 'snapshot':
@@ -287,6 +326,9 @@ class LabCamsGUI(QMainWindow):
             for icam,cam in enumerate(self.cams):
                 self.camwidgets[icam].toggle_reference(filename = '')
             self.server_reply(msg = 'hide_reference',address = address) 
+        elif message['action'].lower() == 'stats':
+            # per camera rates, queue, ring and disk (JSON over UDP)
+            self.server_reply(msg = self.get_stats(),msgtype = 'stats',address = address)
         elif message['action'].lower() == 'ping':
             display('Server got PING.')
             self.server_reply(msg = 'pong',address = address) 
@@ -308,6 +350,27 @@ class LabCamsGUI(QMainWindow):
             if res[1]:
                 self.update_frequency = res[0]
             self.timer.start(self.update_frequency)
+        elif q.text() == 'Frame latency':
+            self.latency_window()
+
+    def latency_window(self):
+        if not any([not getattr(c,'stats',None) is None for c in self.cams]):
+            display('Set "latency_stats":true in the camera settings to measure the frame latency.')
+            return
+        if hasattr(self,'latency_tab'):
+            self.latency_tab.show()
+            return
+        self.latency_tab = QDockWidget("Frame latency",self)
+        self.latency_tab.setObjectName("frame_latency")
+        self.latency_tab.setWidget(LatencyWidget(self.cams))
+        self.latency_tab.setAllowedAreas(Qt.LeftDockWidgetArea |
+                                         Qt.RightDockWidgetArea |
+                                         Qt.BottomDockWidgetArea |
+                                         Qt.TopDockWidgetArea)
+        self.addDockWidget(Qt.BottomDockWidgetArea,
+                           self.latency_tab)
+        self.latency_tab.setFloating(True)
+        self.latency_tab.resize(600,300)
         
     def initUI(self):
         # Menu
@@ -324,6 +387,7 @@ class LabCamsGUI(QMainWindow):
         toggle_downsample.link(tdownsample)
         editmenu.addAction(toggle_downsample)
         editmenu.addAction("Set refresh time")
+        editmenu.addAction("Frame latency")
         editmenu.triggered[QAction].connect(self.experiment_menu_trigger)
         pluginmenu = bar.addMenu("Plugins")
         from .plugins import load_plugins
@@ -418,6 +482,8 @@ class LabCamsGUI(QMainWindow):
                 self.udpsocket.close()
         self.timer.stop()
         self.plugin_timer.stop()
+        if hasattr(self,'metrics_timer'):
+            self.metrics_timer.stop()
 
         display('Acquisition stopped (close event).')
         for cam in self.cams:
@@ -26,9 +26,19 @@ from datetime import datetime
 import time
 import sys
 from .utils import display,shared_date
+from .ringbuffer import (FrameRing, FRAME_METADATA_DTYPE, metadata_record, driver_timestamp,
+                         TIMESTAMP_FLOAT, TIMESTAMP_INT, TIMESTAMP_NONE)
 import numpy as np
 import os
-from glob import glob
+import mmap
+import zlib
+import threading
+from queue import Queue as ThreadQueue
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob, escape as glob_escape
+import operator
+from collections import OrderedDict
+from io import BytesIO
 from os.path import join as pjoin
 from tifffile import imread, TiffFile
 from tifffile import TiffWriter as twriter
@@ -52,10 +62,22 @@ class GenericWriter(object):
                  sleeptime = 1./30,
                  virtual_channels = None,
                  incrementruns=True,
+                 encoder_affinity = None,
+                 encoder_priority = None,
+                 async_write = 0,
+                 camlog_format = 'text',
                  **kwargs):
         if not hasattr(self,'extension'):
             self.extension = '.nan'
         self.cam = None
+        # number of staging buffers of the I/O thread (0 writes on the calling thread)
+        self.async_write = async_write
+        self._io_thread = None
+        # seconds spent in blocking writes to disk
+        self.write_seconds = Value('d',0,lock = False)
+        # CPUs and priority of encoder processes (ffmpeg)
+        self.encoder_affinity = encoder_affinity
+        self.encoder_priority = encoder_priority
         self.saved_frame_count = 0
         self.runs = 0
         self.write_event = False
@@ -72,6 +94,14 @@ class GenericWriter(object):
         self.today = datetime.today().strftime('%Y%m%d')
         self.nchannels = Value('i',1)
         self.logfile = None
+        self.logfilename = None
+        self.frameindex = None # sidecar frame index of the run (FrameIndexWriter)
+        self._stopped = False  # a tagged STOP was handled, what is left on the queues is for the next run
+        # 'binary' logs the frames in fixed records (CAMLOG_DTYPE) and keeps the comments in the camlog
+        self.camlog_format = camlog_format
+        self.camlogbin = None
+        self.file_frames = 0   # frames in the current file
+        self.stats = None
         self.nFiles = 0
         runname = 'run{0:03d}'.format(self.runs)
         self.virtual_channels = virtual_channels
@@ -99,6 +129,8 @@ class GenericWriter(object):
         if self.framesperfile > 0:
             if not '{nfiles}' in self.path_format:
                 self.path_format += '_{nfiles}'
+        self.inQ = None
+        self.frameQ = None
         if not cam is None:
             self.init_cam(cam)
             
@@ -108,15 +140,28 @@ class GenericWriter(object):
             return
         self.frame_rate = None
         if self.cam is None:
+            queue,index_queue = cam.queue,None
+            stats = getattr(cam,'stats',None)
+            if hasattr(cam,'add_writer'):
+                # each writer of the ring has its own queues
+                queue,index_queue = cam.add_writer()
+                if len(cam.writer_queues) > 1:
+                    stats = None # the latency is measured on the first writer
             self.cam = dict(buffer_name = cam.membuffer_name,
                             buffer_len = cam.membuffer_len,
-                            queue = cam.queue,
+                            ring_prefault = getattr(cam,'ring_prefault',False),
+                            queue = queue,
+                            index_queue = index_queue,
+                            stats = stats,
+                            nframes = cam.nframes,
                             dtype = cam.dtype,
                             h = cam.h,
                             w = cam.w,
                             nchannels = cam.nchan,
                             frame_rate = cam.fs)
-            self.inQ = self.cam['queue']
+            self.inQ = self.cam['queue']  # control messages (and frames in queue mode)
+            self.frameQ = self.cam['index_queue']  # frames in the shared memory ring
+            self.stats = self.cam['stats']  # per-stage latency, None if not measured
         if hasattr(cam,'frame_rate'):
             self.frame_rate = cam.fs.value
         self.nchannels = self.cam['nchannels']
@@ -178,6 +223,9 @@ class GenericWriter(object):
         self.nFiles += 1
         if hasattr(self,'parsed_filename'):
             filename = self.parsed_filename
+        self.file_frames = 0
+        if not self.frameindex is None:
+            self.frameindex.add_file(filename)
         display('Opened: '+ filename)        
         self.logfile.write('# [' + datetime.today().strftime('%y-%m-%d %H:%M:%S')+'] - ' + filename + '\n')
 
@@ -193,6 +241,8 @@ class GenericWriter(object):
             **self.path_keys),'.camlog')
         
         self.logfile = open(logfname,'w',encoding = 'utf-8')
+        self.logfilename = logfname
+        self.frameindex = FrameIndexWriter(logfname.replace('.camlog',FRAME_INDEX_EXTENSION))
         self.logfile.write('# Camera: {0} log file'.format(
             self.dataname) + '\n')
         self.logfile.write('# Date: {0}'.format(
@@ -200,13 +250,88 @@ class GenericWriter(object):
         self.logfile.write('# labcams version: {0}'.format(
             VERSION) + '\n')                
         self.logfile.write('# Log header:' + 'frame_id,timestamp' + '\n')
+        if self.camlog_format == 'binary':
+            binname = logfname.replace('.camlog',CAMLOG_BINARY_EXTENSION)
+            self.camlogbin = open(binname,'wb')
+            self.logfile.write('# Binary camlog: {0}'.format(os.path.basename(binname)) + '\n')
 
     def _open_file(self,filename,frame):
         pass
 
+    def _set_encoder_priority(self,pid):
+        if self.encoder_affinity is None and self.encoder_priority is None:
+            return
+        set_process_priority(self.encoder_affinity,
+                             self.encoder_priority,
+                             pid = pid,
+                             name = '{0} encoder'.format(self.dataname))
+
     def _write(self,frame,frameid,timestamp):
         pass
 
+    def _write_batch(self,frames,frameids,timestamps):
+        # writers that can do better than one frame at a time override this
+        for frame,frameid,timestamp in zip(frames,frameids,timestamps):
+            self._write(frame.squeeze(),frameid,timestamp)
+
+    def _start_io_thread(self):
+        self._io_queue = ThreadQueue()
+        self._io_buffers = ThreadQueue()
+        for i in range(self.async_write):
+            self._io_buffers.put(None) # allocated when first used
+        self._io_thread = threading.Thread(target = self._io_loop,
+                                           name = '{0} io'.format(self.dataname),
+                                           daemon = True)
+        self._io_thread.start()
+
+    def _io_loop(self):
+        while True:
+            func,args = self._io_queue.get()
+            try:
+                func(*args)
+            except Exception as err:
+                display('[Recorder] {0} write failed: {1}'.format(self.dataname,err))
+            finally:
+                self._io_queue.task_done()
+
+    def _io(self,func,*args):
+        '''
+        Runs func on the I/O thread (in order) when async_write is set,
+        otherwise runs it now and returns the result.
+        '''
+        if not self.async_write:
+            return func(*args)
+        if self._io_thread is None:
+            self._start_io_thread()
+        self._io_queue.put((func,args))
+        return None,None
+
+    def _io_wait(self):
+        '''Waits for the I/O thread to write everything it has.'''
+        if not self._io_thread is None:
+            self._io_queue.join()
+
+    def _stage(self,data):
+        '''
+        Copies data to a free staging buffer, waits while all buffers are being written.
+        Returns the buffer (to release with _write_staged) and the copy.
+        '''
+        if self._io_thread is None:
+            self._start_io_thread()
+        buf = self._io_buffers.get()
+        if buf is None or buf.nbytes < data.nbytes:
+            buf = np.empty(data.nbytes,dtype = np.uint8)
+        staged = buf[:data.nbytes].view(data.dtype).reshape(data.shape)
+        np.copyto(staged,data)
+        return buf,staged
+
+    def _write_staged(self,buf,func,*args):
+        # I/O thread, the staging buffer is free once written
+        try:
+            return func(*args)
+        finally:
+            self._io_buffers.put(buf)
+
     def save(self,frame,metadata):
         return self._handle_frame((frame,metadata))
     
@@ -228,28 +353,129 @@ class GenericWriter(object):
             return None,msg
         else:
             frame,(metadata) = buff
-            if (self.fd is None or
-                (self.framesperfile > 0 and np.mod(self.saved_frame_count,
-                                                   self.framesperfile)==0)):
-                self.open_file(frame = frame)
-                if not self.inQ is None:
-                    display('Queue size: {0}'.format(self.inQ.qsize()))
-                    self.logfile.write('# [' + datetime.today().strftime('%y-%m-%d %H:%M:%S')+'] - '
-                                       + 'Queue: {0}'.format(self.inQ.qsize())
-                                       + '\n')
+            self._check_file(frame)
             frameid, timestamp = metadata[:2] 
+            tstart = time.perf_counter()
             self._write(frame,frameid,timestamp)
-            self.logfile.write(','.join(['{0}'.format(a) for a in metadata]) + '\n')
+            self.write_seconds.value += time.perf_counter() - tstart
+            self._index_frames([frameid],[timestamp])
+            if self.camlogbin is None:
+                self.logfile.write(','.join(['{0}'.format(a) for a in metadata]) + '\n')
+            else:
+                self.camlogbin.write(camlog_records([metadata]).tobytes())
             self.saved_frame_count += 1
         return frameid,frame
+
+    def _check_file(self,frame):
+        ''' Opens a file when there is none or when the current one is full.'''
+        if (self.fd is None or
+            (self.framesperfile > 0 and np.mod(self.saved_frame_count,
+                                               self.framesperfile)==0)):
+            self.open_file(frame = frame)
+            qsize = self.get_queue_size()
+            if not qsize is None:
+                display('Queue size: {0}'.format(qsize))
+                self.logfile.write('# [' + datetime.today().strftime('%y-%m-%d %H:%M:%S')+'] - '
+                                   + 'Queue: {0}'.format(qsize)
+                                   + '\n')
+
+    def save_batch(self,frames,metadata):
+        '''
+        Saves consecutive frames in one go.
+
+        Inputs:
+            frames (array)    : N frames (N,H,W,NCHANNELS)
+            metadata (array)  : N records of the ring metadata table (FRAME_METADATA_DTYPE)
+        '''
+        start = 0
+        while start < len(frames):
+            self._check_file(frames[start].squeeze())
+            stop = len(frames)
+            if self.framesperfile > 0:
+                # do not write past the end of the file
+                stop = min(stop,start + self.framesperfile - np.mod(self.saved_frame_count,
+                                                                    self.framesperfile))
+            self._write_batch(frames[start:stop],
+                              metadata['frame_id'][start:stop],
+                              [driver_timestamp(*m) for m in metadata[
+                                  ['timestamp','timestamp_ticks','timestamp_kind']][start:stop].tolist()])
+            self._index_frames(metadata['frame_id'][start:stop],
+                               metadata['timestamp'][start:stop])
+            if self.camlogbin is None:
+                self.logfile.write(self._format_camlog(metadata[start:stop]))
+            else:
+                self.camlogbin.write(camlog_records(metadata[start:stop]).tobytes())
+            self.saved_frame_count += stop - start
+            start = stop
+        return int(metadata['frame_id'][-1]),frames[-1].squeeze()
+
+    def _index_offsets(self,positions):
+        # where the frames are in the file: the page or frame number (binary writers use bytes)
+        return positions
+
+    def _index_frames(self,frameids,timestamps):
+        positions = self.file_frames + np.arange(len(frameids))
+        self.file_frames += len(frameids)
+        if not self.frameindex is None:
+            self.frameindex.append(frameids,
+                                   self._index_offsets(positions),
+                                   timestamps)
+
+    def _format_camlog(self,metadata):
+        # one block of camlog lines for a batch (same format as _handle_frame)
+        lines = []
+        for frameid,timestamp,host_timestamp,linestat,ticks,kind in metadata.tolist():
+            timestamp = driver_timestamp(timestamp,ticks,kind)
+            if linestat < 0:
+                lines.append('{0},{1}\n'.format(frameid,timestamp))
+            else:
+                lines.append('{0},{1},{2}\n'.format(frameid,timestamp,linestat))
+        return ''.join(lines)
     
+    def _dump_latency(self):
+        ''' Writes the latency histograms of the run next to the camlog and starts new ones.'''
+        fname = self.logfilename.replace('.camlog','.latency.json')
+        try:
+            intervals = self.stats.dump(fname,
+                                        camera = self.dataname,
+                                        labcams_version = VERSION,
+                                        date = datetime.today().strftime('%d-%m-%Y %H:%M:%S'))
+        except Exception as err:
+            display('[Recorder] Could not write the latency file {0}: {1}'.format(fname,err))
+            return
+        self.stats.reset()
+        self.logfile.write('# [' + datetime.today().strftime('%y-%m-%d %H:%M:%S')+'] - ' +
+                           'Latency grab to disk p50 {0:.2f} ms, p99 {1:.2f} ms ({2}).'.format(
+                               intervals['saved']['p50']*1000,
+                               intervals['saved']['p99']*1000,
+                               os.path.basename(fname)) + '\n')
+
+    def get_queue_size(self):
+        qsize = None
+        if not self.inQ is None:
+            qsize = self.inQ.qsize()
+        if not self.frameQ is None:
+            qsize = (0 if qsize is None else qsize) + self.frameQ.qsize()
+        return qsize
+
     def close_run(self):
+        self._io_wait()
         if not self.logfile is None:
             # Check if there are comments on the queue
-            while not self.inQ.empty():
-                buff = self.inQ.get()
+            while not self._stopped and not self.inQ is None and not self.inQ.empty():
+                buff,position = _untag_message(self.inQ.get())
+                if not position is None and buff == ['STOP']:
+                    continue # closing already
                 frameid,frame = self._handle_frame(buff)
             self.close_file()
+            if hasattr(self,'overruns') and self.overruns.value:
+                self.logfile.write('# [' +
+                                   datetime.today().strftime(
+                                       '%y-%m-%d %H:%M:%S')+'] - ' +
+                                   "Ring overruns: {0} frames were overwritten before saving.".format(
+                                       self.overruns.value) + '\n')
+            if not self.stats is None:
+                self._dump_latency()
             self.logfile.write('# [' +
                                datetime.today().strftime(
                                    '%y-%m-%d %H:%M:%S')+'] - ' +
@@ -259,6 +485,12 @@ class GenericWriter(object):
                                    self.nFiles) + '\n')
             self.logfile.close()
             self.logfile = None
+            if not self.camlogbin is None:
+                self.camlogbin.close()
+                self.camlogbin = None
+            if not self.frameindex is None:
+                self.frameindex.close()
+                self.frameindex = None
             display('[Recorder] Closing the logfile {0}.'.format(self.dataname))
             self.runs += 1
         if not self.saved_frame_count == 0:
@@ -281,6 +513,8 @@ class GenericWriterProcess(Process,GenericWriter):
                  virtual_channels = None,
                  incrementruns=True,
                  save_trigger = None,
+                 writer_affinity = None,
+                 writer_priority = None,
                  **kwargs):
         GenericWriter.__init__(self,
                                cam = cam,
@@ -301,6 +535,17 @@ class GenericWriterProcess(Process,GenericWriter):
         self.close_event = Event()
         self.filename = Array('u',' ' * 1024)
         self.parQ = Queue(MAX_QUEUE_SIZE)
+        # writer pressure, only written by the writer process: the last frame saved
+        # (-1 when not recording) and its host timestamp, get_lag compares them with the camera
+        self.last_saved_frame = Value('q',-1,lock = False)
+        self.last_saved_time = Value('d',0,lock = False)
+        self.overruns = Value('i',0,lock = False)
+        # totals since the writer started (frames and bytes handed to the recorder)
+        self.frames_written = Value('q',0,lock = False)
+        self.bytes_written = Value('q',0,lock = False)
+        # CPUs and priority of the writer process (see set_process_priority)
+        self.writer_affinity = writer_affinity
+        self.writer_priority = writer_priority
         self.daemon = True
 
     def _stop_write(self):
@@ -321,8 +566,9 @@ class GenericWriterProcess(Process,GenericWriter):
     def _write(self,frame,frameid,timestamp):
         pass
     
-    def get_from_queue_and_save(self):
-        buff = self.inQ.get()
+    def get_from_queue_and_save(self,buff = None):
+        if buff is None:
+            buff = self.inQ.get()
         qsize = self.inQ.qsize()
         if qsize > 1000:
             display('[{0}] Queue size: {1}'.format(
@@ -331,56 +577,273 @@ class GenericWriterProcess(Process,GenericWriter):
                 self.inQ.get()
             display('######################################## ISSUE RECORDING. FRAME COUNT ON QUEUE TOO HIGH. DROPPING FRAMES. #########################')
             display('########################################          THIS IS NOT NORMAL, CHECK THE SETTINGS.              #########################')
-            if not self.logfile is None:
-                self.logfile.write('# ISSUE RECORDING. FRAME COUNT ON QUEUE TOO HIGH. DROPPING FRAMES.')
-                self.logfile.write('# THIS IS NOT NORMAL, CHECK THE INSTALATION.')
+            self._io(self._log_comments,['# ISSUE RECORDING. FRAME COUNT ON QUEUE TOO HIGH. DROPPING FRAMES.',
+                                         '# THIS IS NOT NORMAL, CHECK THE INSTALATION.'])
+            if not self.stats is None:
+                # where the time went in the last seconds
+                display('[{0}] Latency p99 (ms): {1}'.format(self.dataname,', '.join(
+                    ['{0} {1:.2f}'.format(k,v['p99']*1000)
+                     for k,v in self.stats.summary().items()])))
         buf = None
         if not buff[0] is None:
             if len(buff) > 1:
                 buf = self.get_frame(buff[0])
+                if self.async_write: # the ring slot may be reused before it is written
+                    buf = np.array(buf)
                 buff = [buf, *buff[1:]]
-        return self._handle_frame(buff)
+        return self._io(self._handle_frame,buff)
+
+    def _log_comments(self,comments):
+        if not self.logfile is None:
+            for c in comments:
+                self.logfile.write(c + '\n')
+
+    def get_from_index_queue_and_save(self,maxitems = None):
+        frameid,frame = None,None
+        frame_indices = self.frameQ.get_all(maxitems)
+        if not self.stats is None:
+            self.stats.stamp(frame_indices,'dequeue')
+        if self.last_saved_frame.value < 0 and len(frame_indices):
+            # first frames of the run, count the lag from the frame before them
+            self.last_saved_time.value = float(
+                self.ring.meta[self.ring.index(frame_indices[0])]['host_timestamp'])
+            self.last_saved_frame.value = int(frame_indices[0]) - 1
+        for frame_indices in self._ring_batches(frame_indices):
+            frameid,frame = self.save_batch_from_ring(frame_indices)
+        return frameid,frame
+
+    def _ring_batches(self,frame_indices):
+        '''Splits frame indices in runs of consecutive frames that are contiguous in the ring.'''
+        if not len(frame_indices):
+            return []
+        slots = frame_indices % self.nbuffers
+        breaks = np.where((np.diff(frame_indices) != 1) | (np.diff(slots) != 1))[0] + 1
+        return np.split(frame_indices,breaks)
+
+    def save_batch_from_ring(self,frame_indices):
+        '''
+        Saves consecutive frames straight from the ring (a single slice of the ring),
+        checking that the camera did not overwrite the slots (ring overrun)
+        before or while they were written to disk.
+        '''
+        if not len(frame_indices):
+            return None,None
+        slots = frame_indices % self.nbuffers
+        seq = self.ring.seq[slots]    # fancy indexing copies
+        metadata = self.ring.meta[slots]
+        valid = (((seq & 1) == 0) &
+                 (metadata['frame_id'] == frame_indices) &
+                 (self.ring.seq[slots] == seq))
+        if not np.all(valid):
+            # the camera lapped the writer, these frames are lost
+            for frame_index in frame_indices[~valid]:
+                self._ring_overrun(frame_index,written = False)
+            frameid,frame = None,None
+            for batch in self._ring_batches(frame_indices[valid]):
+                frameid,frame = self.save_batch_from_ring(batch)
+            return frameid,frame
+        frames = self.imgs[slots[0]:slots[-1]+1]
+        if self.async_write:
+            # copy out of the ring, the I/O thread writes while the next frames are read
+            buf,frames = self._stage(frames)
+            frameid,frame = self._io(self._write_staged,buf,
+                                     self._save_ring_batch,frames,metadata,frame_indices)
+        else:
+            frameid,frame = self._save_ring_batch(frames,metadata,frame_indices)
+        for frame_index in frame_indices[self.ring.seq[slots] != seq]:
+            # overwritten while saving (or copying), what is on disk may be mixed
+            self._ring_overrun(frame_index,written = True)
+        return frameid,frame
+
+    def _save_ring_batch(self,frames,metadata,frame_indices):
+        tstart = time.perf_counter()
+        frameid,frame = self.save_batch(frames,metadata)
+        self.write_seconds.value += time.perf_counter() - tstart
+        if not self.stats is None:
+            self.stats.stamp(frame_indices,'write')
+        self.frames_written.value += len(frame_indices)
+        self.bytes_written.value += len(frame_indices)*self.imgs[0].nbytes
+        self.last_saved_time.value = float(metadata['host_timestamp'][-1])
+        self.last_saved_frame.value = int(frame_indices[-1])
+        return frameid,frame
+
+    def _ring_overrun(self,frame_index,written):
+        self.overruns.value += 1
+        self._io(self._log_overrun,frame_index,written)
+        if self.overruns.value == 1 or not np.mod(self.overruns.value,100):
+            display('[{0}] Ring overrun: frame {1} overwritten before saving ({2} overruns, writer is {3} frames behind).'.format(
+                self.dataname, frame_index, self.overruns.value,self.get_lag()['frames_behind']))
+
+    def _log_overrun(self,frame_index,written):
+        if self.logfile is None:
+            self._open_logfile()
+        self.logfile.write('#OVERRUN:{0},{1}\n'.format(int(frame_index),int(written)))
+
+    def get_lag(self):
+        '''Writer pressure: frames and seconds behind the camera, ring overruns and frames dropped from the queue.'''
+        dropped = 0
+        if not self.frameQ is None:
+            dropped = self.frameQ.dropped
+        # computed now, so a writer stuck in a slow write shows the lag growing
+        frames_behind,seconds_behind = 0,0.
+        lastframe = self.last_saved_frame.value
+        if lastframe >= 0:
+            frames_behind = max(int(self.cam['nframes'].value) - lastframe,0)
+            if frames_behind > 0:
+                seconds_behind = max(time.time() - self.last_saved_time.value,0.)
+        return dict(frames_behind = frames_behind,
+                    seconds_behind = seconds_behind,
+                    overruns = self.overruns.value,
+                    dropped = dropped)
+
+    def save_queued(self):
+        '''
+        Handles the control messages in order with the frames: the frames queued
+        before a message (its tag) are saved first. A STOP ends the run,
+        the frames after it are left for the next one.
+        '''
+        frameid,frame = None,None
+        while not self.inQ.empty():
+            buff,position = _untag_message(self.inQ.get())
+            if not self.frameQ is None:
+                frameid,frame = self._save_index_queue(position)
+            if not position is None and buff == ['STOP']:
+                display('[Recorder] Stopping the recorder.')
+                self._stopped = True
+                return frameid,frame
+            frameid,frame = self.get_from_queue_and_save(buff)
+        if not self.frameQ is None:
+            frameid,frame = self._save_index_queue()
+        return frameid,frame
+
+    def _save_index_queue(self,position = None):
+        '''Saves the frames on the index queue, only those put before position if given.'''
+        frameid,frame = None,None
+        while not self.frameQ.empty():
+            maxitems = None
+            if not position is None:
+                maxitems = position - self.frameQ.tail
+                if maxitems <= 0:
+                    break
+            frameid,frame = self.get_from_index_queue_and_save(maxitems)
+        return frameid,frame
+
+    def wait_queued(self,timeout):
+        if not self.frameQ is None:
+            self.frameQ.wait(timeout)
+        else:
+            time.sleep(timeout)
 
     def _init_shared_mem(self):
+        if hasattr(self,'ring'):
+            return # attached on a previous run
         dtype = self.cam['dtype']
         try:
             dtype = dtype()
         except:
             pass
-        if not hasattr(self,'membuffer'):
-            self.membuffer = SharedMemory(name = self.cam['buffer_name'])
-        buffsize = [self.h.value,self.w.value,self.nchannels.value]
-        self.nbuffers = int(self.cam['buffer_len'] // np.prod(buffsize+[dtype.itemsize]))
-        buffsize = [self.nbuffers] + buffsize
-        self.imgs = np.ndarray(buffsize,
-                               buffer = self.membuffer.buf,
-                               dtype = dtype)
+        self.membuffer = SharedMemory(name = self.cam['buffer_name'])
+        self.ring = FrameRing(self.membuffer.buf,
+                              self.cam['buffer_len'],
+                              [self.h.value,self.w.value,self.nchannels.value],
+                              dtype)
+        self.nbuffers = self.ring.nbuffers
+        self.imgs = self.ring.imgs
+        if self.cam.get('ring_prefault',False):
+            self.ring.prefault()
 
     def get_frame(self,frame_index = None):
         if frame_index is None:
             frame_index = self.nframes.value
         return self.imgs[frame_index % self.nbuffers].squeeze()
+
+    def get_metadata(self,frame_index):
+        return self.ring.metadata_tuple(self.ring.meta[self.ring.index(frame_index)])
         
     def run(self):
+        # encoders started by the writer inherit it
+        set_process_priority(self.writer_affinity,
+                             self.writer_priority,
+                             name = '{0} writer'.format(self.dataname))
         while not self.close_event.is_set():
             self.saved_frame_count = 0
             self.nFiles = 0
+            self.overruns.value = 0 # counted per run
             if not self.parQ.empty():
                 self.getFromParQueue()
             self._init_shared_mem()
-            while self.write_event.is_set() and not self.close_event.is_set():
-                while self.inQ.qsize() > 0:
-                    frameid,frame = self.get_from_queue_and_save()
-                # spare the processor just in case...
-                time.sleep(self.sleeptime)
+            while (self.write_event.is_set() and not self.close_event.is_set()
+                   and not self._stopped):
+                frameid,frame = self.save_queued()
+                # wakes up when the camera queues a frame
+                self.wait_queued(self.sleeptime)
             time.sleep(self.sleeptime)
+            if self.write_event.is_set() and self.logfile is None:
+                # saving started while sleeping, do not save the first frames in a run of their own
+                self._stopped = False
+                continue
             # If queue is not empty, empty if to disk.
-            while self.inQ.qsize() > 0:
-                frameid,frame = self.get_from_queue_and_save()
+            if not self._stopped:
+                frameid,frame = self.save_queued()
+            self.last_saved_frame.value = -1
             #display('Queue is empty. Proceding with close.')
             # close the run
             self.close_run()
+            self._stopped = False
         
+def _untag_message(buff):
+    # the camera tags control messages with the head of the index queue when sent
+    if isinstance(buff,dict):
+        return buff['msg'],buff['frames']
+    return buff,None
+
+def _tiff_layout(frame):
+    # one page per frame, the channels are samples of the page
+    if frame.ndim < 3:
+        return dict(photometric = 'minisblack')
+    return dict(photometric = 'rgb' if frame.shape[-1] == 3 else 'minisblack',
+                planarconfig = 'contig')
+
+def tiff_write_frame(fd, frame, compression = None, description = None, compressed = None):
+    '''
+    Writes a frame as a page of a tifffile.TiffWriter.
+
+    Inputs:
+        fd                   : tifffile.TiffWriter
+        frame (array)        : HxW or HxWxNCHANNELS
+        compression (int)    : zlib level (None or 0 does not compress)
+        description (str)    : page description (e.g. 'id:FRAMEID;timestamp:TIMESTAMP')
+        compressed (bytes)   : the frame already compressed with zlib (a single strip)
+    Works with tifffile versions before (save) and after (write) the TiffWriter.save removal.
+    '''
+    if frame.ndim == 3 and frame.shape[-1] == 1:
+        frame = frame.reshape(frame.shape[:2]) # single channel (H,W,1) ring views
+    if not hasattr(fd,'write'): # old tifffile
+        return fd.save(frame,
+                       compress = compression if compression else 0,
+                       description = description)
+    par = dict(description = description,
+               metadata = None, # so all pages are read as one series (TiffStack)
+               **_tiff_layout(frame))
+    if not compressed is None:
+        return fd.write(iter([compressed]),
+                        shape = frame.shape,
+                        dtype = frame.dtype,
+                        compression = 'zlib',
+                        rowsperstrip = frame.shape[0],
+                        **par)
+    if compression:
+        try:
+            return fd.write(frame,
+                            compression = 'zlib',
+                            compressionargs = dict(level = int(compression)),
+                            **par)
+        except TypeError: # tifffile < 2022.7
+            return fd.write(frame,
+                            compression = ('zlib',int(compression)),
+                            **par)
+    return fd.write(frame, **par)
+
 class TiffWriter(GenericWriterProcess):
     def __init__(self,
                  cam,
@@ -394,6 +857,7 @@ class TiffWriter(GenericWriterProcess):
                  sleeptime = 1./30,
                  incrementruns=True,
                  compression=None,
+                 compression_workers=0,
                  **kwargs):
         self.extension = '.tif'
         super(TiffWriter,self).__init__(cam = cam,
@@ -404,13 +868,17 @@ class TiffWriter(GenericWriterProcess):
                                         pathformat=pathformat,
                                         framesperfile=framesperfile,
                                         sleeptime=sleeptime,
-                                        incrementruns=incrementruns)
+                                        incrementruns=incrementruns,
+                                        **kwargs)
         self.compression = None
         if not compression is None:
             if compression > 9:
                 display('Can not use compression over 9 for the TiffWriter')
             elif compression > 0:
                 self.compression = compression
+        # threads that compress frames from the ring (zlib does not hold the GIL)
+        self.compression_workers = compression_workers
+        self.compression_pool = None
         self.tracker = None
         self.trackerfile = None
         self.trackerFlag = Event()
@@ -424,15 +892,125 @@ class TiffWriter(GenericWriterProcess):
     def _open_file(self,filename,frame = None):
         self.fd = twriter(filename)
 
-    def _write(self,frame,frameid,timestamp):
-        self.fd.save(frame,
-                     compression=self.compression,
-                     description='id:{0};timestamp:{1}'.format(frameid,
-                                                               timestamp))
+    def _write(self,frame,frameid,timestamp,compressed = None):
+        tiff_write_frame(self.fd,frame,
+                         compression = self.compression,
+                         description = 'id:{0};timestamp:{1}'.format(frameid,
+                                                                     timestamp),
+                         compressed = compressed)
+
+    def _compress(self,frame):
+        return zlib.compress(frame,self.compression)
+
+    def _write_batch(self,frames,frameids,timestamps):
+        if self.compression is None or not self.compression_workers:
+            return super(TiffWriter,self)._write_batch(frames,frameids,timestamps)
+        if self.compression_pool is None:
+            self.compression_pool = ThreadPoolExecutor(
+                max_workers = self.compression_workers,
+                thread_name_prefix = '{0} compression'.format(self.dataname))
+        # the frames are compressed in parallel straight from the ring
+        # and the strips are appended in frame order.
+        for frame,frameid,timestamp,compressed in zip(
+                frames,frameids,timestamps,
+                self.compression_pool.map(self._compress,frames)):
+            self._write(frame.squeeze(),frameid,timestamp,compressed = compressed)
+
+    def close_run(self):
+        super(TiffWriter,self).close_run()
+        if not self.compression_pool is None:
+            self.compression_pool.shutdown()
+            self.compression_pool = None
 
 ################################################################################
 ################################################################################
 ################################################################################
+DIRECT_IO_ALIGNMENT = 4096
+
+class DirectFile(object):
+    def __init__(self, filename, preallocate = 0, buffer_size = 16*1024*1024):
+        '''
+        Binary file written with O_DIRECT (no page cache) from a page aligned staging buffer.
+        The file is preallocated in blocks of preallocate bytes and truncated
+        to the bytes written when closed.
+
+        fd = DirectFile(filename, preallocate = 1024*frame.nbytes)
+        fd.write(frames)
+        fd.close()
+        '''
+        self.filename = filename
+        self.direct = hasattr(os,'O_DIRECT')
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os,'O_BINARY',0)
+        try:
+            self.fd = os.open(filename,flags | (os.O_DIRECT if self.direct else 0),0o666)
+        except OSError: # the filesystem does not support O_DIRECT (e.g. tmpfs)
+            self.direct = False
+            self.fd = os.open(filename,flags,0o666)
+        if not self.direct:
+            display('[DirectFile] O_DIRECT not available for {0}, writing through the page cache.'.format(
+                filename))
+        align = DIRECT_IO_ALIGNMENT
+        self.preallocate = int(np.ceil(preallocate/align)*align)
+        self.allocated = 0
+        self.nbytes = 0  # bytes written, the size of the file when closed
+        self.staged = 0  # bytes in the staging buffer
+        self._mmap = mmap.mmap(-1,int(np.ceil(buffer_size/align)*align)) # page aligned
+        self.buffer = np.frombuffer(self._mmap,dtype = np.uint8)
+
+    def _allocate(self, nbytes):
+        # grows the file in blocks so the extents are reserved ahead of the writes
+        while self.preallocate > 0 and self.nbytes + nbytes > self.allocated:
+            try:
+                os.posix_fallocate(self.fd,self.allocated,self.preallocate)
+            except (AttributeError,OSError) as err:
+                display('[DirectFile] Could not preallocate {0}: {1}'.format(self.filename,err))
+                self.preallocate = 0
+                return
+            self.allocated += self.preallocate
+
+    def _flush(self, pad = False):
+        # writes the whole pages of the staging buffer and keeps the rest
+        nbytes = (self.staged // DIRECT_IO_ALIGNMENT)*DIRECT_IO_ALIGNMENT
+        if pad and nbytes < self.staged:
+            nbytes += DIRECT_IO_ALIGNMENT
+            self.buffer[self.staged:nbytes] = 0
+        if nbytes == 0:
+            return
+        view = memoryview(self._mmap)[:nbytes]
+        written = 0
+        while written < nbytes:
+            written += os.write(self.fd,view[written:])
+        view.release()
+        rest = max(self.staged - nbytes,0)
+        self.buffer[:rest] = self.buffer[nbytes:nbytes + rest]
+        self.staged = rest
+
+    def write(self, data):
+        data = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        self._allocate(len(data))
+        start = 0
+        while start < len(data):
+            n = min(len(data) - start,len(self.buffer) - self.staged)
+            self.buffer[self.staged:self.staged + n] = data[start:start + n]
+            self.staged += n
+            start += n
+            if self.staged == len(self.buffer):
+                self._flush()
+        if self.staged >= DIRECT_IO_ALIGNMENT:
+            self._flush()
+        self.nbytes += len(data)
+        return len(data)
+
+    def close(self):
+        if self.fd is None:
+            return
+        self._flush(pad = True)
+        os.ftruncate(self.fd,self.nbytes)
+        os.close(self.fd)
+        self.fd = None
+        del self.buffer
+        self._mmap.close()
+
 class BinaryWriter(GenericWriterProcess):
     def __init__(self,
                  cam,
@@ -445,7 +1023,10 @@ class BinaryWriter(GenericWriterProcess):
                  framesperfile=0,
                  sleeptime = 1./300,
                  virtual_channels = None,
-                 incrementruns=True,**kwargs):
+                 incrementruns=True,
+                 direct_io = False,
+                 preallocate_frames = None,
+                 **kwargs):
         self.extension = '_{nchannels}_{H}_{W}_{dtype}.dat'
         super(BinaryWriter,self).__init__(cam = cam,
                                           loggerQ=loggerQ,
@@ -459,6 +1040,10 @@ class BinaryWriter(GenericWriterProcess):
                                           incrementruns=incrementruns,
                                           **kwargs)
         self.buf = []
+        # write with O_DIRECT, the files grow in blocks of preallocate_frames
+        # (framesperfile or 1024 if None)
+        self.direct_io = direct_io
+        self.preallocate_frames = preallocate_frames
     def close_file(self):
         if not self.fd is None:
             self.fd.close()
@@ -477,13 +1062,169 @@ class BinaryWriter(GenericWriterProcess):
                                    H=self.h.value,
                                    dtype=dtype) 
         self.parsed_filename = filename
-        self.fd = open(filename,'wb')
+        self.frame_nbytes = frame.nbytes
+        if self.direct_io:
+            nframes = self.preallocate_frames
+            if nframes is None:
+                nframes = self.framesperfile if self.framesperfile > 0 else 1024
+            self.fd = DirectFile(filename,preallocate = nframes*frame.nbytes)
+        else:
+            self.fd = open(filename,'wb')
         
     def _write(self,frame,frameid,timestamp):
         self.fd.write(frame)
         if np.mod(frameid,5000) == 0: 
             display('Wrote frame id - {0}'.format(frameid))
+
+    def _index_offsets(self,positions):
+        return positions*self.frame_nbytes
+
+    def _write_batch(self,frames,frameids,timestamps):
+        # consecutive ring slots are contiguous: one write for the whole batch
+        self.fd.write(frames)
+        for frameid in frameids[np.mod(frameids,5000) == 0]:
+            display('Wrote frame id - {0}'.format(frameid))
         
+################################################################################
+################################################################################
+################################################################################
+class HDF5Writer(GenericWriterProcess):
+    def __init__(self,
+                 cam,
+                 loggerQ = None,
+                 filename = pjoin('dummy','run'),
+                 dataname = 'eyecam',
+                 datafolder=pjoin(os.path.expanduser('~'),'data'),
+                 pathformat = pjoin('{datafolder}','{dataname}','{filename}',
+                                    '{today}_{run}_{nfiles}'),
+                 framesperfile=0,
+                 sleeptime = 1./300,
+                 incrementruns=True,
+                 compression = 'zstd',
+                 compression_level = 5,
+                 compression_threads = 4,
+                 chunkframes = 32,
+                 **kwargs):
+        '''
+        Records frames to HDF5 in chunks of chunkframes frames compressed with Blosc
+        (lossless, zstd by default, compression_threads threads per chunk).
+        Each file has the datasets:
+            frames          (NFRAMES,H,W[,NCHANNELS])
+            frame_id, timestamp, host_timestamp, line_status   (NFRAMES)
+        Needs h5py and hdf5plugin (pip install h5py hdf5plugin), reading the files needs
+        hdf5plugin to be imported too.
+        '''
+        try:
+            import h5py
+            import hdf5plugin
+        except ImportError as err:
+            print(err)
+            print('''
+
+                    Could not load h5py and hdf5plugin.
+
+    To record in the hdf5 format install them:
+
+            pip install h5py hdf5plugin
+
+''')
+            raise
+        self.extension = '.h5'
+        super(HDF5Writer,self).__init__(cam = cam,
+                                        loggerQ=loggerQ,
+                                        filename=filename,
+                                        datafolder=datafolder,
+                                        dataname=dataname,
+                                        pathformat = pathformat,
+                                        framesperfile=framesperfile,
+                                        sleeptime=sleeptime,
+                                        incrementruns=incrementruns,
+                                        **kwargs)
+        self.compression = compression
+        self.compression_level = int(compression_level)
+        self.compression_threads = int(compression_threads)
+        self.chunkframes = int(chunkframes)
+        self._metadata = None
+
+    def _open_file(self,filename,frame = None):
+        # blosc reads the number of threads from the environment when compressing
+        os.environ['BLOSC_NTHREADS'] = str(self.compression_threads)
+        import h5py
+        import hdf5plugin
+        self.fd = h5py.File(filename,'w')
+        self.fd.attrs['camera'] = self.dataname
+        self.fd.attrs['labcams_version'] = VERSION
+        self.fd.create_dataset('frames',
+                               shape = (0,*frame.shape),
+                               maxshape = (None,*frame.shape),
+                               chunks = (self.chunkframes,*frame.shape),
+                               dtype = frame.dtype,
+                               **hdf5plugin.Blosc(cname = self.compression,
+                                                  clevel = self.compression_level,
+                                                  shuffle = hdf5plugin.Blosc.SHUFFLE))
+        for k,dtype in [('frame_id',np.int64),
+                        ('timestamp',np.float64),
+                        ('host_timestamp',np.float64),
+                        ('line_status',np.int64)]:
+            self.fd.create_dataset(k,
+                                   shape = (0,),
+                                   maxshape = (None,),
+                                   chunks = (4096,),
+                                   dtype = dtype)
+        self.nwritten = 0
+        # frames are written in whole chunks
+        self.chunk = np.empty((self.chunkframes,*frame.shape),dtype = frame.dtype)
+        self.chunkmeta = np.empty(self.chunkframes,dtype = FRAME_METADATA_DTYPE)
+        self.nchunk = 0
+
+    def _flush_chunk(self):
+        if not self.nchunk:
+            return
+        n = self.nwritten + self.nchunk
+        self.fd['frames'].resize(n,axis = 0)
+        self.fd['frames'][self.nwritten:n] = self.chunk[:self.nchunk]
+        for k,field in [('frame_id','frame_id'),
+                        ('timestamp','timestamp'),
+                        ('host_timestamp','host_timestamp'),
+                        ('line_status','linestat')]:
+            self.fd[k].resize(n,axis = 0)
+            self.fd[k][self.nwritten:n] = self.chunkmeta[field][:self.nchunk]
+        self.nwritten = n
+        self.nchunk = 0
+
+    def close_file(self):
+        if not self.fd is None:
+            self._flush_chunk()
+            self.fd.close()
+        self.fd = None
+
+    def save_batch(self,frames,metadata):
+        # keep the metadata records, _write_batch gets them in order
+        self._metadata = metadata
+        self._metadata_index = 0
+        return super(HDF5Writer,self).save_batch(frames,metadata)
+
+    def _write_batch(self,frames,frameids,timestamps):
+        metadata = self._metadata[self._metadata_index:self._metadata_index + len(frames)]
+        self._metadata_index += len(frames)
+        frames = frames.reshape((len(frames),*self.chunk.shape[1:]))
+        start = 0
+        while start < len(frames):
+            n = min(len(frames) - start,self.chunkframes - self.nchunk)
+            self.chunk[self.nchunk:self.nchunk + n] = frames[start:start + n]
+            self.chunkmeta[self.nchunk:self.nchunk + n] = metadata[start:start + n]
+            self.nchunk += n
+            start += n
+            if self.nchunk == self.chunkframes:
+                self._flush_chunk()
+
+    def _write(self,frame,frameid,timestamp):
+        # frames from the queue (no host timestamp or line status)
+        record = np.array([metadata_record((frameid,timestamp))],dtype = FRAME_METADATA_DTYPE)
+        self._metadata = record
+        self._metadata_index = 0
+        self._write_batch(frame[np.newaxis],[frameid],[timestamp])
+
 ################################################################################
 ################################################################################
 ################################################################################
@@ -587,6 +1328,10 @@ class FFMPEGWriter(GenericWriterProcess):
                             self.doutputs['-b:v'] = comp[1]
                             bitrate = comp[1]
         self.hwaccel = hwaccel
+        if not self.encoder_affinity is None and '-threads' in self.doutputs.keys():
+            # one encoder thread per CPU it can use
+            self.doutputs['-threads'] = str(min(int(self.doutputs['-threads']),
+                                                max(len(self.encoder_affinity),1)))
         display('[FFMPEG] - Using compression (preset {0}) {1}  - bitrate {3} for the {2} encoder.'.format(
             preset,
             self.compression,
@@ -601,6 +1346,7 @@ class FFMPEGWriter(GenericWriterProcess):
     def _open_file(self,filename,frame = None):
         if frame is None:
             raise ValueError('[Recorder] Need to pass frame to open a file.')
+        self._encoder_started = False
         self.frame_rate = self.cam['frame_rate'].value
         if self.frame_rate is None or self.frame_rate == 0:
             display('Using 30Hz frame rate for ffmpeg')
@@ -627,6 +1373,10 @@ class FFMPEGWriter(GenericWriterProcess):
             
     def _write(self,frame,frameid,timestamp):
         self.fd.writeFrame(frame)
+        if not self._encoder_started:
+            # ffmpeg starts with the first frame
+            self._encoder_started = True
+            self._set_encoder_priority(self.fd._proc.pid)
 
 ################################################################################
 ################################################################################
@@ -740,6 +1490,9 @@ class FFMPEGCamWriter(GenericWriter):
                                  '-threads':str(1),
                                  '-preset':str(self.compression)}
         self.hwaccel = hwaccel
+        if not self.encoder_affinity is None and '-threads' in self.doutputs.keys():
+            self.doutputs['-threads'] = str(min(int(self.doutputs['-threads']),
+                                                max(len(self.encoder_affinity),1)))
         display('Using compression {0} for the {1} FFMPEG encoder.'.format(
             self.compression, hwaccel))
 
@@ -752,6 +1505,7 @@ class FFMPEGCamWriter(GenericWriter):
     def _open_file(self,filename,frame = None):
         if frame is None:
             raise ValueError('[Recorder] Need to pass frame to open a file.')
+        self._encoder_started = False
         self.frame_rate = self.cam['frame_rate'].value
         if self.frame_rate is None or self.frame_rate == 0:
             display('Using 30Hz frame rate for ffmpeg')
@@ -775,6 +1529,10 @@ class FFMPEGCamWriter(GenericWriter):
             
     def _write(self,frame,frameid,timestamp):
         self.fd.writeFrame(frame)
+        if not self._encoder_started:
+            # ffmpeg starts with the first frame
+            self._encoder_started = True
+            self._set_encoder_priority(self.fd._proc.pid)
 
 ################################################################################
 ################################################################################
@@ -820,8 +1578,12 @@ class BinaryCamWriter(GenericWriter):
                                    W=self.w.value,
                                    H=self.h.value, dtype=dtype)
         self.parsed_filename = filename
+        self.frame_nbytes = frame.nbytes
         self.fd = open(filename,'wb')
 
+    def _index_offsets(self,positions):
+        return positions*self.frame_nbytes
+
     def _write(self,frame,frameid,timestamp):
         self.fd.write(frame)
 
@@ -901,9 +1663,18 @@ class BinaryDAQWriter(GenericWriter):
         self.nbytes = 0
 
     def save(self, data,metadata = None):
+        if self.async_write:
+            # the acquisition keeps reading the DAQ while the I/O thread writes
+            buf,data = self._stage(data)
+            return self._io(self._write_staged,buf,self._save,data)
+        return self._save(data)
+
+    def _save(self,data):
         if self.fd is None:
             self.open_file(data = data)
-        return self._write(data)
+        tstart = time.perf_counter()
+        self._write(data)
+        self.write_seconds.value += time.perf_counter() - tstart
     
     def _write(self,data):
         self.fd.write(data)
@@ -911,6 +1682,7 @@ class BinaryDAQWriter(GenericWriter):
         self.nsamples += data.shape[1]
         
     def close_run(self):
+        self._io_wait()
         self.close_file()
         self.runs += 1
     
@@ -950,70 +1722,347 @@ class TiffCamWriter(GenericWriter):
         self.fd = twriter(filename)
 
     def _write(self,frame,frameid,timestamp):
-        self.fd.save(frame,
-                     compress=self.compression,
-                     description='id:{0};timestamp:{1}'.format(frameid,timestamp))
+        tiff_write_frame(self.fd,frame,
+                         compression = self.compression,
+                         description = 'id:{0};timestamp:{1}'.format(frameid,timestamp))
         
 ################################################################################
 ################################################################################
 ################################################################################
 
-def parseCamLog(fname, readTeensy = False):
-    logheaderkey = '# Log header:'
+# binary camlog records, the comments stay in the text camlog
+# the timestamp is kept exact as in the ring (ticks and kind, see driver_timestamp)
+CAMLOG_DTYPE = np.dtype([('frame_id',np.int64),
+                         ('timestamp',np.float64),
+                         ('linestat',np.int64),    # -1 if the camera has no line status
+                         ('timestamp_ticks',np.int64),
+                         ('timestamp_kind',np.int64)])
+CAMLOG_BINARY_EXTENSION = '.camlog.bin'
+
+def camlog_records(metadata):
+    '''
+    Binary camlog records from ring metadata (FRAME_METADATA_DTYPE)
+    or from a list of camlog tuples (frame_id, timestamp[, linestat]).
+    '''
+    if isinstance(metadata,np.ndarray) and not metadata.dtype.names is None:
+        records = np.empty(len(metadata),dtype = CAMLOG_DTYPE)
+        for k in CAMLOG_DTYPE.names:
+            records[k] = metadata[k]
+        return records
+    records = [metadata_record(m) for m in metadata]
+    return np.array([(r[0],r[1],r[3],r[4],r[5]) for r in records],
+                    dtype = CAMLOG_DTYPE)
+
+def _camlog_timestamps(records):
+    # the timestamps as the text camlog has them: exact integers, floats or the driver objects
+    kinds = records['timestamp_kind']
+    if np.all(kinds == TIMESTAMP_INT):
+        return records['timestamp_ticks']
+    if np.all((kinds == TIMESTAMP_FLOAT) | (kinds == TIMESTAMP_NONE)):
+        return records['timestamp'] # nan if there was none
+    return [driver_timestamp(*r) for r in records[
+        ['timestamp','timestamp_ticks','timestamp_kind']].tolist()]
+
+def _camlog_dataframe(records, columns):
+    # same columns as the text camlog: the line status is the 3rd column if present
+    logdata = pd.DataFrame({columns[0]:records['frame_id'],
+                            columns[1]:_camlog_timestamps(records)})
+    linestat = records['linestat']
+    if np.any(linestat >= 0):
+        name = columns[2] if len(columns) > 2 else 'var2'
+        if np.all(linestat >= 0):
+            logdata[name] = linestat
+        else:
+            logdata[name] = np.where(linestat >= 0,linestat,np.nan)
+    return logdata
+
+def _read_camlog_comments(fname):
     comments = []
+    columns = ['frame_id','timestamp']
+    binary = None
     with open(fname,'r',encoding = 'utf-8') as fd:
         for line in fd:
             if line.startswith('#'):
                 line = line.strip('\n').strip('\r')
                 comments.append(line)
-                if line.startswith(logheaderkey):
-                    columns = line.strip(logheaderkey).strip(' ').split(',')
-
-    logdata = pd.read_csv(fname, 
-                          delimiter=',',
-                          header=None,
-                          comment='#',
-                          engine='c')
-    col = [c for c in logdata.columns]
-    for icol in range(len(col)):
-        if icol <= len(columns)-1:
-            col[icol] = columns[icol]
-        else:
-            col[icol] = 'var{0}'.format(icol)
-    logdata.columns = col
-    if readTeensy:
-        # get the sync pulses and frames along with the LED
-        def _convert(string):
-            try:
-                val = int(string)
-            except ValueError as err:
-                val = float(string)
-            return val
+                if line.startswith('# Log header:'):
+                    columns = line[len('# Log header:'):].strip(' ').split(',')
+                elif line.startswith('# Binary camlog:'):
+                    binary = pjoin(os.path.dirname(fname),
+                                   line[len('# Binary camlog:'):].strip(' '))
+    return comments,columns,binary
+
+CAMLOG_CHUNK_SIZE = 32*1024*1024 # bytes parsed at a time
+CAMLOG_CACHE_EXTENSION = '.camlog.npz'
+CAMLOG_CACHE_VERSION = 2
+CAMLOG_LED_COLUMNS = ['led','frame','timestamp']
+CAMLOG_SYNC_COLUMNS = ['sync','count','frame','timestamp']
 
+def _numeric_rows(rows, ncols):
+    # comma separated rows to columns of literals, malformed rows are skipped
+    fields = ','.join(rows).split(',') if len(rows) else []
+    if not len(fields) == len(rows)*ncols:
+        fields = [f for r in rows for f in r.split(',') if r.count(',') == ncols - 1]
+    return [fields[i::ncols] for i in range(ncols)]
+
+def _numeric_table(chunks, columns, floatcolumns = []):
+    '''
+    Table from the columns of literals of each chunk, in one conversion per column.
+    A column is float64 if any of its literals is a float (., e, nan or inf) or it is in floatcolumns,
+    otherwise int64 (as when parsed from text).
+    '''
+    table = dict()
+    for i,c in enumerate(columns):
+        values = [v for chunk in chunks for v in chunk[i]]
+        literals = ','.join(values)
+        isfloat = c in floatcolumns or any(k in literals for k in '.eEnN')
+        table[c] = np.array(values,dtype = str).astype(np.float64 if isfloat else np.int64)
+    return pd.DataFrame(table,columns = columns)
+
+def _stream_camlog(fname, teensy = False, chunksize = CAMLOG_CHUNK_SIZE):
+    '''
+    Reads a text camlog in one pass, chunksize bytes at a time.
+    The frame rows of each chunk are parsed together with the C parser;
+    with teensy the #LED, #SYNC and #SYNC1 lines are converted to arrays per chunk.
+    '''
+    frames = []
+    comments = []
+    led,sync = [],[]
+    columns = ['frame_id','timestamp']
+    binary = None
+    rest = b''
+    with open(fname,'rb') as fd:
+        while True:
+            chunk = fd.read(chunksize)
+            data = rest + chunk
+            if len(chunk):
+                end = data.rfind(b'\n') + 1
+                data,rest = data[:end],data[end:]
+            elif len(data) and not data.endswith(b'\n'):
+                data += b'\n'
+            if len(data):
+                buf = np.frombuffer(data,dtype = np.uint8)
+                ends = np.flatnonzero(buf == ord('\n'))
+                starts = np.hstack([0,ends[:-1] + 1])
+                icomments = np.flatnonzero(buf[starts] == ord('#'))
+                rows = []
+                ledrows,syncrows = [],[]
+                previous = 0
+                for i in icomments:
+                    rows.append(data[previous:starts[i]])
+                    previous = ends[i] + 1
+                    line = data[starts[i]:ends[i]].decode('utf-8').rstrip('\r')
+                    if teensy and line.startswith('#LED:'):
+                        ledrows.append(line[5:])
+                    elif teensy and line.startswith('#SYNC:'):
+                        syncrows.append('0,' + line[6:])
+                    elif teensy and line.startswith('#SYNC1:'):
+                        syncrows.append('1,' + line[7:])
+                    else:
+                        comments.append(line)
+                        if line.startswith('# Log header:'):
+                            columns = line[len('# Log header:'):].strip(' ').split(',')
+                        elif line.startswith('# Binary camlog:'):
+                            binary = pjoin(os.path.dirname(fname),
+                                           line[len('# Binary camlog:'):].strip(' '))
+                rows.append(data[previous:])
+                rows = b''.join(rows)
+                if len(rows.strip()):
+                    frames.append(pd.read_csv(BytesIO(rows),
+                                              delimiter = ',',
+                                              header = None,
+                                              engine = 'c'))
+                led.append(_numeric_rows(ledrows,len(CAMLOG_LED_COLUMNS)))
+                sync.append(_numeric_rows(syncrows,len(CAMLOG_SYNC_COLUMNS)))
+            if not len(chunk):
+                break
+    if len(frames):
+        logdata = pd.concat(frames,ignore_index = True)
+    else:
+        logdata = pd.DataFrame(columns = range(len(columns)))
+    logdata.columns = [columns[i] if i < len(columns) else 'var{0}'.format(i)
+                       for i in range(logdata.shape[1])]
+    if teensy:
+        led = _numeric_table(led,CAMLOG_LED_COLUMNS)
+        sync = _numeric_table(sync,CAMLOG_SYNC_COLUMNS,floatcolumns = ['sync'])
+    return logdata,led,sync,comments,columns,binary
+
+def _camlog_sources(fname):
+    # size and modification time of the files the cache depends on
+    sources = [fname]
+    binname = fname.replace('.camlog',CAMLOG_BINARY_EXTENSION)
+    if os.path.exists(binname):
+        sources.append(binname)
+    return np.array([[os.stat(f).st_size,os.stat(f).st_mtime_ns] for f in sources],
+                    dtype = np.int64)
+
+def _cached_table(cache, name):
+    # the columns keep their dtype
+    columns = [str(c) for c in cache[name + '_columns']]
+    return pd.DataFrame(dict([(c,cache['{0}_{1}'.format(name,i)]) for i,c in enumerate(columns)]),
+                        columns = columns)
+
+def _table_to_cache(name, table):
+    res = dict([('{0}_{1}'.format(name,i),table[c].values) for i,c in enumerate(table.columns)])
+    res[name + '_columns'] = np.array(table.columns,dtype = str)
+    return res
+
+def _load_camlog_cache(fname, teensy):
+    cachename = fname.replace('.camlog',CAMLOG_CACHE_EXTENSION)
+    if not os.path.exists(cachename):
+        return None
+    try:
+        with np.load(cachename,allow_pickle = False) as cache:
+            if (not int(cache['version']) == CAMLOG_CACHE_VERSION or
+                not bool(cache['teensy']) == teensy or
+                not np.array_equal(cache['sources'],_camlog_sources(fname))):
+                return None
+            logdata = _cached_table(cache,'log')
+            comments = str(cache['comments']).split('\n') if cache['ncomments'] else []
+            if not teensy:
+                return logdata,comments
+            return logdata,_cached_table(cache,'led'),_cached_table(cache,'sync'),comments
+    except Exception as err:
+        display('Could not read the camlog cache {0}: {1}'.format(cachename,err))
+        return None
+
+def _save_camlog_cache(fname, teensy, logdata, comments, led = None, sync = None):
+    cachename = fname.replace('.camlog',CAMLOG_CACHE_EXTENSION)
+    columns = _table_to_cache('log',logdata)
+    if teensy:
+        columns.update(_table_to_cache('led',led))
+        columns.update(_table_to_cache('sync',sync))
+    try:
+        with open(cachename + '.tmp','wb') as fd:
+            np.savez(fd,
+                     version = CAMLOG_CACHE_VERSION,
+                     teensy = teensy,
+                     sources = _camlog_sources(fname),
+                     comments = np.array('\n'.join(comments)),
+                     ncomments = len(comments),
+                     **columns)
+        os.replace(cachename + '.tmp',cachename)
+    except OSError as err:
+        display('Could not write the camlog cache {0}: {1}'.format(cachename,err))
+
+def parseCamLog(fname, readTeensy = False, cache = False):
+    '''
+    Reads a camlog (text or binary, pass the .camlog file).
+    Returns a dataframe with the frames and the comments (or the LED, sync and other
+    comments with readTeensy).
+    With cache the tables are saved next to the camlog (.camlog.npz) and read from
+    there while the camlog does not change.
+    '''
+    if fname.endswith(CAMLOG_BINARY_EXTENSION):
+        fname = fname.replace(CAMLOG_BINARY_EXTENSION,'.camlog')
+    res = None
+    if cache:
+        res = _load_camlog_cache(fname,readTeensy)
+    if res is None:
+        logdata,led,sync,comments,columns,binary = _stream_camlog(fname,teensy = readTeensy)
+        if not binary is None:
+            # fixed records, no parsing
+            logdata = _camlog_dataframe(np.fromfile(binary,dtype = CAMLOG_DTYPE),columns)
+        if cache:
+            _save_camlog_cache(fname,readTeensy,logdata,comments,led,sync)
+        res = (logdata,comments) if not readTeensy else (logdata,led,sync,comments)
+    if not readTeensy:
+        return res
+    # get the sync pulses and frames along with the LED
+    logdata,led,sync,ncomm = res
+    if not len(sync):
+        sync = []
+    if not len(led):
         led = []
-        sync= []
-        ncomm = []
-        for l in comments:
-            if l.startswith('#LED:'):
-                led.append([_convert(f) for f in  l.strip('#LED:').split(',')])
-            elif l.startswith('#SYNC:'):
-                sync.append([0.] + [_convert(f) for f in  l.strip('#SYNC:').split(',')])
-            elif l.startswith('#SYNC1:'):
-                sync.append([1.] + [_convert(f) for f in  l.strip('#SYNC1:').split(',')])
-            else:
-                ncomm.append(l)
-        if len(sync):
-            sync = pd.DataFrame(sync,
-                                columns=['sync','count','frame','timestamp'])
-        if len(led):
-            led = pd.DataFrame(led, columns=['led','frame','timestamp'])
-        return logdata,led,sync,ncomm
-    return logdata,comments
+    return logdata,led,sync,ncomm
 
 parse_cam_log = parseCamLog
 
+def camlog_to_binary(fname, outname = None):
+    '''
+    Converts a text camlog to binary: the frames go to OUTNAME.camlog.bin and
+    the comments stay in OUTNAME (replaces the camlog if outname is None).
+    '''
+    comments,columns,binary = _read_camlog_comments(fname)
+    if not binary is None:
+        raise ValueError('{0} is already a binary camlog.'.format(fname))
+    logdata = parseCamLog(fname)[0]
+    if outname is None:
+        outname = fname
+    linestat = np.full(len(logdata),-1,dtype = np.int64)
+    if logdata.shape[1] > 2:
+        linestat = np.nan_to_num(logdata.iloc[:,2].values,nan = -1).astype(np.int64)
+    records = camlog_records(list(zip(logdata.iloc[:,0].values.tolist(),
+                                      logdata.iloc[:,1].values.tolist(),
+                                      linestat.tolist())))
+    binname = outname.replace('.camlog',CAMLOG_BINARY_EXTENSION)
+    records.tofile(binname)
+    with open(outname + '.tmp','w',encoding = 'utf-8') as fd:
+        for c in comments:
+            fd.write(c + '\n')
+            if c.startswith('# Log header:'):
+                fd.write('# Binary camlog: {0}'.format(os.path.basename(binname)) + '\n')
+    os.replace(outname + '.tmp',outname)
+    return outname
+
+def camlog_to_text(fname, outname = None):
+    '''
+    Converts a binary camlog to text (replaces the camlog and removes the .camlog.bin
+    if outname is None). The comments are written before the frames.
+    '''
+    comments,columns,binary = _read_camlog_comments(fname)
+    if binary is None:
+        raise ValueError('{0} is not a binary camlog.'.format(fname))
+    records = np.fromfile(binary,dtype = CAMLOG_DTYPE)
+    if outname is None:
+        outname = fname
+    with open(outname + '.tmp','w',encoding = 'utf-8') as fd:
+        for c in comments:
+            if not c.startswith('# Binary camlog:'):
+                fd.write(c + '\n')
+        for frameid,timestamp,linestat,ticks,kind in records.tolist():
+            timestamp = driver_timestamp(timestamp,ticks,kind)
+            if linestat < 0:
+                fd.write('{0},{1}\n'.format(frameid,timestamp))
+            else:
+                fd.write('{0},{1},{2}\n'.format(frameid,timestamp,linestat))
+    os.replace(outname + '.tmp',outname)
+    if outname == fname:
+        os.remove(binary)
+    return outname
+
+def _stack_frames(index, nframes):
+    '''
+    Frames selected by the first index of a stack: an int for a single frame,
+    otherwise an array (slices, lists of frames and boolean masks, negative frames count from the end).
+    '''
+    if isinstance(index,slice):
+        return np.arange(*index.indices(nframes))
+    if not isinstance(index,(list,tuple,np.ndarray)):
+        frame = operator.index(index)
+        if frame < -nframes or frame >= nframes:
+            raise IndexError('Frame {0} is out of range ({1} frames).'.format(frame,nframes))
+        return frame + nframes if frame < 0 else frame
+    index = np.asarray(index)
+    if index.dtype == bool:
+        if not len(index) == nframes:
+            raise IndexError('The mask has {0} frames, the stack has {1}.'.format(len(index),nframes))
+        return np.nonzero(index)[0]
+    index = index.astype(np.int64)
+    if np.any((index < -nframes) | (index >= nframes)):
+        raise IndexError('Frames out of range ({0} frames).'.format(nframes))
+    return np.where(index < 0,index + nframes,index)
+
 class TiffStack(object):
-    def __init__(self,filenames):
+    def __init__(self,filenames, cache_bytes = 512*1024**2, prefetch = False):
+        '''
+        Frames from a list of multipage tiff files (or a folder), decoded page by page.
+        Decoded pages are kept in an LRU cache of up to cache_bytes;
+        with prefetch, reading frames in order decodes the next file on a background thread.
+
+        stack = TiffStack(sorted(glob('run000_*.tif')), prefetch = True)
+        frame = stack[1000]
+        '''
         if type(filenames) is str:
             filenames = np.sort(glob(pjoin(filenames,'*.tif')))
         
@@ -1040,40 +2089,334 @@ class TiffStack(object):
         self.framesOffset = np.hstack([0,np.cumsum(self.framesPerFile[:-1])])
         self.nFrames = np.sum(framesPerFile)
         self.curfile = 0
-        self.curstack = self.files[self.curfile].asarray()
-        N,self.h,self.w = self.curstack.shape[:3]
-        self.dtype = self.curstack.dtype
+        page = self.files[0].pages[0]
+        self.h,self.w = page.shape[:2]
+        self.dtype = page.dtype
         self.shape = (self.nFrames,self.shape[1],self.shape[2])
+        # decoded pages (fileidx,frameidx): frame, least recently used first
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cache_nbytes = 0
+        self._lock = threading.Lock()
+        self.prefetch = prefetch
+        self._prefetcher = None
+        self._prefetched = dict() # file: future
+        self._lastframe = None
+        self._run = 0
+        self._framebytes = page.size*np.dtype(self.dtype).itemsize
+
     def getFrameIndex(self,frame):
-        '''Computes the frame index from multipage tiff files.'''
-        fileidx = np.where(self.framesOffset <= frame)[0][-1]
+        '''Computes the frame index from multipage tiff files (frame can be an array).'''
+        fileidx = np.searchsorted(self.framesOffset,frame,side = 'right') - 1
         return fileidx,frame - self.framesOffset[fileidx]
-    def __getitem__(self,*args):
-        index  = args[0]
-        if not type(index) is int:
-            Z, X, Y = index
-            if type(Z) is slice:
-                index = range(Z.start, Z.stop, Z.step)
-            else:
-                index = Z
-        else:
-            index = [index]
-        img = np.empty((len(index),self.h,self.w),dtype = self.dtype)
-        for i,ind in enumerate(index):
-            img[i,:,:] = self.getFrame(ind)
-        return np.squeeze(img)
+
+    def __getitem__(self,index):
+        '''
+        Numpy style indexing: stack[Z], stack[Z,X,Y]
+        Z can be an int, a slice or an array of frames; X and Y crop each frame.
+        Frames are grouped by file so each file is read once.
+        '''
+        if not type(index) is tuple:
+            index = (index,)
+        # None for X or Y reads the whole axis
+        crop = tuple(slice(None) if c is None else c for c in index[1:3])
+        crop += (slice(None),)*(2 - len(crop))
+        frames = _stack_frames(index[0],self.nFrames)
+        if np.ndim(frames) == 0:
+            return np.array(self.getFrame(frames)[crop])
+        cropshape = np.empty((self.h,self.w),dtype = np.uint8)[crop].shape
+        img = np.empty((len(frames),*cropshape),dtype = self.dtype)
+        if not len(frames):
+            return img
+        fileidx,frameidx = self.getFrameIndex(frames)
+        if np.all(np.diff(frames) == 1):
+            self._advance(int(frames[0]),int(frames[-1]))
+            if self.prefetch and self._run >= 8:
+                self._prefetch_next(int(fileidx[-1]))
+        for f in np.unique(fileidx):
+            sel = np.where(fileidx == f)[0]
+            missing = []
+            for i in sel:
+                frame = self._cache_get((int(f),int(frameidx[i])))
+                if frame is None:
+                    missing.append(i)
+                else:
+                    img[i] = frame[crop]
+            if len(missing) and self._wait_prefetch(f):
+                missing,waiting = [],missing
+                for i in waiting:
+                    frame = self._cache_get((int(f),int(frameidx[i])))
+                    if frame is None:
+                        missing.append(i)
+                    else:
+                        img[i] = frame[crop]
+            if len(missing):
+                pages = [int(p) for p in frameidx[missing]]
+                fd = self._open(f)
+                data = fd.asarray(key = pages).reshape((len(pages),*fd.pages[pages[0]].shape))
+                for i,page,frame in zip(missing,pages,data):
+                    self._cache_put((int(f),page),frame)
+                    img[i] = frame[crop]
+        return img
+
+    def _cache_get(self,key):
+        with self._lock:
+            frame = self._cache.get(key)
+            if not frame is None:
+                self._cache.move_to_end(key)
+            return frame
+
+    def _cache_put(self,key,frame):
+        with self._lock:
+            if key in self._cache.keys():
+                return
+            self._cache[key] = frame
+            self._cache_nbytes += frame.nbytes
+            while self._cache_nbytes > self.cache_bytes and len(self._cache) > 1:
+                key,old = self._cache.popitem(last = False)
+                self._cache_nbytes -= old.nbytes
+
+    def _open(self,fileidx):
+        if self.files[fileidx] is None:
+            self.files[fileidx] = TiffFile(self.filenames[fileidx])
+        return self.files[fileidx]
+
+    def _decode(self,fd,fileidx,start,stop):
+        # decodes pages start to stop of a file in one go and keeps them in the cache
+        frames = fd.asarray(key = range(start,stop))
+        frames = frames.reshape((stop - start,*fd.pages[start].shape))
+        for i,frame in enumerate(frames):
+            self._cache_put((int(fileidx),start + i),frame)
+        return frames[0]
+
+    def _prefetch_file(self,fileidx):
+        # background thread, with its own file handle
+        try:
+            with TiffFile(self.filenames[fileidx]) as fd:
+                self._decode(fd,fileidx,0,len(fd.pages))
+        except Exception as err:
+            display('[TiffStack] Could not prefetch {0}: {1}'.format(self.filenames[fileidx],err))
+
+    def _prefetch_next(self,fileidx):
+        nextfile = fileidx + 1
+        if nextfile >= len(self.filenames) or int(nextfile) in self._prefetched.keys():
+            return
+        # do not push the current file out of the cache
+        if 2*self.framesPerFile[fileidx]*self._framebytes > self.cache_bytes:
+            return
+        if self._prefetcher is None:
+            self._prefetcher = ThreadPoolExecutor(max_workers = 1,
+                                                  thread_name_prefix = 'tiffstack prefetch')
+        self._prefetched[int(nextfile)] = self._prefetcher.submit(self._prefetch_file,nextfile)
+
+    def _advance(self,first,last):
+        # sequential reads: how many frames were read in order (frames first to last were read now)
+        if not self._lastframe is None and first == self._lastframe + 1:
+            self._run += last - first + 1
+        elif not (first == last and first == self._lastframe):
+            self._run = last - first
+            # jumped, prefetch again when reading in order
+            self._prefetched = dict([(k,f) for k,f in self._prefetched.items() if not f.done()])
+        self._lastframe = last
+
+    def _wait_prefetch(self,fileidx):
+        # waits for the prefetcher if it is decoding the file, True if it was
+        future = self._prefetched.get(int(fileidx))
+        if future is None:
+            return False
+        future.result()
+        return True
+
     def getFrame(self,frame):
         ''' Returns a single frame from the stack '''
         fileidx,frameidx = self.getFrameIndex(frame)
-        if not fileidx == self.curfile:
-            if self.files[fileidx] is None:
-                self.files[fileidx] = TiffFile(self.filenames[fileidx])
-            self.curstack = self.files[fileidx].asarray()
-            self.curfile = fileidx
-        return self.curstack[frameidx,:,:]
+        self._advance(frame,frame)
+        if self.prefetch and self._run >= 8:
+            self._prefetch_next(fileidx)
+        self.curfile = fileidx
+        key = (int(fileidx),int(frameidx))
+        img = self._cache_get(key)
+        if img is None and self._wait_prefetch(fileidx):
+            img = self._cache_get(key)
+        if img is None:
+            fd = self._open(fileidx)
+            stop = int(frameidx) + 1
+            # read ahead as the sequential run grows, up to half the cache
+            readahead = min(self._run,int(self.cache_bytes//(2*self._framebytes)))
+            stop = min(len(fd.pages),stop + readahead)
+            img = self._decode(fd,fileidx,int(frameidx),stop)
+        return img
+
     def __len__(self):
         return self.nFrames
 
+    def close(self):
+        if not self._prefetcher is None:
+            self._prefetcher.shutdown()
+            self._prefetcher = None
+        for f in self.files:
+            if not f is None:
+                f.close()
+        self._cache.clear()
+        self._cache_nbytes = 0
+
+FRAME_INDEX_DTYPE = np.dtype([('frame_id',np.int64),
+                              ('file',np.int64),      # file number in the run (line of the .files list)
+                              ('offset',np.int64),    # bytes for binary files, page or frame for the others
+                              ('timestamp',np.float64)])
+FRAME_INDEX_EXTENSION = '.frameidx'
+
+class FrameIndexWriter(object):
+    def __init__(self, filename, batchsize = 256):
+        '''
+        Sidecar index of a run, one FRAME_INDEX_DTYPE record per saved frame,
+        appended in batches of batchsize frames.
+        The files of the run are listed in filename + '.files' (line number is the file number).
+        '''
+        self.filename = filename
+        self.fd = open(filename,'wb')
+        self.filesfd = open(filename + '.files','w',encoding = 'utf-8')
+        self.nfiles = 0
+        self.buffer = np.zeros(batchsize,dtype = FRAME_INDEX_DTYPE)
+        self.nbuffer = 0
+
+    def add_file(self, filename):
+        self.flush() # the frames before are in the previous file
+        try:
+            filename = os.path.relpath(filename,os.path.dirname(os.path.abspath(self.filename)))
+        except ValueError: # other drive
+            filename = os.path.abspath(filename)
+        self.filesfd.write(filename + '\n')
+        self.filesfd.flush()
+        self.nfiles += 1
+
+    def append(self, frameids, offsets, timestamps):
+        frameids = np.asarray(frameids)
+        offsets = np.asarray(offsets)
+        timestamps = np.asarray(timestamps)
+        start = 0
+        while start < len(frameids):
+            n = min(len(frameids) - start,len(self.buffer) - self.nbuffer)
+            records = self.buffer[self.nbuffer:self.nbuffer + n]
+            records['frame_id'] = frameids[start:start + n]
+            records['file'] = self.nfiles - 1
+            records['offset'] = offsets[start:start + n]
+            records['timestamp'] = timestamps[start:start + n]
+            self.nbuffer += n
+            start += n
+            if self.nbuffer == len(self.buffer):
+                self.flush()
+
+    def flush(self):
+        if self.nbuffer:
+            self.fd.write(self.buffer[:self.nbuffer].tobytes())
+            self.fd.flush()
+            self.nbuffer = 0
+
+    def close(self):
+        self.flush()
+        self.fd.close()
+        self.filesfd.close()
+
+class FrameIndex(object):
+    def __init__(self, filename):
+        '''
+        Reads the sidecar frame index of a run to get frames by frame id or by time
+        without parsing the camlog (pass the .frameidx or the .camlog file).
+
+        idx = FrameIndex('run000_00000000.camlog')
+        filename,offset,timestamp = idx.locate(1000)
+        frames = idx.get_frames([1000,1001])            # binary, tiff and hdf5 files
+        records = idx.time_range(10.,20.)               # frame_id, file, offset, timestamp
+        frames = idx.get_frames(records['frame_id'])
+        '''
+        if filename.endswith('.camlog'):
+            filename = filename.replace('.camlog',FRAME_INDEX_EXTENSION)
+        self.filename = filename
+        if os.path.getsize(filename):
+            self.records = np.memmap(filename,dtype = FRAME_INDEX_DTYPE,mode = 'r')
+        else:
+            self.records = np.zeros(0,dtype = FRAME_INDEX_DTYPE)
+        folder = os.path.dirname(os.path.abspath(filename))
+        with open(filename + '.files','r',encoding = 'utf-8') as fd:
+            self.filenames = [pjoin(folder,f.strip('\n')) for f in fd if len(f.strip())]
+        frameids = self.records['frame_id']
+        # no frames lost: the position of a frame is its id minus the first id
+        self.contiguous = bool(len(frameids) and
+                               frameids[-1] - frameids[0] == len(frameids) - 1 and
+                               np.all(np.diff(frameids) == 1))
+        self._files = dict()
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, frameids):
+        '''Positions of frame ids in the index (-1 if the frame was not saved).'''
+        frameids = np.atleast_1d(np.asarray(frameids,dtype = np.int64))
+        allids = self.records['frame_id']
+        if not len(allids):
+            return -np.ones(len(frameids),dtype = np.int64)
+        if self.contiguous:
+            idx = frameids - allids[0]
+        else:
+            idx = np.searchsorted(allids,frameids)
+        idx = np.clip(idx,0,len(allids) - 1)
+        idx[allids[idx] != frameids] = -1
+        return idx
+
+    def locate(self, frameid):
+        '''File, offset and timestamp of a frame.'''
+        i = self.find(frameid)[0]
+        if i < 0:
+            raise KeyError('Frame {0} is not in {1}'.format(frameid,self.filename))
+        record = self.records[i]
+        return self.filenames[record['file']],int(record['offset']),float(record['timestamp'])
+
+    def time_range(self, tstart, tstop):
+        '''Records of the frames with tstart <= timestamp < tstop (camera timestamps).'''
+        timestamps = self.records['timestamp']
+        return np.array(self.records[np.searchsorted(timestamps,tstart,side = 'left'):
+                                     np.searchsorted(timestamps,tstop,side = 'left')])
+
+    def _open(self, ifile):
+        if not ifile in self._files.keys():
+            filename = self.filenames[ifile]
+            if filename.endswith('.dat'):
+                self._files[ifile] = mmap_dat(filename)
+            elif filename.endswith('.tif'):
+                self._files[ifile] = TiffFile(filename)
+            elif filename.endswith('.h5'):
+                import hdf5plugin # the blosc filter
+                import h5py
+                self._files[ifile] = h5py.File(filename,'r')
+            else:
+                raise NotImplementedError(
+                    'Can not read frames from {0}, use the offsets with a video reader.'.format(filename))
+        return self._files[ifile]
+
+    def _read(self, ifile, offset):
+        fd = self._open(ifile)
+        if isinstance(fd,np.memmap):
+            return np.array(fd[offset // (fd.itemsize*int(np.prod(fd.shape[1:])))])
+        if isinstance(fd,TiffFile):
+            return fd.pages[offset].asarray()
+        return fd['frames'][offset]
+
+    def get_frames(self, frameids):
+        '''Reads frames from the files of the run (N,...).'''
+        idx = self.find(frameids)
+        if np.any(idx < 0):
+            raise KeyError('Frames {0} are not in {1}'.format(
+                np.atleast_1d(frameids)[idx < 0],self.filename))
+        records = self.records[idx]
+        return np.stack([self._read(int(r['file']),int(r['offset'])) for r in records])
+
+    def close(self):
+        for fd in self._files.values():
+            if hasattr(fd,'close'):
+                fd.close()
+        self._files = dict()
+
 def mmap_dat(filename,
              mode = 'r',
              nframes = None,
@@ -1122,6 +2465,167 @@ def mmap_dat(filename,
                      shape = (int(nframes),*shape))
 
 
+def _split_dat_name(filename):
+    # (prefix, file number, _NCHANNELS_H_W_DTYPE.dat) of a binary file of a run
+    folder,name = os.path.split(filename)
+    meta = os.path.splitext(name)[0].split('_')
+    nmeta = 4 if len(meta) > 4 and meta[-4].isdigit() else 3
+    if len(meta) <= nmeta or not len(meta[-nmeta-1]) == 8 or not meta[-nmeta-1].isdigit():
+        return None
+    return (pjoin(folder,'_'.join(meta[:-nmeta-1])),
+            meta[-nmeta-1],
+            '_' + '_'.join(meta[-nmeta:]) + '.dat')
+
+def binary_run_files(filename):
+    '''
+    Lists the binary files of a run (recorded with framesperfile > 0).
+    Pass one of the .dat files, the .camlog or the .frameidx of the run.
+    '''
+    for ext in ['.camlog',FRAME_INDEX_EXTENSION]:
+        if filename.endswith(ext):
+            filesname = filename[:-len(ext)] + FRAME_INDEX_EXTENSION + '.files'
+            if os.path.isfile(filesname):
+                folder = os.path.dirname(os.path.abspath(filesname))
+                with open(filesname,'r',encoding = 'utf-8') as fd:
+                    return [pjoin(folder,f.strip('\n')) for f in fd
+                            if f.strip().endswith('.dat')]
+            # the first file has the number of the camlog
+            filename = filename[:-len(ext)]
+            filenames = sorted(glob(glob_escape(filename) + '_*.dat'))
+            if not len(filenames):
+                raise OSError('No binary files found for {0}.'.format(filename))
+            filename = filenames[0]
+    parts = _split_dat_name(filename)
+    if parts is None: # not split in files
+        return [filename]
+    prefix,number,suffix = parts
+    return sorted(glob(glob_escape(prefix) + '_' + '[0-9]'*8 + glob_escape(suffix)))
+
+class BinaryStack(object):
+    def __init__(self, filenames, camlog = None):
+        '''
+        The binary files of a run as one (NFRAMES,NCHANNELS,H,W) array.
+        Files are memory mapped only when frames are read from them.
+
+        stack = BinaryStack('20200710_run000_00000000_2_540_640_uint16.dat')  # or the .camlog
+        frames = stack[1000:2000:10,0]       # slices across files, only these frames are read
+        frames = stack.time_range(10.,20.)   # frames between camera timestamps 10 and 20 s
+
+        filenames can also be the list of .dat files; the camlog (or frame index) of the run
+        is found next to the first file if not given.
+        '''
+        if type(filenames) is str:
+            filenames = binary_run_files(filenames)
+        self.filenames = list(filenames)
+        if not len(self.filenames):
+            raise OSError('No binary files to read.')
+        for f in self.filenames:
+            if not os.path.isfile(f):
+                raise OSError('File {0} not found.'.format(f))
+        # all files of a run have the same frame shape
+        meta = os.path.splitext(self.filenames[0])[0].split('_')
+        try:
+            self.frame_shape = tuple(int(m) for m in meta[-4:-1])
+        except ValueError:
+            self.frame_shape = tuple(int(m) for m in meta[-3:-1])
+        self.dtype = np.dtype(meta[-1])
+        self.frame_nbytes = int(np.prod(self.frame_shape))*self.dtype.itemsize
+        self.framesPerFile = np.array([os.path.getsize(f)//self.frame_nbytes
+                                       for f in self.filenames],dtype = np.int64)
+        self.framesOffset = np.hstack([0,np.cumsum(self.framesPerFile)[:-1]]).astype(np.int64)
+        self.nFrames = int(np.sum(self.framesPerFile))
+        self.shape = (self.nFrames,*self.frame_shape)
+        if camlog is None:
+            parts = _split_dat_name(self.filenames[0])
+            if not parts is None:
+                camlog = parts[0] + '_' + parts[1] + '.camlog'
+        self.camlog = camlog
+        self.frame_id = None
+        self.timestamps = None
+        self._maps = dict()
+
+    def __len__(self):
+        return self.nFrames
+
+    def _map(self,fileidx):
+        if not fileidx in self._maps.keys():
+            self._maps[fileidx] = mmap_dat(self.filenames[fileidx],
+                                           nframes = self.framesPerFile[fileidx],
+                                           shape = self.frame_shape,
+                                           dtype = self.dtype)
+        return self._maps[fileidx]
+
+    def getFrameIndex(self,frame):
+        '''File and frame in the file (frame can be an array).'''
+        fileidx = np.searchsorted(self.framesOffset,frame,side = 'right') - 1
+        return fileidx,frame - self.framesOffset[fileidx]
+
+    def __getitem__(self,index):
+        '''
+        Numpy style indexing: stack[Z], stack[Z,C,Y,X]
+        A single frame or a slice inside one file is a view of the memory map,
+        the other indices copy only the selected frames.
+        '''
+        if not type(index) is tuple:
+            index = (index,)
+        Z,crop = index[0],tuple(index[1:])
+        frames = _stack_frames(Z,self.nFrames)
+        fileidx,frameidx = self.getFrameIndex(frames)
+        if np.ndim(frames) == 0:
+            return self._map(int(fileidx))[(int(frameidx),*crop)]
+        if not len(frames):
+            return np.empty((0,*self.frame_shape),dtype = self.dtype)[(slice(None),*crop)]
+        if type(Z) is slice and fileidx[0] == fileidx[-1]:
+            step = Z.indices(self.nFrames)[2]
+            stop = int(frameidx[-1]) + (1 if step > 0 else -1)
+            return self._map(int(fileidx[0]))[(slice(int(frameidx[0]),
+                                                     stop if stop >= 0 else None,
+                                                     step),*crop)]
+        img = None
+        for f in np.unique(fileidx):
+            sel = np.where(fileidx == f)[0]
+            data = self._map(int(f))[(frameidx[sel],*crop)]
+            if img is None:
+                img = np.empty((len(frames),*data.shape[1:]),dtype = self.dtype)
+            img[sel] = data
+        return img
+
+    def load_camlog(self):
+        '''
+        Reads the frame ids and timestamps of the frames in the stack
+        (from the frame index of the run if there is one, otherwise from the camlog).
+        '''
+        if self.camlog is None:
+            raise OSError('No camlog for {0}.'.format(self.filenames[0]))
+        indexname = self.camlog.replace('.camlog',FRAME_INDEX_EXTENSION)
+        if os.path.isfile(indexname):
+            idx = FrameIndex(indexname)
+            records = np.array(idx.records[:self.nFrames])
+            idx.close()
+            frame_id,timestamps = records['frame_id'],records['timestamp']
+        else:
+            logdata,comments = parseCamLog(self.camlog, cache = True)
+            logdata = logdata.iloc[:self.nFrames]
+            frame_id = logdata.iloc[:,0].values.astype(np.int64)
+            timestamps = logdata.iloc[:,1].values.astype(np.float64)
+        if len(frame_id) < self.nFrames:
+            display('[BinaryStack] The camlog has {0} frames, the stack has {1}.'.format(
+                len(frame_id),self.nFrames))
+        self.frame_id = frame_id
+        self.timestamps = timestamps
+        return frame_id,timestamps
+
+    def time_range(self,tstart,tstop):
+        '''Frames with tstart <= timestamp < tstop (camera timestamps).'''
+        if self.timestamps is None:
+            self.load_camlog()
+        return self[np.searchsorted(self.timestamps,tstart,side = 'left'):
+                    np.searchsorted(self.timestamps,tstop,side = 'left')]
+
+    def close(self):
+        self._maps = dict()
+
+
 def stack_to_mj2_lossless(stack,fname, rate = 30):
     '''
     Compresses a uint16 stack with FFMPEG and libopenjpeg
@@ -33,7 +33,6 @@ class NIDAQ(object):
         '''
         # Events to interface with cameras
         self.camera_ready = Event()
-        self.close_event = Event()
         self.eventsQ = Queue() # not used now.
         self.recorder = None # not used now.
         self.device = device
@@ -45,11 +44,14 @@ class NIDAQ(object):
         self.save_trigger = save_trigger
 
         if self.start_trigger is None:
-            self.start_trigger = Event()
+            self.start_trigger = TriggerEvent()
+        # the triggers share a condition to wait on all of them
+        condition = getattr(self.start_trigger,'condition',None)
         if self.stop_trigger is None:
-            self.stop_trigger = Event()
+            self.stop_trigger = TriggerEvent(condition)
         if self.save_trigger is None:
-            self.save_trigger = Event()
+            self.save_trigger = TriggerEvent(condition)
+        self.close_event = TriggerEvent(condition)
         self.ai_range = ai_range
         self.digital_channels = digital
         self.analog_channels = analog
@@ -137,9 +139,10 @@ class NIDAQ(object):
     def _waitsoftwaretrigger(self):
         '''wait for software trigger'''
         display('[{0}] waiting for software trigger.'.format('nidaq'))
+        triggers = [self.start_trigger,self.stop_trigger,self.close_event]
         while (not self.start_trigger.is_set()):
-            # limits resolution to 1 ms 
-            time.sleep(0.001)
+            # wakes up on the triggers, checks the commands every 100 ms
+            wait_any(triggers, timeout = 0.1)
             self._parse_command_queue()
             if self.was_saving:
                 display("Closing nidaq file.")
@@ -168,6 +171,9 @@ class NIDAQ(object):
         if not self.task_di is None:
             self.di_reader.read_all_avail_samp = True
 
+    def send_command(self,cmd):
+        self.eventsQ.put(cmd)
+
     def _parse_command_queue(self):
         if not self.eventsQ.empty():
             cmd = self.eventsQ.get()
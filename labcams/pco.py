@@ -42,7 +42,8 @@ class PCOCam(GenericCam):
                                     start_trigger = start_trigger,
                                     stop_trigger = stop_trigger,
                                     save_trigger = save_trigger,
-                                    recorderpar = recorderpar)
+                                    recorderpar = recorderpar,
+                                    **kwargs)
         self.armed = False
         self.drivername = 'PCO'
         self.exposure = exposure
@@ -65,6 +66,9 @@ class PCOCam(GenericCam):
         else:
             self.nchan.value = frame.shape
         self.dtype = dtype
+        # the frame rate is needed to size the ring in seconds
+        self.frame_rate = 1000.0/float(self.exposure)
+        self.fs.value = self.frame_rate
         self._init_variables(dtype)
 
         self.hardware_trigger = hardware_trigger
@@ -72,8 +76,6 @@ class PCOCam(GenericCam):
             self.hardware_trigger = Event()
 
         self.trigger_source = trigger_source
-        self.frame_rate = 1000.0/float(self.exposure)
-        self.fs.value = self.frame_rate
         display("[PCO {0}] Got info from camera".format(
              self.cam_id))
 
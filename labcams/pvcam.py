@@ -47,7 +47,8 @@ class PVCam(GenericCam):
                                    start_trigger = start_trigger,
                                    stop_trigger = stop_trigger,
                                    save_trigger = save_trigger,
-                                   recorderpar=recorderpar)
+                                   recorderpar=recorderpar,
+                                   **kwargs)
         self.drivername = 'PVCam'
         self.trigerMode = 0
         self.exposure = exposure
@@ -76,6 +77,9 @@ class PVCam(GenericCam):
         else:
             self.nchan.value = frame.shape
         self.dtype = dtype
+        # the frame rate is needed to size the ring in seconds
+        self.frame_rate = 1000.0/float(self.exposure)
+        self.fs.value = self.frame_rate
         self._init_variables(dtype)
 
         self.hardware_trigger = hardware_trigger
@@ -83,8 +87,6 @@ class PVCam(GenericCam):
             self.hardware_trigger = Event()
 
         self.trigger_source = trigger_source
-        self.frame_rate = 1000.0/float(self.exposure)
-        self.fs.value = self.frame_rate
 
         self._dll = None
         display("[PVCam {0}] Got info from camera".format(
@@ -155,18 +157,20 @@ class PVCam(GenericCam):
     def _cam_stopacquisition(self, clean_buffers = True):
         self.cam.finish()
         
-    def _cam_loop(self):
+    def _cam_loop_into(self,dest):
         f, fps, frame_count = self.cam.poll_frame(oldestFrame=True,
                                                   copyData=False)
-        frame = f['pixel_data'].copy()
+        # single copy, from the driver buffer to the ring
+        frame = f['pixel_data']
+        self._frame_ready()
+        np.copyto(dest.reshape(frame.shape),frame)
         frameID = int(f['meta_data']['frame_header']['frameNr'])
         tstamp = int(f['meta_data']['frame_header']['timestampBOF'])
         if frameID != self.iframe+1:
             print('The number of buffers can needs to be increased??\n Got frame {0}; expected {1}!'.format(self.iframe,frameID))
         self.iframe = frameID
 
-        return frame,(frameID,tstamp)
-        return None,(None,None)
+        return dest,(frameID,tstamp)
     
     def _cam_close(self):
         display('PVCam [{0}] - Closing camera.'.format(self.cam_id))
@@ -175,4 +179,4 @@ class PVCam(GenericCam):
         self.save_trigger.clear()
         if self.was_saving:
             self.was_saving = False
-            self.queue.put(['STOP'])
+            self._stop_recorder()
@@ -46,7 +46,8 @@ class QImagingCam(GenericCam):
                                          start_trigger = start_trigger,
                                          stop_trigger = stop_trigger,
                                          save_trigger = save_trigger,    
-                                         recorderpar = recorderpar)
+                                         recorderpar = recorderpar,
+                                         **kwargs)
         self.hardware_trigger = hardware_trigger
         if self.hardware_trigger is None:
             self.hardware_trigger = Event()
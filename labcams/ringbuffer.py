@@ -0,0 +1,352 @@
+#  labcams - https://jpcouto@bitbucket.org/jpcouto/labcams.git
+# Copyright (C) 2020 Joao Couto - jpcouto@gmail.com
+#
+#  This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Lock-free frame ring in shared memory.
+# There is a single producer (the camera process) and any number of readers
+# (writers, the GUI, plugins). Each slot has a sequence counter that the
+# producer makes odd while writing and even when done (a seqlock), readers
+# check the counter before and after copying and retry when the read was torn.
+# The camera never waits for a consumer.
+# Next to the frames there is a table with the metadata of each slot
+# (frame id, hardware and host timestamps, line status), so consumers can read
+# metadata without going through a multiprocessing queue.
+# The IndexQueue tells a writer which frames to save, also without pickling.
+import time
+from datetime import datetime, timedelta
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+RING_ALIGNMENT = 4096 # frames start on a page boundary
+
+# one record per ring slot; linestat is -1 when the camera does not report it.
+# timestamp is in seconds (or ticks) as a float, timestamp_ticks keeps the
+# timestamps the drivers give as integers (hardware tick counters) or as
+# datetimes (microseconds since 1970) exact, so the camlog is written as before.
+TIMESTAMP_FLOAT = 0
+TIMESTAMP_INT = 1
+TIMESTAMP_DATETIME = 2
+TIMESTAMP_NONE = 3
+FRAME_METADATA_DTYPE = np.dtype([('frame_id',np.int64),
+                                 ('timestamp',np.float64),
+                                 ('host_timestamp',np.float64),
+                                 ('linestat',np.int64),
+                                 ('timestamp_ticks',np.int64),
+                                 ('timestamp_kind',np.int64)])
+
+def _align(nbytes, alignment = RING_ALIGNMENT):
+    return int(np.ceil(nbytes/alignment)*alignment)
+
+def ring_layout(nbytes, shape, dtype):
+    '''
+    Computes how many slots of a given shape fit in a shared memory block.
+
+    The block has one int64 sequence counter per slot, then the metadata table
+    and (page aligned) the frames.
+
+    Inputs:
+        nbytes (int)         : size of the shared memory block
+        shape (list|tuple)   : frame dimensions (H, W, NCHANNELS)
+        dtype                : frame datatype
+    Returns:
+        nbuffers, offset of the metadata table, offset of the frames
+    '''
+    framesize = int(np.prod(shape))*np.dtype(dtype).itemsize
+    slotheader = np.dtype(np.int64).itemsize + FRAME_METADATA_DTYPE.itemsize
+    nbuffers = int(nbytes // (framesize + slotheader))
+    # make room for the page alignment of the frames
+    while nbuffers > 0 and (_align(nbuffers*slotheader) + nbuffers*framesize) > nbytes:
+        nbuffers -= 1
+    return nbuffers, nbuffers*8, _align(nbuffers*slotheader)
+
+def ring_nbytes(nbuffers, shape, dtype):
+    '''
+    Size of the shared memory block needed for nbuffers slots (see ring_layout).
+    '''
+    framesize = int(np.prod(shape))*np.dtype(dtype).itemsize
+    slotheader = np.dtype(np.int64).itemsize + FRAME_METADATA_DTYPE.itemsize
+    return _align(int(nbuffers)*slotheader) + int(nbuffers)*framesize
+
+_EPOCH = datetime(1970,1,1)
+
+def _timestamp_fields(timestamp):
+    # (float, exact ticks, kind) of a driver timestamp
+    if timestamp is None:
+        return np.nan,0,TIMESTAMP_NONE
+    if isinstance(timestamp,datetime):
+        ticks = (timestamp.replace(tzinfo = None) - _EPOCH)//timedelta(microseconds = 1)
+        return timestamp.timestamp(),ticks,TIMESTAMP_DATETIME
+    if isinstance(timestamp,(int,np.integer)) and not isinstance(timestamp,bool):
+        return float(timestamp),int(timestamp),TIMESTAMP_INT
+    return float(timestamp),0,TIMESTAMP_FLOAT
+
+def metadata_record(metadata, host_timestamp = np.nan):
+    '''Ring metadata record (FRAME_METADATA_DTYPE fields) from (frame_id, timestamp[, linestat]).'''
+    linestat = -1
+    if len(metadata) > 2 and not metadata[2] is None:
+        linestat = int(metadata[2])
+    timestamp,ticks,kind = _timestamp_fields(metadata[1])
+    return (int(metadata[0]),timestamp,host_timestamp,linestat,ticks,kind)
+
+def driver_timestamp(timestamp, ticks, kind):
+    '''The timestamp of a record as the driver gave it (int, datetime, None or float).'''
+    if kind == TIMESTAMP_INT:
+        return int(ticks)
+    if kind == TIMESTAMP_DATETIME:
+        return _EPOCH + timedelta(microseconds = int(ticks))
+    if kind == TIMESTAMP_NONE:
+        return None
+    return float(timestamp)
+
+class FrameRing(object):
+    def __init__(self, buf, nbytes, shape, dtype):
+        '''
+        Frame ring on top of a shared memory buffer.
+
+        ring = FrameRing(membuffer.buf, membuffer_len, [H, W, NCHANNELS], dtype)
+        '''
+        self.shape = tuple([int(s) for s in shape])
+        self.dtype = np.dtype(dtype)
+        self.nbuffers, metaoffset, offset = ring_layout(nbytes, self.shape, self.dtype)
+        if self.nbuffers < 1:
+            raise ValueError('Shared memory is too small for a {0} {1} frame.'.format(
+                self.shape, self.dtype))
+        self.seq = np.ndarray([self.nbuffers],
+                              buffer = buf,
+                              dtype = np.int64)
+        self.meta = np.ndarray([self.nbuffers],
+                               buffer = buf,
+                               offset = metaoffset,
+                               dtype = FRAME_METADATA_DTYPE)
+        self.imgs = np.ndarray([self.nbuffers,*self.shape],
+                               buffer = buf,
+                               offset = offset,
+                               dtype = self.dtype)
+
+    def index(self,frame_index):
+        return int(frame_index) % self.nbuffers
+
+    def begin_write(self, frame_index):
+        '''
+        Marks the slot of a frame as being written and returns (slot, view)
+        so the frame can be copied (or decoded) straight into the ring.
+        Must be followed by end_write or abort_write (producer side only).
+        '''
+        idx = self.index(frame_index)
+        self.seq[idx] += 1 # odd: write in progress
+        return idx, self.imgs[idx]
+
+    def end_write(self, idx, metadata, host_timestamp = None):
+        '''Stores the metadata (frame_id, timestamp[, linestat]) and releases the slot.'''
+        if host_timestamp is None:
+            host_timestamp = time.time()
+        self.meta[idx] = metadata_record(metadata,host_timestamp)
+        self.seq[idx] += 1
+
+    def abort_write(self, idx, invalidate = True):
+        '''Releases a slot without storing a frame; invalidate if the pixels were touched.'''
+        if invalidate:
+            self.meta[idx]['frame_id'] = -1
+        self.seq[idx] += 1
+
+    def write(self, frame, metadata, host_timestamp = None):
+        '''
+        Copies a frame and its metadata (frame_id, timestamp[, linestat])
+        to the ring (producer side only).
+        '''
+        idx, dest = self.begin_write(metadata[0])
+        if len(frame.shape) == 2:
+            dest[:,:,0] = frame
+        else:
+            dest[:] = frame
+        self.end_write(idx, metadata, host_timestamp)
+        return idx
+
+    def read(self, frame_index, out = None, retries = 100):
+        '''
+        Copies a frame out of the ring, retrying if the producer
+        was writing to the slot. Returns None if no consistent copy was possible.
+        '''
+        idx = self.index(frame_index)
+        if out is None:
+            out = np.empty(self.shape, dtype = self.dtype)
+        for i in range(retries):
+            seq = self.seq[idx]
+            if seq & 1:
+                continue
+            out[:] = self.imgs[idx]
+            if self.seq[idx] == seq:
+                return out
+        return None
+
+    def read_metadata(self, frame_index, retries = 100):
+        '''Copy of the metadata record of a slot (None if it could not be read).'''
+        idx = self.index(frame_index)
+        for i in range(retries):
+            seq = self.seq[idx]
+            if seq & 1:
+                continue
+            rec = self.meta[idx].copy()
+            if self.seq[idx] == seq:
+                return rec
+        return None
+
+    def prefault(self, write = False):
+        '''
+        Touches every page of the ring so that page faults happen now and not
+        during the first seconds of acquisition. Each process maps the block
+        on its own, so this has to run in the process that uses the ring.
+        The producer should use write = True (the slots are rewritten with
+        their own contents).
+        '''
+        for arr in [self.seq, self.meta, self.imgs]:
+            pages = arr.reshape(-1).view(np.uint8)[::RING_ALIGNMENT]
+            if write:
+                pages[:] = pages
+            else:
+                pages.sum()
+
+    def metadata_tuple(self, record):
+        '''Converts a record to the (frame_id, timestamp[, linestat]) camlog tuple.'''
+        timestamp = driver_timestamp(record['timestamp'],
+                                     record['timestamp_ticks'],
+                                     record['timestamp_kind'])
+        if record['linestat'] < 0:
+            return (int(record['frame_id']),timestamp)
+        return (int(record['frame_id']),timestamp,int(record['linestat']))
+
+    def close(self):
+        # release the views so the shared memory can be closed.
+        del self.seq
+        del self.meta
+        del self.imgs
+
+class IndexQueue(object):
+    # positions of the counters in the control block (one cache line each)
+    _HEAD = 0
+    _TAIL = 8
+    _WAITING = 16
+    _DROPPED = 24
+    _NCONTROL = 32
+    def __init__(self, capacity = 4096, name = None):
+        '''
+        Single-producer/single-consumer queue of frame indices in shared memory.
+
+        The producer (camera) only moves the head, the consumer (writer) only
+        moves the tail, so no locks are needed. A semaphore wakes the consumer
+        when it is waiting on an empty queue. When the queue is full the index
+        is dropped and counted, the producer never blocks.
+
+        q = IndexQueue(capacity)           # in the camera
+        q.put(frame_id)
+        q.wait(timeout); q.get_all()       # in the writer
+        '''
+        from multiprocessing import Semaphore
+        self.capacity = int(capacity)
+        self.nbytes = (self._NCONTROL + self.capacity)*np.dtype(np.int64).itemsize
+        if name is None:
+            name = 'idxq_{0}'.format(int(np.random.rand()*1e9))
+        self.name = name
+        self.shm = SharedMemory(name = self.name, create = True, size = self.nbytes)
+        self._owner = True
+        self.semaphore = Semaphore(0)
+        self._attach()
+        self.ctl[:] = 0
+
+    def _attach(self):
+        self.ctl = np.ndarray([self._NCONTROL],
+                              buffer = self.shm.buf,
+                              dtype = np.int64)
+        self.slots = np.ndarray([self.capacity],
+                                buffer = self.shm.buf,
+                                offset = self.ctl.nbytes,
+                                dtype = np.int64)
+        
+    def __getstate__(self):
+        return dict(name = self.name,
+                    capacity = self.capacity,
+                    nbytes = self.nbytes,
+                    semaphore = self.semaphore)
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.shm = SharedMemory(name = self.name)
+        self._owner = False
+        self._attach()
+
+    def qsize(self):
+        return int(self.ctl[self._HEAD] - self.ctl[self._TAIL])
+
+    def empty(self):
+        return self.ctl[self._HEAD] == self.ctl[self._TAIL]
+
+    @property
+    def dropped(self):
+        return int(self.ctl[self._DROPPED])
+
+    @property
+    def head(self):
+        # indices put so far, tags control messages with their place among the frames
+        return int(self.ctl[self._HEAD])
+
+    @property
+    def tail(self):
+        # indices taken so far
+        return int(self.ctl[self._TAIL])
+
+    def put(self, value):
+        '''Producer side; returns False (and counts a drop) if the queue is full.'''
+        head = self.ctl[self._HEAD]
+        if head - self.ctl[self._TAIL] >= self.capacity:
+            self.ctl[self._DROPPED] += 1
+            return False
+        self.slots[head % self.capacity] = value
+        self.ctl[self._HEAD] = head + 1
+        if self.ctl[self._WAITING]:
+            self.ctl[self._WAITING] = 0
+            self.semaphore.release()
+        return True
+
+    def get_all(self, maxitems = None):
+        '''Consumer side; returns a copy of the queued indices and frees them.'''
+        tail = int(self.ctl[self._TAIL])
+        n = int(self.ctl[self._HEAD]) - tail
+        if not maxitems is None:
+            n = min(n,maxitems)
+        if n <= 0:
+            return np.empty(0,dtype = np.int64)
+        idx = np.arange(tail,tail+n) % self.capacity
+        values = self.slots[idx]    # fancy indexing copies
+        self.ctl[self._TAIL] = tail + n
+        return values
+
+    def wait(self, timeout = None):
+        '''Consumer side; waits until there is something on the queue.'''
+        if not self.empty():
+            return True
+        self.ctl[self._WAITING] = 1
+        if not self.empty():
+            self.ctl[self._WAITING] = 0
+            return True
+        self.semaphore.acquire(timeout = timeout)
+        self.ctl[self._WAITING] = 0
+        return not self.empty()
+
+    def close(self):
+        del self.ctl
+        del self.slots
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
@@ -0,0 +1,273 @@
+#  labcams - https://jpcouto@bitbucket.org/jpcouto/labcams.git
+# Copyright (C) 2020 Joao Couto - jpcouto@gmail.com
+#
+#  This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Per-stage frame latency in shared memory.
+# Each process stamps the frames it handles with time.perf_counter
+# (a system wide clock, the same in all processes):
+#   grab     - the driver returned the frame (camera process)
+#   ring     - the frame is in the ring
+#   queue    - the frame index is on the writer queue
+#   dequeue  - the writer took the index from the queue (writer process)
+#   write    - the frame is on disk
+#   display  - the GUI showed the frame
+# The time between stages goes to log-linear (HDR-style) histograms: a rolling
+# one that covers the last window seconds and one for the whole run, that the
+# recorder dumps next to the camlog when the run is closed.
+# A histogram is only updated by the process that stamps its last stage, no locks.
+# A new run does not clear the totals (other processes write them), the run
+# histograms are the totals minus a snapshot taken when the run starts.
+import time
+import json
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+LATENCY_STAGES = ['grab','ring','queue','dequeue','write','display']
+# name: (from stage, to stage)
+LATENCY_INTERVALS = dict(ring = ('grab','ring'),
+                         queue = ('ring','queue'),
+                         wait = ('queue','dequeue'),
+                         write = ('dequeue','write'),
+                         saved = ('grab','write'),
+                         display = ('ring','display'))
+
+def _hdr_bins(lowest = 1e-6, octaves = 27, subbuckets = 16):
+    # 16 linear buckets per power of 2 from 1us to ~2 min (6% precision)
+    edges = [0.]
+    for e in range(octaves):
+        edges.extend(lowest*2**e*(1. + np.arange(subbuckets)/subbuckets))
+    return np.array(edges)
+
+LATENCY_BINS = _hdr_bins() # lower edges (s)
+# highest value in each bin, used for the percentiles
+LATENCY_BIN_VALUES = np.hstack([LATENCY_BINS[1:],LATENCY_BINS[-1]*(1. + 1./16)])
+
+def histogram_percentiles(counts, q = [50,90,99]):
+    '''
+    Percentiles (s) from a latency histogram, nan if it is empty.
+    Returns a dict with count, p50, p90, p99 and max.
+    '''
+    n = int(np.sum(counts))
+    res = dict(count = n)
+    if n == 0:
+        res.update(dict([('p{0}'.format(p),np.nan) for p in q]))
+        res['max'] = np.nan
+        return res
+    cumulative = np.cumsum(counts)
+    for p in q:
+        res['p{0}'.format(p)] = float(LATENCY_BIN_VALUES[
+            np.searchsorted(cumulative,np.ceil(n*p/100.))])
+    res['max'] = float(LATENCY_BIN_VALUES[np.nonzero(counts)[0][-1]])
+    return res
+
+class LatencyStats(object):
+    def __init__(self, nslots, window = 10., name = None):
+        '''
+        Shared memory block with the stage timestamps of the last nslots frames
+        and the latency histograms.
+
+        stats = LatencyStats(nbuffers)          # in the main process
+        stats.begin(frame_id)                   # camera, the driver returned a frame
+        stats.stamp(frame_id,'ring')            # any process, frame_id can be an array
+        stats.summary()                         # percentiles of the last window seconds
+        '''
+        self.nslots = int(nslots)
+        self.window = float(window)
+        self.nstages = len(LATENCY_STAGES)
+        self.intervals = list(LATENCY_INTERVALS.keys())
+        nintervals = len(self.intervals)
+        nbins = len(LATENCY_BINS)
+        self.nbytes = 8*(self.nslots*(self.nstages + 1) + # frame ids and timestamps
+                         nintervals*(4*nbins + 1))        # histograms and their epochs
+        if name is None:
+            name = 'latency_{0}'.format(int(np.random.rand()*1e9))
+        self.name = name
+        self.shm = SharedMemory(name = self.name, create = True, size = self.nbytes)
+        self._owner = True
+        self._attach()
+        self.frame_ids[:] = -1
+        self.times[:] = np.nan
+        self.rolling[:] = 0
+        self.total[:] = 0
+        self.run_offset[:] = 0
+        self.epochs[:] = -10
+
+    def _attach(self):
+        nintervals = len(self.intervals)
+        nbins = len(LATENCY_BINS)
+        offset = 0
+        self.frame_ids = np.ndarray([self.nslots],
+                                    buffer = self.shm.buf,
+                                    dtype = np.int64)
+        offset += self.frame_ids.nbytes
+        self.times = np.ndarray([self.nslots,self.nstages],
+                                buffer = self.shm.buf,
+                                offset = offset,
+                                dtype = np.float64)
+        offset += self.times.nbytes
+        # two banks of window seconds, the rolling histogram is their sum
+        self.rolling = np.ndarray([2,nintervals,nbins],
+                                  buffer = self.shm.buf,
+                                  offset = offset,
+                                  dtype = np.int64)
+        offset += self.rolling.nbytes
+        self.total = np.ndarray([nintervals,nbins],
+                                buffer = self.shm.buf,
+                                offset = offset,
+                                dtype = np.int64)
+        offset += self.total.nbytes
+        # totals when the run started
+        self.run_offset = np.ndarray([nintervals,nbins],
+                                     buffer = self.shm.buf,
+                                     offset = offset,
+                                     dtype = np.int64)
+        offset += self.run_offset.nbytes
+        self.epochs = np.ndarray([nintervals],
+                                 buffer = self.shm.buf,
+                                 offset = offset,
+                                 dtype = np.int64)
+        # intervals that end in each stage: stage -> [(interval, from stage)]
+        self._ending = dict([(s,[]) for s in range(self.nstages)])
+        for i,k in enumerate(self.intervals):
+            start,stop = LATENCY_INTERVALS[k]
+            self._ending[LATENCY_STAGES.index(stop)].append(
+                (i,LATENCY_STAGES.index(start)))
+
+    def __getstate__(self):
+        return dict(name = self.name,
+                    nslots = self.nslots,
+                    window = self.window,
+                    nstages = self.nstages,
+                    intervals = self.intervals,
+                    nbytes = self.nbytes)
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.shm = SharedMemory(name = self.name)
+        self._owner = False
+        self._attach()
+
+    def begin(self, frame_id, t = None):
+        '''Camera side; starts the row of a frame and stamps the grab.'''
+        if t is None:
+            t = time.perf_counter()
+        row = int(frame_id) % self.nslots
+        self.frame_ids[row] = -1
+        self.times[row] = np.nan
+        self.times[row,0] = t
+        self.frame_ids[row] = int(frame_id)
+
+    def stamp(self, frame_id, stage, t = None):
+        '''
+        Stamps a stage for one frame or an array of frames and adds the
+        latency of the intervals that end in that stage to the histograms.
+        Frames that are no longer in the table are skipped.
+        '''
+        if t is None:
+            t = time.perf_counter()
+        istage = LATENCY_STAGES.index(stage)
+        if np.isscalar(frame_id):
+            row = int(frame_id) % self.nslots
+            if not self.frame_ids[row] == frame_id:
+                return
+            self.times[row,istage] = t
+            for iinterval,istart in self._ending[istage]:
+                dt = t - self.times[row,istart]
+                if dt >= 0: # nan if the first stage was not stamped
+                    bank = self._rotate(iinterval,t)
+                    ibin = np.searchsorted(LATENCY_BINS,dt,side = 'right') - 1
+                    self.rolling[bank,iinterval,ibin] += 1
+                    self.total[iinterval,ibin] += 1
+            return
+        frame_id = np.asarray(frame_id,dtype = np.int64)
+        rows = frame_id % self.nslots
+        rows = rows[self.frame_ids[rows] == frame_id]
+        if not len(rows):
+            return
+        self.times[rows,istage] = t
+        for iinterval,istart in self._ending[istage]:
+            dt = t - self.times[rows,istart]
+            dt = dt[dt >= 0]
+            if not len(dt):
+                continue
+            bank = self._rotate(iinterval,t)
+            counts = np.bincount(np.searchsorted(LATENCY_BINS,dt,side = 'right') - 1,
+                                 minlength = len(LATENCY_BINS))
+            self.rolling[bank,iinterval] += counts
+            self.total[iinterval] += counts
+
+    def _rotate(self, iinterval, t):
+        # clears the bank of an interval when its window starts
+        epoch = int(t // self.window)
+        last = self.epochs[iinterval]
+        if not epoch == last:
+            if epoch - last == 1:
+                self.rolling[epoch % 2,iinterval] = 0
+            else:
+                self.rolling[:,iinterval] = 0
+            self.epochs[iinterval] = epoch
+        return epoch % 2
+
+    def histogram(self, interval, rolling = True):
+        '''Counts per bin (LATENCY_BINS) for the last window seconds or for the run.'''
+        i = self.intervals.index(interval)
+        if not rolling:
+            return self.total[i] - self.run_offset[i]
+        last = int(self.epochs[i])
+        age = int(time.perf_counter() // self.window) - last
+        if age > 1:
+            return np.zeros(len(LATENCY_BINS),dtype = np.int64)
+        if age == 1:
+            return self.rolling[last % 2,i].copy()
+        return self.rolling[:,i].sum(axis = 0)
+
+    def summary(self, rolling = True):
+        '''Percentiles (s) of each interval: {interval: dict(count,p50,p90,p99,max)}'''
+        return dict([(k,histogram_percentiles(self.histogram(k,rolling)))
+                     for k in self.intervals])
+
+    def reset(self):
+        '''Starts new run histograms (only takes a snapshot of the totals, does not write them).'''
+        self.run_offset[:] = self.total
+
+    def dump(self, filename, **kwargs):
+        '''
+        Writes the run histograms to a JSON file (percentiles in seconds and
+        the non-empty bins as [highest value, count]); kwargs are added to the header.
+        '''
+        intervals = dict()
+        for k in self.intervals:
+            counts = self.histogram(k,rolling = False)
+            ibins = np.nonzero(counts)[0]
+            intervals[k] = dict(histogram_percentiles(counts),
+                                stages = LATENCY_INTERVALS[k],
+                                bins = [[float(LATENCY_BIN_VALUES[i]),int(counts[i])]
+                                        for i in ibins])
+        with open(filename,'w') as fd:
+            json.dump(dict(kwargs,
+                           units = 's',
+                           intervals = intervals),fd,indent = 1)
+        return intervals
+
+    def close(self):
+        del self.frame_ids
+        del self.times
+        del self.rolling
+        del self.total
+        del self.run_offset
+        del self.epochs
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
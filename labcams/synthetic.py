@@ -0,0 +1,165 @@
+#  labcams - https://jpcouto@bitbucket.org/jpcouto/labcams.git
+# Copyright (C) 2020 Joao Couto - jpcouto@gmail.com
+#
+#  This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Synthetic camera to test acquisition and recording without hardware.
+from .cams import *
+
+SYNTHETIC_PATTERNS = ['noise','moving','constant']
+
+class SyntheticCam(GenericCam):
+    def __init__(self,
+                 cam_id = 0,
+                 name = '',
+                 start_trigger = None,
+                 stop_trigger = None,
+                 save_trigger = None,
+                 out_q = None,
+                 frame_rate = 30.,
+                 height = 480,
+                 width = 640,
+                 nchannels = 1,
+                 dtype = 'uint8',
+                 pattern = 'noise',
+                 value = 128,
+                 speed = 4,
+                 drop_every = 0,
+                 stamp_frame_id = False,
+                 recorderpar = None,
+                 **kwargs):
+        '''
+        Generates frames at a target rate (frame_rate = 0 runs as fast as possible).
+
+        pattern is 'noise', 'moving' (a grating that moves speed pixels per frame)
+        or 'constant' (all pixels at value).
+        drop_every skips a frame id every N frames, like a camera dropping frames.
+        stamp_frame_id writes the frame id (int64) in the first bytes of the frame.
+        '''
+        super(SyntheticCam,self).__init__(cam_id = cam_id,
+                                          name = name,
+                                          out_q = out_q,
+                                          start_trigger = start_trigger,
+                                          stop_trigger = stop_trigger,
+                                          save_trigger = save_trigger,
+                                          recorderpar = recorderpar,
+                                          **kwargs)
+        self.drivername = 'synthetic'
+        if not pattern in SYNTHETIC_PATTERNS:
+            raise ValueError('[synthetic] Unknown pattern {0}, use one of {1}'.format(
+                pattern,SYNTHETIC_PATTERNS))
+        self.pattern = pattern
+        self.value = value
+        self.speed = int(speed)
+        self.drop_every = int(drop_every)
+        self.stamp_frame_id = stamp_frame_id
+        self.dtype = np.dtype(dtype)
+        self.h.value = int(height)
+        self.w.value = int(width)
+        self.nchan.value = int(nchannels)
+        self.frame_rate = float(frame_rate)
+        self.fs.value = self.frame_rate
+        self._init_variables(dtype = self.dtype)
+        display('[synthetic {0}] - {1} frames {2}x{3}x{4} {5} at {6} fps.'.format(
+            self.cam_id, self.pattern,
+            self.h.value, self.w.value, self.nchan.value,
+            self.dtype, self.frame_rate))
+
+    def _init_controls(self):
+        self.ctrevents = dict(
+            frame_rate=dict(
+                function = 'set_framerate',
+                widget = 'float',
+                variable = 'frame_rate',
+                units = 'fps',
+                type = 'float',
+                min = 0.0,
+                max = 100000,
+                step = 10))
+
+    def set_framerate(self,framerate = 30.):
+        self.frame_rate = float(framerate)
+        self.fs.value = self.frame_rate
+        if self.cam_is_running:
+            # keep the frame ids, restart the clock
+            self.tstart = time.perf_counter()
+            self.nclock = 0
+
+    def _make_frames(self):
+        shape = [self.h.value,self.w.value,self.nchan.value]
+        if np.issubdtype(self.dtype,np.integer):
+            vmax = np.iinfo(self.dtype).max
+        else:
+            vmax = 1.
+        if self.pattern == 'noise':
+            # a bank of frames, generating noise for every frame is slower than most cameras
+            rng = np.random.default_rng(self.cam_id)
+            frames = (rng.random([16] + shape)*vmax).astype(self.dtype)
+        elif self.pattern == 'moving':
+            # grating twice as wide as the frame, each frame is a slice
+            x = np.arange(2*self.w.value)
+            grating = (np.sin(2*np.pi*x/64.)+1)/2.*vmax
+            frames = np.broadcast_to(grating[None,:,None],
+                                     [self.h.value,2*self.w.value,self.nchan.value]).astype(self.dtype)
+        else:
+            frames = np.full([1] + shape,self.value,dtype = self.dtype)
+        return frames
+
+    def _cam_init(self):
+        self.frames = self._make_frames()
+        self.lastframeid = -1
+        self.nframes.value = 0
+        self.frame_id = 0
+        self.camera_ready.set()
+
+    def _cam_startacquisition(self):
+        display('[synthetic {0}] - Started acquisition.'.format(self.cam_id))
+        self.tstart = time.perf_counter()
+        self.nclock = 0
+
+    def _cam_stopacquisition(self):
+        pass
+
+    def _wait_next_frame(self):
+        if self.frame_rate <= 0:
+            return time.perf_counter()
+        tnext = self.tstart + self.nclock/self.frame_rate
+        dt = tnext - time.perf_counter()
+        if dt > 0.002:
+            time.sleep(dt - 0.002)
+        # spin the last ms for a precise rate
+        while time.perf_counter() < tnext:
+            pass
+        return tnext
+
+    def _cam_loop_into(self,dest):
+        timestamp = self._wait_next_frame()
+        self.nclock += 1
+        self.frame_id += 1
+        if self.drop_every > 0 and not np.mod(self.frame_id,self.drop_every):
+            self.frame_id += 1
+        self._frame_ready()
+        if self.pattern == 'moving':
+            offset = np.mod(self.frame_id*self.speed,self.w.value)
+            np.copyto(dest,self.frames[:,offset:offset + self.w.value])
+        else:
+            np.copyto(dest,self.frames[np.mod(self.frame_id,len(self.frames))])
+        if self.stamp_frame_id:
+            dest.reshape(-1).view(np.uint8)[:8] = np.frombuffer(
+                np.int64(self.frame_id).tobytes(),dtype = np.uint8)
+        linestat = np.mod(self.frame_id,2) # fake sync line
+        return dest,(self.frame_id,timestamp,linestat)
+
+    def _cam_close(self):
+        display('[synthetic {0}] - Stopped acquisition.'.format(self.cam_id))
@@ -34,7 +34,7 @@ MAX_QUEUE_SIZE = 1500
 
 tstart = [time.time()]
 
-from multiprocessing import Array
+from multiprocessing import Array, Condition, RawValue, RawArray, Lock
 from ctypes import c_wchar
 shared_date = Array(c_wchar,datetime.now().strftime('%Y%m%d_%H%M%S'))
 
@@ -49,6 +49,238 @@ def display(msg):
         pass
 
 
+class TriggerEvent(object):
+    def __init__(self, condition = None):
+        '''
+        Drop-in for multiprocessing.Event used for the start, stop, save and close triggers.
+
+        Events created with the same condition can be waited on together (wait_any),
+        so a process sleeps until any of them changes instead of polling.
+        is_set() does not take a lock, it is called for every frame.
+        The time of the last set() is kept to measure the trigger latency.
+
+        start = TriggerEvent()
+        stop = TriggerEvent(start.condition)
+        wait_any([start,stop], timeout = 1)
+        '''
+        if condition is None:
+            condition = Condition()
+        self.condition = condition
+        self._flag = RawValue('b',0)
+        self._tset = RawValue('d',np.nan)
+
+    def is_set(self):
+        return bool(self._flag.value)
+
+    @property
+    def time_set(self):
+        '''time.time() of the last set (nan if it was never set).'''
+        return self._tset.value
+
+    def set(self):
+        with self.condition:
+            if not self._flag.value:
+                self._tset.value = time.time()
+            self._flag.value = 1
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self._flag.value = 0
+            self.condition.notify_all()
+
+    def wait(self, timeout = None):
+        with self.condition:
+            return self.condition.wait_for(self.is_set, timeout)
+
+def wait_any(events, timeout = None):
+    '''
+    Waits until one of the events is set or until any of them is set or cleared.
+    The events must be TriggerEvents sharing a condition, otherwise
+    this falls back to polling once with a 1 ms sleep.
+    Returns True if one of the events is set.
+    '''
+    conditions = set([id(getattr(e,'condition',None)) for e in events])
+    if len(conditions) == 1 and hasattr(events[0],'condition'):
+        with events[0].condition:
+            if not any([e.is_set() for e in events]):
+                events[0].condition.wait(timeout)
+    else:
+        time.sleep(0.001)
+    return any([e.is_set() for e in events])
+
+
+# types of the camera controls (the 'type' in ctrevents)
+PARAMETER_TYPES = dict(float = float,
+                       int = int)
+
+class ParameterBlock(object):
+    def __init__(self, names):
+        '''
+        Camera parameters in shared memory with a generation counter.
+
+        The GUI (or server) sets values, the camera process compares the
+        generation once per frame and only looks at the parameters when it changed.
+        touch() bumps the generation without changing a value (to signal commands).
+
+        params = ParameterBlock(['exposure','gain'])
+        params.set('exposure',10)                    # any process
+        generation,changed = params.changed(since)   # camera process
+        '''
+        self.names = list(names)
+        self._index = dict([(n,i) for i,n in enumerate(self.names)])
+        self._values = RawArray('d',max(len(self.names),1))
+        # the first is the generation of the block, then one per parameter
+        self._generations = RawArray('q',len(self.names)+1)
+        self._lock = Lock() # between setters only
+
+    @property
+    def generation(self):
+        return self._generations[0]
+
+    def set(self, name, value):
+        if not name in self._index.keys():
+            raise KeyError('Unknown parameter {0}.'.format(name))
+        i = self._index[name]
+        with self._lock:
+            self._values[i] = float(value)
+            self._generations[i+1] = self._generations[0] + 1
+            self._generations[0] += 1
+
+    def get(self, name):
+        return self._values[self._index[name]]
+
+    def touch(self):
+        with self._lock:
+            self._generations[0] += 1
+
+    def changed(self, since):
+        '''Returns the current generation and the (name,value) pairs set after generation since.'''
+        generation = self._generations[0]
+        changed = [(n,self._values[i]) for i,n in enumerate(self.names)
+                   if self._generations[i+1] > since]
+        return generation,changed
+
+
+# process priorities: posix nice value and windows priority class
+PROCESS_PRIORITIES = dict(normal = (0,'NORMAL_PRIORITY_CLASS'),
+                          high = (-10,'HIGH_PRIORITY_CLASS'),
+                          realtime = (None,'REALTIME_PRIORITY_CLASS'))
+REALTIME_PRIORITY = 10 # SCHED_FIFO priority, low so the kernel threads still run
+
+def _process_threads(pid):
+    # the threads of a process (linux), so child processes can be pinned after they started
+    try:
+        return [int(t) for t in os.listdir('/proc/{0}/task'.format(pid))]
+    except OSError:
+        return [pid]
+
+def set_process_priority(affinity = None, priority = None, pid = 0, name = ''):
+    '''
+    Pins a process to CPUs and sets its scheduling priority.
+
+    Inputs:
+        affinity (list)      : CPU indices (None leaves it as it is)
+        priority (str|int)   : 'normal', 'high', 'realtime' or a nice value
+        pid (int)            : process id, 0 for the calling process (and the threads it starts)
+        name (str)           : for the messages
+
+    Uses os.sched_setaffinity/sched_setscheduler/setpriority on linux and psutil
+    on other systems. High and realtime priorities usually need admin rights,
+    failures are reported and ignored.
+    '''
+    tasks = [pid] if pid == 0 else _process_threads(pid)
+    if not affinity is None and len(affinity):
+        affinity = [int(a) for a in affinity]
+        try:
+            if hasattr(os,'sched_setaffinity'):
+                for t in tasks:
+                    os.sched_setaffinity(t,affinity)
+            else:
+                import psutil
+                psutil.Process(pid if pid else os.getpid()).cpu_affinity(affinity)
+            display('[{0}] - running on CPUs {1}.'.format(name,affinity))
+        except Exception as err:
+            display('[{0}] - could not set the CPU affinity to {1}: {2}'.format(name,affinity,err))
+    if not priority is None:
+        try:
+            if type(priority) is str:
+                nice,pclass = PROCESS_PRIORITIES[priority.lower()]
+            else:
+                nice,pclass = int(priority),('HIGH_PRIORITY_CLASS' if int(priority) < 0
+                                             else 'NORMAL_PRIORITY_CLASS')
+            if hasattr(os,'sched_setscheduler') and nice is None:
+                for t in tasks:
+                    os.sched_setscheduler(t,os.SCHED_FIFO,os.sched_param(REALTIME_PRIORITY))
+            elif hasattr(os,'setpriority'):
+                for t in tasks:
+                    os.setpriority(os.PRIO_PROCESS,t,-20 if nice is None else nice)
+            else:
+                import psutil
+                psutil.Process(pid if pid else os.getpid()).nice(getattr(psutil,pclass))
+            display('[{0}] - running with {1} priority.'.format(name,priority))
+        except Exception as err:
+            display('[{0}] - could not set the priority to {1}: {2}'.format(name,priority,err))
+
+def default_cpu_placement(ncams, ncpus = None, camera_cpus = 2):
+    '''
+    CPUs for the processes of ncams cameras: camera_cpus cores for each camera process
+    (the grab loop and the threads of the driver, counting down from the last core,
+    the first is busy with the system) and the other cores for the writers and encoders.
+    Returns a list of (camera CPUs, writer CPUs), None when there are not
+    enough cores (ncams*camera_cpus + 2) to keep them apart.
+    '''
+    if ncpus is None:
+        ncpus = os.cpu_count()
+    if ncams < 1 or ncpus is None or ncpus < ncams*camera_cpus + 2:
+        return None
+    writers = list(range(ncpus - ncams*camera_cpus))
+    return [(list(range(ncpus - (i + 1)*camera_cpus,ncpus - i*camera_cpus)),writers)
+            for i in range(ncams)]
+
+# camera stats exported as metrics (see Camera.get_stats): name, type, help
+PROMETHEUS_METRICS = [
+    ('saving','gauge','1 if the camera is recording.'),
+    ('frames_acquired','counter','Frames acquired by the camera.'),
+    ('acquisition_fps','gauge','Frames per second acquired by the camera.'),
+    ('frames_written','counter','Frames saved by the writer.'),
+    ('writer_fps','gauge','Frames per second saved by the writer.'),
+    ('bytes_written','counter','Bytes of the frames handed to the writer.'),
+    ('write_seconds','counter','Seconds the writer spent in blocking writes to disk.'),
+    ('ring_frames','gauge','Number of frames in the camera ring.'),
+    ('ring_occupancy','gauge','Fraction of the ring waiting for the writer.'),
+    ('queue_depth','gauge','Frames on the writer queue.'),
+    ('dropped','counter','Frames that did not fit in the writer queue.'),
+    ('overruns','gauge','Frames overwritten in the ring before saving (this run).'),
+    ('disk_free','gauge','Bytes free on the disk of the data folder.')]
+
+def prometheus_metrics(camstats, prefix = 'labcams'):
+    '''
+    Formats a list of camera stats (Camera.get_stats) in the Prometheus text format.
+    Values that are not known (None) are left out.
+    '''
+    lines = []
+    for name,mtype,mhelp in PROMETHEUS_METRICS:
+        values = [(c['camera'],c.get(name)) for c in camstats if not c.get(name) is None]
+        if not len(values):
+            continue
+        lines.append('# HELP {0}_{1} {2}'.format(prefix,name,mhelp))
+        lines.append('# TYPE {0}_{1} {2}'.format(prefix,name,mtype))
+        for camera,value in values:
+            camera = str(camera).replace('\\','\\\\').replace('"','\\"')
+            lines.append('{0}_{1}{{camera="{2}"}} {3}'.format(prefix,name,camera,float(value)))
+    return '\n'.join(lines) + '\n'
+
+def write_metrics_file(filename, text):
+    '''Replaces a metrics file in one go, so readers never see it half written.'''
+    folder = os.path.dirname(filename)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    tmpname = filename + '.tmp'
+    with open(tmpname,'w') as fd:
+        fd.write(text)
+    os.replace(tmpname,filename)
+
 preferencepath = pjoin(os.path.expanduser('~'), 'labcams')
 
 # This has the cameras and properties
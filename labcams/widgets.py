@@ -38,6 +38,7 @@ from PyQt5.QtWidgets import (QWidget,
                              QGraphicsLineItem,
                              QGroupBox,
                              QTableWidget,
+                             QTableWidgetItem,
                              QMainWindow,
                              QDockWidget,
                              QFileDialog,
@@ -412,7 +413,7 @@ class CamWidget(QWidget):
             self.ctract = dict()
             def vchanged(the):
                 val = the['action'].value()
-                self.cam.cam.eventsQ.put(the['name']+'='+str(val))
+                self.cam.cam.set_parameter(the['name'],val)
 
             for k in  self.cam.cam.ctrevents.keys():
                 self.ctract[k] = dict(**self.cam.cam.ctrevents[k])
@@ -765,7 +766,14 @@ class CamWidget(QWidget):
                 else:
                     frame = self.eyeTracker.img
 
-            self.text.setText(self.string.format(nframe))
+            txt = self.string.format(nframe)
+            lag = self.cam.get_writer_lag()
+            if not lag is None and (lag['frames_behind'] > 1 or lag['overruns']):
+                txt += ' - writer {0} frames ({1:.2f} s) behind'.format(
+                    lag['frames_behind'],lag['seconds_behind'])
+                if lag['overruns']:
+                    txt += ', {0} overruns'.format(lag['overruns'])
+            self.text.setText(txt)
             if not self.displaychannel == -1 and len(frame.shape) > 2:
                 frame = frame[:,:,self.displaychannel]
 
@@ -783,6 +791,8 @@ class CamWidget(QWidget):
                 im = np.stack([ref/np.max(ref),frame/np.max(frame),np.zeros_like(frame)]).transpose([1,2,0])
                 self.view.setImage(im,autoDownsample=True)
             self.lastnFrame = nframe
+            if not getattr(self.cam,'stats',None) is None:
+                self.cam.stats.stamp(nframe,'display')
 
 
 class ROIPlotWidget(QWidget):
@@ -1142,3 +1152,48 @@ class DAQPlotWidget(QWidget):
                 Y = Y.astype('float32')/32767
             plot.setData(x = np.arange(0,self.N),
                          y = Y*0.7 + i)
+
+class LatencyWidget(QWidget):
+    def __init__(self, cams, refresh_period = 1000):
+        '''
+        Table with the per-stage frame latency of the cameras that have
+        latency_stats on (percentiles of the last latency_window seconds).
+        '''
+        super(LatencyWidget,self).__init__()
+        from .stats import LATENCY_INTERVALS
+        self.cams = [c for c in cams if not getattr(c,'stats',None) is None]
+        self.intervals = list(LATENCY_INTERVALS.keys())
+        layout = QGridLayout()
+        self.setLayout(layout)
+        self.columns = ['count','p50','p90','p99','max']
+        self.table = QTableWidget(len(self.cams)*len(self.intervals),len(self.columns))
+        self.table.setHorizontalHeaderLabels(['frames','p50 (ms)','p90 (ms)','p99 (ms)','max (ms)'])
+        labels = []
+        for cam in self.cams:
+            for k in self.intervals:
+                labels.append('{0} {1} ({2}-{3})'.format(cam.name,k,*LATENCY_INTERVALS[k]))
+        self.table.setVerticalHeaderLabels(labels)
+        layout.addWidget(self.table,0,0)
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update)
+        self.timer.start(refresh_period)
+        self.update()
+
+    def update(self):
+        irow = 0
+        for cam in self.cams:
+            summary = cam.stats.summary()
+            for k in self.intervals:
+                for icol,c in enumerate(self.columns):
+                    if c == 'count':
+                        txt = '{0}'.format(summary[k][c])
+                    elif np.isnan(summary[k][c]):
+                        txt = '-'
+                    else:
+                        txt = '{0:.2f}'.format(summary[k][c]*1000)
+                    self.table.setItem(irow,icol,QTableWidgetItem(txt))
+                irow += 1
+
+    def closeEvent(self,ev):
+        self.timer.stop()
+        ev.accept()
@@ -38,7 +38,8 @@ class XimeaCam(GenericCam):
                                       start_trigger = None,
                                       stop_trigger = None,
                                       save_trigger = None,
-                                      recorderpar = recorderpar)
+                                      recorderpar = recorderpar,
+                                      **kwargs)
         self.drivername = 'Ximea'
         self.hardware_trigger = hardware_trigger
         if self.hardware_trigger is None:
@@ -89,11 +90,9 @@ class XimeaCam(GenericCam):
         self.exposure = exposure
         self.frame_rate = 1000./float(self.exposure)
         self.fs.value = self.frame_rate
-
         if not self.cam is None:
-            if self.cam_is_running:
-                self.start_trigger.set()
-                self.stop_trigger.set()
+            # the exposure can be changed during acquisition
+            self.cam.set_exposure(self.exposure)
 
     def _cam_init(self,set_gpio=True):
         self.cam = xiapi.Camera()
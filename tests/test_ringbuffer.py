@@ -0,0 +1,51 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from labcams.ringbuffer import FrameRing, IndexQueue, ring_layout
+
+@pytest.fixture
+def ring():
+    shape,dtype = (4,6,1),np.uint16
+    nbytes = 8*4096
+    return FrameRing(bytearray(nbytes),nbytes,shape,dtype)
+
+@pytest.mark.parametrize('timestamp',[123456789012345678,          # hardware ticks
+                                      np.uint64(2**60 + 1),
+                                      datetime(2020,5,1,10,0,0,123456), # pco
+                                      1.5e9 + 0.25,
+                                      None])
+def test_metadata_keeps_driver_timestamps(ring,timestamp):
+    frame = np.arange(24,dtype = np.uint16).reshape(4,6)
+    ring.write(frame,(3,timestamp,1))
+    frameid,ts,linestat = ring.metadata_tuple(ring.read_metadata(3))
+    assert (frameid,linestat) == (3,1)
+    assert type(ts) == type(timestamp if not isinstance(timestamp,np.integer) else 0)
+    assert '{0}'.format(ts) == '{0}'.format(timestamp)
+    assert np.array_equal(ring.read(3)[:,:,0],frame)
+
+def test_torn_read(ring):
+    frame = np.full((4,6),7,dtype = np.uint16)
+    ring.write(frame,(1,0.1))
+    idx,dest = ring.begin_write(1 + ring.nbuffers) # the camera laps the slot
+    dest[:2] = 9
+    assert ring.read(1,retries = 3) is None   # half written
+    assert ring.read_metadata(1,retries = 3) is None
+    ring.end_write(idx,(1 + ring.nbuffers,0.2))
+    assert np.all(ring.read(1 + ring.nbuffers)[:2] == 9)
+    assert ring.read_metadata(1)['frame_id'] == 1 + ring.nbuffers # not frame 1 anymore
+
+def test_index_queue_drops_when_full_and_wraps():
+    q = IndexQueue(capacity = 4)
+    try:
+        assert all([q.put(i) for i in range(4)])
+        assert not q.put(4) # full, dropped and counted
+        assert q.dropped == 1
+        assert q.get_all(maxitems = 3).tolist() == [0,1,2]
+        for i in range(5,8): # wraps around the slots
+            assert q.put(i)
+        assert q.qsize() == 4
+        assert q.get_all().tolist() == [3,5,6,7]
+        assert q.empty() and (q.head,q.tail) == (7,7)
+        assert not q.wait(timeout = 0.01)
+    finally:
+        q.close()
@@ -0,0 +1,26 @@
+import os
+import numpy as np
+import pytest
+from tifffile import imread
+from labcams.io import TiffCamWriter
+
+@pytest.mark.parametrize('dtype',[np.uint8,np.uint16])
+@pytest.mark.parametrize('compression',[None,6])
+def test_tiffcamwriter_single_channel(tmp_path,dtype,compression):
+    # the drivers pass (H,W,1) views of the ring to the inline writer
+    writer = TiffCamWriter(None,
+                           datafolder = str(tmp_path),
+                           filename = 'run',
+                           pathformat = os.path.join('{datafolder}','{filename}','{run}_{nfiles}'),
+                           framesperfile = 0,
+                           compression = compression)
+    frames = np.random.randint(0,np.iinfo(dtype).max,(5,24,32,1)).astype(dtype)
+    for i,frame in enumerate(frames):
+        writer.save(frame,(i,float(i)/100.))
+    writer.close_file()
+    writer.logfile.close()
+    tifs = [os.path.join(r,f) for r,d,fs in os.walk(str(tmp_path)) for f in fs if f.endswith('.tif')]
+    assert len(tifs) == 1
+    data = imread(tifs[0])
+    assert data.dtype == dtype
+    assert np.array_equal(data,frames[...,0])
@@ -0,0 +1,97 @@
+import os
+import queue
+from multiprocessing import Value
+import numpy as np
+import pytest
+from labcams.io import BinaryWriter, BinaryStack, FrameIndex, parseCamLog
+from labcams.ringbuffer import FrameRing, IndexQueue, ring_nbytes
+
+H,W = 8,10
+
+@pytest.fixture
+def writer(tmp_path):
+    # a ring writer without the camera process, the test plays the camera
+    writer = BinaryWriter(None,
+                          datafolder = str(tmp_path),
+                          filename = 'run',
+                          dataname = 'cam',
+                          pathformat = os.path.join('{datafolder}','{filename}','{run}_{nfiles}'),
+                          framesperfile = 4)
+    nbytes = ring_nbytes(8,(H,W,1),np.uint16)
+    writer.ring = FrameRing(bytearray(nbytes),nbytes,(H,W,1),np.uint16)
+    writer.nbuffers = writer.ring.nbuffers
+    writer.imgs = writer.ring.imgs
+    writer.h,writer.w = Value('i',H),Value('i',W)
+    writer.virtual_channels.value = 1
+    writer.cam = dict(nframes = Value('i',-1))
+    writer.frameQ = IndexQueue(16)
+    yield writer
+    writer.frameQ.close()
+
+def _grab(writer,frame_id):
+    frame = np.full((H,W),frame_id,dtype = np.uint16)
+    writer.ring.write(frame,(frame_id,frame_id*1000,0))
+    writer.cam['nframes'].value = frame_id
+    writer.frameQ.put(frame_id)
+
+def _camlog(tmp_path):
+    return [os.path.join(r,f) for r,d,fs in os.walk(str(tmp_path))
+            for f in fs if f.endswith('.camlog')][0]
+
+def test_overrun_is_recorded_in_the_camlog(tmp_path,writer):
+    for i in range(1,11): # the camera laps the writer, frames 1 and 2 are gone
+        _grab(writer,i)
+    writer.get_from_index_queue_and_save()
+    writer.close_run()
+    log,comments = parseCamLog(_camlog(tmp_path))
+    assert log.frame_id.tolist() == list(range(3,11))
+    assert log.timestamp.tolist() == [i*1000 for i in range(3,11)]
+    assert ['#OVERRUN:1,0','#OVERRUN:2,0'] == [c for c in comments if c.startswith('#OVERRUN')]
+    assert writer.overruns.value == 2
+
+def test_frames_are_read_across_files(tmp_path,writer):
+    for i in range(1,7):
+        _grab(writer,i)
+    writer.get_from_index_queue_and_save()
+    for i in range(7,11):
+        _grab(writer,i)
+    writer.get_from_index_queue_and_save() # wraps around the ring
+    writer.close_run()
+    camlog = _camlog(tmp_path)
+    stack = BinaryStack(camlog)
+    assert len(stack.filenames) == 3 # 4 frames per file
+    assert stack.shape[0] == 10
+    assert [int(f[0,0,0]) for f in stack[2:9]] == list(range(3,10))
+    index = FrameIndex(camlog)
+    assert np.array_equal(index.records['frame_id'],np.arange(1,11))
+    frames = index.get_frames([4,5])
+    assert [int(f.reshape(-1)[0]) for f in frames] == [4,5]
+
+def test_camlog_cache(tmp_path,writer):
+    for i in range(1,6):
+        _grab(writer,i)
+    writer.get_from_index_queue_and_save()
+    writer.close_run()
+    camlog = _camlog(tmp_path)
+    log,comments = parseCamLog(camlog,cache = True)
+    assert os.path.isfile(camlog + '.npz')
+    cached,cachedcomments = parseCamLog(camlog,cache = True)
+    assert cached.equals(log) and cachedcomments == comments
+    with open(camlog,'a') as fd: # the cache is stale once the camlog changes
+        fd.write('# appended\n')
+    assert parseCamLog(camlog,cache = True)[1][-1] == '# appended'
+
+def test_messages_are_saved_in_order_with_the_frames(tmp_path,writer):
+    writer.inQ = queue.Queue()
+    for i in range(1,4):
+        _grab(writer,i)
+        writer.inQ.put(dict(msg = ['# after {0}'.format(i)],frames = writer.frameQ.head))
+    writer.inQ.put(dict(msg = ['STOP'],frames = writer.frameQ.head))
+    _grab(writer,4) # next run
+    writer.save_queued()
+    assert writer._stopped and writer.frameQ.qsize() == 1
+    writer.close_run()
+    with open(_camlog(tmp_path),'r') as fd:
+        lines = [l.strip() for l in fd if not l.startswith('# [')]
+    lines = lines[lines.index('1,1000,0'):]
+    assert lines == ['1,1000,0','# after 1','2,2000,0','# after 2','3,3000,0','# after 3']